@@ -152,6 +152,18 @@ def parse_args():
     split_bam = add_global_args(subparsers.add_parser("split_wgs_bam"))
     split_bam.set_defaults(which='split_wgs_bam')
 
+    # ===========
+    # plan regions
+    # ===========
+    plan_regions = add_global_args(subparsers.add_parser("plan_regions"))
+    plan_regions.set_defaults(which='plan_regions')
+    plan_regions.add_argument(
+        "--num_regions",
+        required=True,
+        type=int,
+        help='''target number of regions, balanced by the reads in the normal and cell bams'''
+    )
+
     # ================
     # variant calling
     # ================
@@ -72,6 +72,10 @@ def get_hmmcopy_params(reference_dir, reference, binsize, smoothing_function):
         'ref_genome': referencedata['ref_genome'],
         'igv_segs_quality_threshold': 0.75,
         'memory': {'med': 6},
+        'max_cores': 8,
+        'cells_per_job': 1,
+        'hmmcopy_engine': 'rscript',
+        'intermediate_format': 'csv',
         'good_cells': [
             ['median_hmmcopy_reads_per_bin', 'ge', 50],
             ['is_contaminated', 'in', ['False', 'false', False]],
@@ -90,6 +94,10 @@ def get_align_params(reference_dir, reference):
         'memory': {'med': 6},
         'adapter': 'CTGTCTCTTATACACATCTCCGAGCCCACGAGAC',
         'adapter2': 'CTGTCTCTTATACACATCTGACGCTGCCGACGA',
+        'max_cores': 1,
+        'max_parallel_lanes': 2,
+        'streaming_alignment': False,
+        'combined_bam_metrics': False,
         'picard_wgs_params': {
             "min_bqual": 20,
             "min_mqual": 20,
@@ -177,8 +185,11 @@ def get_merge_bams_params(reference_dir, reference, cluster):
         'max_cores': 8,
         'ref_genome': referencedata['ref_genome'],
         'split_size': 10000000,
+        'regions_file': None,
         'chromosomes': referencedata['chromosomes'],
-        'one_split_job': one_split_job
+        'one_split_job': one_split_job,
+        'native_merge': False,
+        'max_open_files': 500,
     }
     return {'merge_bams': params}
 
@@ -191,8 +202,10 @@ def get_split_bam_params(reference_dir, reference):
         'max_cores': 8,
         'ref_genome': referencedata['ref_genome'],
         'split_size': 10000000,
+        'regions_file': None,
         'chromosomes': referencedata['chromosomes'],
-        'one_split_job': True
+        'one_split_job': True,
+        'native_split': False,
     }
 
     return {'split_bam': params}
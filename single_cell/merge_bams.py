@@ -31,16 +31,26 @@ def merge_bams_workflow(args):
         value=list(bam_files.keys()),
     )
 
-    workflow.transform(
-        name="get_regions",
-        func="single_cell.utils.pysamutils.get_regions_from_reference",
-        ret=pypeliner.managed.OutputChunks('region'),
-        args=(
-            config["ref_genome"],
-            config["split_size"],
-            config["chromosomes"],
+    if config['regions_file']:
+        workflow.transform(
+            name="get_regions",
+            func="single_cell.utils.pysamutils.load_regions",
+            ret=pypeliner.managed.OutputChunks('region'),
+            args=(
+                mgd.InputFile(config['regions_file']),
+            )
+        )
+    else:
+        workflow.transform(
+            name="get_regions",
+            func="single_cell.utils.pysamutils.get_regions_from_reference",
+            ret=pypeliner.managed.OutputChunks('region'),
+            args=(
+                config["ref_genome"],
+                config["split_size"],
+                config["chromosomes"],
+            )
         )
-    )
 
     workflow.transform(
         name="remove_softclipped_reads",
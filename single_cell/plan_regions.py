@@ -0,0 +1,68 @@
+'''
+Created on Oct 18, 2026
+'''
+import os
+import sys
+
+import pypeliner
+import pypeliner.managed as mgd
+from single_cell.utils import inpututils
+
+
+def plan_regions_workflow(args):
+    config = inpututils.load_config(args)
+    config = config['split_bam']
+
+    normal_bam, cell_bams = inpututils.load_plan_regions_input(args['input_yaml'])
+
+    regions_file = args['output_prefix'] + 'regions.yaml'
+
+    meta_yaml = os.path.join(args["out_dir"], 'metadata.yaml')
+    input_yaml_blob = os.path.join(args["out_dir"], 'input.yaml')
+
+    workflow = pypeliner.workflow.Workflow()
+
+    workflow.setobj(
+        obj=mgd.OutputChunks('cell_id'),
+        value=list(cell_bams.keys()),
+    )
+
+    workflow.transform(
+        name="plan_regions",
+        ctx={'mem': config['memory']['low'], 'ncpus': 1},
+        func="single_cell.utils.pysamutils.write_balanced_regions",
+        args=(
+            mgd.InputFile(normal_bam, extensions=['.bai']),
+            mgd.InputFile('cell_bams', 'cell_id', fnames=cell_bams, extensions=['.bai'], axes_origin=[]),
+            config["ref_genome"],
+            args['num_regions'],
+            config["chromosomes"],
+            mgd.OutputFile(regions_file),
+        )
+    )
+
+    workflow.transform(
+        name='generate_meta_files_results',
+        func='single_cell.utils.helpers.generate_and_upload_metadata',
+        args=(
+            sys.argv[0:],
+            args['out_dir'],
+            [regions_file],
+            mgd.OutputFile(meta_yaml)
+        ),
+        kwargs={
+            'input_yaml_data': inpututils.load_yaml(args['input_yaml']),
+            'input_yaml': mgd.OutputFile(input_yaml_blob),
+            'metadata': {'type': 'wgs_regions'}
+        }
+    )
+
+    return workflow
+
+
+def plan_regions_pipeline(args):
+    pyp = pypeliner.app.Pypeline(config=args)
+
+    workflow = plan_regions_workflow(args)
+
+    pyp.run(workflow)
@@ -11,6 +11,7 @@ from single_cell.hmmcopy import hmmcopy_pipeline
 from single_cell.infer_haps import count_haps_pipeline
 from single_cell.infer_haps import infer_haps_pipeline
 from single_cell.merge_bams import merge_bams_pipeline
+from single_cell.plan_regions import plan_regions_pipeline
 from single_cell.sample_qc import sample_qc_pipeline
 from single_cell.snv_genotyping import snv_genotyping_pipeline
 from single_cell.split_bam import split_bam_pipeline
@@ -45,6 +46,9 @@ def main():
     if args["which"] == "split_wgs_bam":
         split_bam_pipeline(args)
 
+    if args["which"] == "plan_regions":
+        plan_regions_pipeline(args)
+
     if args["which"] == "variant_calling":
         variant_calling_pipeline(args)
 
@@ -33,11 +33,13 @@ def create_variant_counting_workflow(args):
     workflow.transform(
         name='merge_snvs_museq',
         func='single_cell.utils.vcfutils.merge_vcf',
+        ctx={'mem': config['memory']['med'], 'ncpus': config['max_cores']},
         args=(
             [mgd.InputFile(vcf_file, extensions=['.tbi','.csi']) for vcf_file in vcf_files],
             mgd.TempOutputFile('all.snv.vcf.gz', extensions=['.tbi', '.csi']),
             mgd.TempSpace("merge_vcf_temp")
         ),
+        kwargs={'ncores': config['max_cores']},
     )
 
     workflow.subworkflow(
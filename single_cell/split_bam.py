@@ -25,17 +25,28 @@ def split_bam_workflow(args):
 
     workflow = pypeliner.workflow.Workflow()
 
-    workflow.transform(
-        name="get_regions",
-        ctx={'mem': config['memory']['low'], 'ncpus': 1},
-        func="single_cell.utils.pysamutils.get_regions_from_reference",
-        ret=pypeliner.managed.OutputChunks('region'),
-        args=(
-            config["ref_genome"],
-            config["split_size"],
-            config["chromosomes"],
+    if config['regions_file']:
+        workflow.transform(
+            name="get_regions",
+            ctx={'mem': config['memory']['low'], 'ncpus': 1},
+            func="single_cell.utils.pysamutils.load_regions",
+            ret=pypeliner.managed.OutputChunks('region'),
+            args=(
+                mgd.InputFile(config['regions_file']),
+            )
+        )
+    else:
+        workflow.transform(
+            name="get_regions",
+            ctx={'mem': config['memory']['low'], 'ncpus': 1},
+            func="single_cell.utils.pysamutils.get_regions_from_reference",
+            ret=pypeliner.managed.OutputChunks('region'),
+            args=(
+                config["ref_genome"],
+                config["split_size"],
+                config["chromosomes"],
+            )
         )
-    )
 
     workflow.subworkflow(
         name="split_normal",
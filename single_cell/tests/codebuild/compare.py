@@ -58,7 +58,9 @@ def _load_hmmcopy_reads_data(readsfile):
         'cor_gc', 'copy'
     ]
 
-    reads = csvutils.read_csv_and_yaml(readsfile)
+    reads = csvutils.read_csv_and_yaml(
+        readsfile, columns=['cell_id', 'chr', 'start', 'end'] + keepcols
+    )
 
     reads = reads.set_index(['cell_id', 'chr', 'start', 'end'])
 
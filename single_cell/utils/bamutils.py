@@ -41,7 +41,7 @@ def produce_fastqc_report(fastq_filename, output_html, output_plots, temp_dir,):
 
 
 def bwa_mem_paired_end(fastq1, fastq2, output,
-                       reference, readgroup,
+                       reference, readgroup, threads=1
                        ):
     """
     run bwa aln on both fastq files,
@@ -51,18 +51,54 @@ def bwa_mem_paired_end(fastq1, fastq2, output,
     try:
         readgroup_literal = '"' + readgroup + '"'
         pypeliner.commandline.execute(
-            'bwa', 'mem', '-C', '-M', '-R', readgroup_literal,
+            'bwa', 'mem', '-C', '-M', '-t', threads, '-R', readgroup_literal,
             reference, fastq1, fastq2,
             '>', output,
             )
     except pypeliner.commandline.CommandLineException:
         pypeliner.commandline.execute(
-            'bwa', 'mem', '-C', '-M', '-R', readgroup,
+            'bwa', 'mem', '-C', '-M', '-t', threads, '-R', readgroup,
             reference, fastq1, fastq2,
             '>', output,
             )
 
 
+def bwa_mem_to_sorted_bam(fastq1, fastq2, output, reference, readgroup,
+                          tempdir, threads=1
+                          ):
+    """
+    pipe bwa mem into samtools sort, the alignments are never written
+    as sam or unsorted bam. output is coordinate sorted and indexed
+    """
+    makedirs(tempdir)
+
+    sort_cmd = [
+        'samtools', 'sort', '-@', threads, '-T',
+        os.path.join(tempdir, 'sort'), '-o', output, '-'
+    ]
+
+    try:
+        readgroup_literal = '"' + readgroup + '"'
+        pypeliner.commandline.execute(
+            'bwa', 'mem', '-C', '-M', '-t', threads, '-R', readgroup_literal,
+            reference, fastq1, fastq2, '|', *sort_cmd
+            )
+    except pypeliner.commandline.CommandLineException:
+        pypeliner.commandline.execute(
+            'bwa', 'mem', '-C', '-M', '-t', threads, '-R', readgroup,
+            reference, fastq1, fastq2, '|', *sort_cmd
+            )
+
+    bam_index(output, output + '.bai')
+
+
+def is_coordinate_sorted(bam):
+    with pysam.AlignmentFile(bam, 'rb', check_sq=False) as reader:
+        header = reader.header.to_dict()
+
+    return header.get('HD', {}).get('SO') == 'coordinate'
+
+
 def samtools_sam_to_bam(samfile, bamfile,
                         ):
     pypeliner.commandline.execute(
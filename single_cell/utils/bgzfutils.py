@@ -0,0 +1,122 @@
+'''
+Created on Oct 18, 2026
+'''
+import collections
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# largest payload that is guaranteed to fit in a 64kb block, same as htslib
+BLOCK_SIZE = 0xff00
+
+# empty block that marks the end of a bgzf file
+BGZF_EOF = bytes(bytearray([
+    0x1f, 0x8b, 0x08, 0x04, 0x00, 0x00, 0x00, 0x00, 0x00, 0xff, 0x06, 0x00,
+    0x42, 0x43, 0x02, 0x00, 0x1b, 0x00, 0x03, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x00, 0x00, 0x00, 0x00
+]))
+
+
+def compress_block(data, level):
+    """
+    compress data into a single bgzf block, each block is a gzip member with
+    the BC extra subfield holding the total block size - 1
+
+    :param data: at most BLOCK_SIZE bytes
+    :param level: zlib compression level
+    :returns bytes of the bgzf block
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+
+    header = struct.pack(
+        '<4BI2BH2BHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2,
+        len(deflated) + 25
+    )
+    trailer = struct.pack('<2I', zlib.crc32(data) & 0xffffffff, len(data))
+
+    return header + deflated + trailer
+
+
+class BgzfWriter(object):
+    """
+    text mode writer for bgzf compressed files. blocks are compressed in a
+    thread pool and written in order, the output is a regular multi member
+    gzip file.
+    """
+
+    def __init__(self, filepath, mode='wt', threads=1, level=6):
+        """
+        :param filepath: output file
+        :param mode: wt to overwrite or at to append
+        :param threads: number of compression threads
+        :param level: zlib compression level
+        """
+        assert mode in ['w', 'wt', 'a', 'at']
+
+        self.filepath = filepath
+        self.threads = threads
+        self.level = level
+
+        self.writer = open(filepath, mode[0] + 'b')
+
+        self.buffer = bytearray()
+
+        self.pool = None
+        self.pending = collections.deque()
+        if threads > 1:
+            self.pool = ThreadPoolExecutor(max_workers=threads)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_pending(self, max_pending):
+        while len(self.pending) > max_pending:
+            self.writer.write(self.pending.popleft().result())
+
+    def compress(self, data):
+        if not self.pool:
+            self.writer.write(compress_block(data, self.level))
+            return
+
+        self.pending.append(self.pool.submit(compress_block, data, self.level))
+
+        # bound memory to a few blocks per thread
+        self.write_pending(self.threads * 4)
+
+    def flush_buffer(self, final=False):
+        offset = 0
+        while len(self.buffer) - offset >= BLOCK_SIZE:
+            self.compress(bytes(self.buffer[offset:offset + BLOCK_SIZE]))
+            offset += BLOCK_SIZE
+
+        if final and len(self.buffer) > offset:
+            self.compress(bytes(self.buffer[offset:]))
+            offset = len(self.buffer)
+
+        del self.buffer[:offset]
+
+    def write(self, text):
+        if isinstance(text, str):
+            text = text.encode('utf-8')
+
+        self.buffer.extend(text)
+
+        if len(self.buffer) >= BLOCK_SIZE:
+            self.flush_buffer()
+
+    def close(self):
+        if self.writer.closed:
+            return
+
+        self.flush_buffer(final=True)
+        self.write_pending(0)
+
+        if self.pool:
+            self.pool.shutdown()
+
+        self.writer.write(BGZF_EOF)
+        self.writer.close()
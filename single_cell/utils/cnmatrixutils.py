@@ -0,0 +1,230 @@
+'''
+Created on Oct 18, 2026
+
+cell by bin matrices of hmmcopy reads data. every column is stored as
+compressed chunks of cells in a npz archive along with the bin and cell
+indexes, so readers only decompress the columns and cells they need.
+'''
+import numpy as np
+import pandas as pd
+from single_cell.utils import csvutils
+
+MATRIX_COLUMNS = ['state', 'copy', 'reads', 'gc', 'map']
+
+
+class CnMatrixError(Exception):
+    pass
+
+
+def is_cn_matrix(filepath):
+    return filepath.endswith('.npz')
+
+
+class CnMatrixOutput(object):
+    """
+    cells are added with add_df inside a with block, the indexes are
+    written when the block exits
+    """
+
+    def __init__(self, filepath, columns=None, chunksize=100):
+        """
+        :param filepath: output npz file
+        :param columns: reads columns to store, defaults to MATRIX_COLUMNS
+        :param chunksize: number of cells per compressed chunk
+        """
+        self.filepath = filepath
+        self.columns = columns if columns else MATRIX_COLUMNS
+        self.chunksize = chunksize
+
+        self.bins = None
+        self.bin_index = None
+
+        self.cells = []
+        self.chunk_starts = []
+
+        self.buffer = []
+
+        self.archive = None
+
+    def __enter__(self):
+        self.archive = csvutils.open_array_archive(self.filepath)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+                self.write_indexes()
+        finally:
+            self.archive.close()
+            self.archive = None
+
+    def set_bins(self, df):
+        bins = df[['chr', 'start', 'end']].drop_duplicates()
+
+        self.bins = bins.reset_index(drop=True)
+        self.bin_index = pd.MultiIndex.from_frame(self.bins)
+
+    def get_bin_positions(self, df):
+        positions = self.bin_index.get_indexer(
+            pd.MultiIndex.from_frame(df[['chr', 'start', 'end']])
+        )
+
+        if (positions < 0).any():
+            raise CnMatrixError(
+                'bins in {} do not match the bins of the first cell'.format(
+                    df['cell_id'].iloc[0])
+            )
+
+        return positions
+
+    def add_cell(self, cell_id, df):
+        if self.bins is None:
+            self.set_bins(df)
+
+        positions = self.get_bin_positions(df)
+
+        celldata = {}
+        for column in self.columns:
+            values = np.full(len(self.bins), np.nan)
+            values[positions] = df[column].astype(np.float64).values
+            celldata[column] = values
+
+        self.cells.append(cell_id)
+        self.buffer.append(celldata)
+
+    def add_df(self, df):
+        """
+        :param df: all hmmcopy reads of one or more cells
+        """
+        for cell_id, celldf in df.groupby('cell_id', sort=False):
+            self.add_cell(cell_id, celldf)
+
+            if len(self.buffer) == self.chunksize:
+                self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+
+        chunk_id = len(self.chunk_starts)
+        self.chunk_starts.append(len(self.cells) - len(self.buffer))
+
+        for column in self.columns:
+            matrix = np.vstack([celldata[column] for celldata in self.buffer])
+            csvutils.write_archive_array(
+                self.archive, '{}.{}'.format(column, chunk_id), matrix
+            )
+
+        self.buffer = []
+
+    def write_indexes(self):
+        if self.bins is None:
+            self.set_bins(pd.DataFrame(columns=['chr', 'start', 'end']))
+
+        indexes = [
+            ('chr', np.array(self.bins['chr'].tolist(), dtype=str)),
+            ('start', self.bins['start'].values.astype(np.int64)),
+            ('end', self.bins['end'].values.astype(np.int64)),
+            ('cell_id', np.array(self.cells, dtype=str)),
+            ('chunk_starts', np.array(self.chunk_starts, dtype=np.int64)),
+            ('columns', np.array(self.columns, dtype=str)),
+        ]
+
+        for name, array in indexes:
+            csvutils.write_archive_array(self.archive, name, array)
+
+    def write_csv_files(self, csvfiles):
+        """
+        :param csvfiles: list of hmmcopy reads csv files, or dict of csv files
+        that is read in sorted key order
+        """
+        if isinstance(csvfiles, dict):
+            csvfiles = [csvfiles[key] for key in sorted(csvfiles)]
+
+        with self:
+            for csvfile in csvfiles:
+                self.add_df(csvutils.read_csv_and_yaml(csvfile))
+
+
+class CnMatrixInput(object):
+    def __init__(self, filepath):
+        """
+        :param filepath: npz file from CnMatrixOutput
+        """
+        self.filepath = filepath
+
+        with np.load(filepath, allow_pickle=False) as store:
+            self.bins = pd.MultiIndex.from_arrays(
+                [store['chr'], store['start'], store['end']],
+                names=['chr', 'start', 'end']
+            )
+            self.cells = store['cell_id']
+            self.chunk_starts = store['chunk_starts']
+            self.columns = list(store['columns'])
+
+    def get_chunks(self, cells):
+        """
+        :param cells: list of cell ids or None for all cells
+        :returns dict of chunk id to the row offsets of the cells in that chunk
+        """
+        if cells is None:
+            rows = np.arange(len(self.cells))
+        else:
+            lookup = pd.Index(self.cells).get_indexer(cells)
+            if (lookup < 0).any():
+                missing = [cell for cell, row in zip(cells, lookup) if row < 0]
+                raise CnMatrixError(
+                    'cells {} not in {}'.format(missing, self.filepath)
+                )
+            rows = lookup
+
+        chunk_ids = np.searchsorted(self.chunk_starts, rows, side='right') - 1
+
+        chunks = {}
+        for row, chunk_id in zip(rows, chunk_ids):
+            chunks.setdefault(chunk_id, []).append(row - self.chunk_starts[chunk_id])
+
+        return rows, chunk_ids, chunks
+
+    def read_column(self, column, cells=None):
+        """
+        :param column: one of the stored reads columns
+        :param cells: list of cell ids to load, all cells by default
+        :returns dataframe with a row per cell and a column per bin
+        """
+        if column not in self.columns:
+            raise CnMatrixError(
+                '{} not stored in {}'.format(column, self.filepath)
+            )
+
+        rows, chunk_ids, chunks = self.get_chunks(cells)
+
+        data = np.empty((len(rows), len(self.bins)))
+
+        with np.load(self.filepath, allow_pickle=False) as store:
+            for chunk_id, offsets in chunks.items():
+                matrix = store['{}.{}'.format(column, chunk_id)]
+                data[chunk_ids == chunk_id] = matrix[offsets]
+
+        return pd.DataFrame(
+            data, index=pd.Index(self.cells[rows], name='cell_id'),
+            columns=self.bins
+        )
+
+    def read_columns(self, columns=None, cells=None):
+        """
+        :returns dict of column name to cell by bin dataframe
+        """
+        if columns is None:
+            columns = self.columns
+
+        return {column: self.read_column(column, cells=cells) for column in columns}
+
+
+def write_cn_matrix(reads_files, output, columns=None):
+    CnMatrixOutput(output, columns=columns).write_csv_files(reads_files)
+
+
+def read_cn_matrix(infile, column, cells=None):
+    return CnMatrixInput(infile).read_column(column, cells=cells)
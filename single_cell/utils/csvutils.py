@@ -1,13 +1,18 @@
 import gzip
+import io
 import logging
 import os
 import shutil
+import zipfile
 
+import numpy as np
 import pandas as pd
 import yaml
 
 import collections
 
+from single_cell.utils.bgzfutils import BgzfWriter
+
 class CsvMergeDtypesEmptyMergeSet(Exception):
     pass
 
@@ -68,6 +73,75 @@ def pandas_to_std_types():
     return collections.defaultdict(lambda: "str", std_dict)
 
 
+FILTER_OPERATIONS = {
+    'gt': lambda values, threshold: values > threshold,
+    'ge': lambda values, threshold: values >= threshold,
+    'lt': lambda values, threshold: values < threshold,
+    'le': lambda values, threshold: values <= threshold,
+    'eq': lambda values, threshold: values == threshold,
+    'ne': lambda values, threshold: values != threshold,
+    'in': lambda values, threshold: values.isin(threshold),
+    'notin': lambda values, threshold: ~values.isin(threshold),
+}
+
+
+def filter_dataframe(df, filters):
+    """
+    vectorised helpers.filter_metrics, keeps rows that pass all filters
+    :param filters: list of [column, operation, value] with the operations
+    supported by helpers.eval_expr
+    """
+    if not filters:
+        return df
+
+    keep = np.ones(len(df), dtype=bool)
+    for column, operation, threshold in filters:
+        if operation not in FILTER_OPERATIONS:
+            raise Exception("unknown operator type: {}".format(operation))
+
+        keep &= FILTER_OPERATIONS[operation](df[column], threshold).values
+
+    return df[keep]
+
+
+def get_usecols(all_columns, columns, filters):
+    """
+    columns to parse for a projected and filtered read, None for all
+    """
+    if columns is None:
+        return None
+
+    usecols = list(columns)
+    for column, _, _ in filters or []:
+        if column not in usecols:
+            usecols.append(column)
+
+    missing = [column for column in usecols if column not in all_columns]
+    if missing:
+        raise CsvParseError("columns {} not found".format(missing))
+
+    return usecols
+
+
+def parse_yaml_metadata(yaml_file):
+    with open(yaml_file) as yamlfile:
+        yamldata = yaml.safe_load(yamlfile)
+
+    header = yamldata['header']
+    sep = yamldata['sep']
+
+    dtypes = {}
+    columns = []
+    for coldata in yamldata['columns']:
+        colname = coldata['name']
+
+        dtypes[colname] = coldata['dtype']
+
+        columns.append(colname)
+
+    return header, dtypes, columns, sep
+
+
 class CsvWriterError(Exception):
     pass
 
@@ -255,62 +329,84 @@ class CsvInput(object):
             raise CsvInputError("{} is not supported".format(ext))
 
     def __parse_metadata(self):
-        with open(self.filepath + '.yaml') as yamlfile:
-            yamldata = yaml.safe_load(yamlfile)
-
-        header = yamldata['header']
-        sep = yamldata['sep']
+        return parse_yaml_metadata(self.yaml_file)
 
-        dtypes = {}
-        columns = []
-        for coldata in yamldata['columns']:
-            colname = coldata['name']
+    def __verify_data(self, df, usecols=None):
+        expected = usecols if usecols else self.columns
+        if not set(list(df.columns.values)) == set(expected):
+            raise CsvParseError("metadata mismatch in {}".format(self.filepath))
 
-            dtypes[colname] = coldata['dtype']
+    def __select(self, df, usecols, columns, filters):
+        self.__verify_data(df, usecols)
 
-            columns.append(colname)
+        df = filter_dataframe(df, filters)
 
-        return header, dtypes, columns, sep
+        if columns is not None:
+            df = df[columns]
 
-    def __verify_data(self, df):
-        if not set(list(df.columns.values)) == set(self.columns):
-            raise CsvParseError("metadata mismatch in {}".format(self.filepath))
+        return df
 
-    def read_csv(self, chunksize=None):
+    def read_csv(self, chunksize=None, columns=None, filters=None, buffer=None):
+        """
+        :param chunksize: returns a generator of dataframes if set
+        :param columns: only parse these columns
+        :param filters: list of [column, operation, value], rows that fail
+        a filter are dropped chunk by chunk while parsing
+        :param buffer: gzipped file contents already in memory, parsed
+        instead of reading the file again
+        """
         def return_gen(df_iterator):
             for df in df_iterator:
-                self.__verify_data(df)
-                yield df
+                yield self.__select(df, usecols, columns, filters)
 
-        dtypes = {k: v for k, v in self.dtypes.items() if v != "NA"}
+        usecols = get_usecols(self.columns, columns, filters)
+
+        dtypes = {
+            k: v for k, v in self.dtypes.items()
+            if v != "NA" and (usecols is None or k in usecols)
+        }
         # if header exists then use first line (0) as header
         header = 0 if self.header else None
         names = None if self.header else self.columns
 
+        # filtered reads are parsed in chunks to bound memory
+        read_chunksize = chunksize
+        if filters and not chunksize:
+            read_chunksize = 10 ** 5
+
         try:
             data = pd.read_csv(
-                self.filepath, compression='gzip', chunksize=chunksize,
-                sep=self.sep, header=header, names=names, dtype=dtypes)
+                self.filepath if buffer is None else io.BytesIO(buffer),
+                compression='gzip', chunksize=read_chunksize,
+                sep=self.sep, header=header, names=names, dtype=dtypes,
+                usecols=usecols)
         except pd.errors.EmptyDataError:
-            data = pd.DataFrame(columns=self.columns)
+            data = pd.DataFrame(columns=usecols if usecols else self.columns)
             data = self.cast_dataframe(data)
+            if read_chunksize:
+                data = [data]
 
         if chunksize:
             return return_gen(data)
+        elif read_chunksize:
+            return pd.concat(list(return_gen(data)), ignore_index=True)
         else:
-            self.__verify_data(data)
-            return data
+            return self.__select(data, usecols, columns, filters)
 
 
 class CsvOutput(object):
     def __init__(
             self, filepath, dtypes, header=True,
-            na_rep='NaN', columns=None
+            na_rep='NaN', columns=None, threads=1
     ):
+        """
+        :param threads: more than 1 writes bgzf blocks compressed in parallel
+        """
         self.filepath = filepath
         self.header = header
         self.dtypes = dtypes
         self.na_rep = na_rep
+        self.threads = threads
 
         self.columns = columns
 
@@ -370,6 +466,11 @@ class CsvOutput(object):
 
         return df
 
+    def open_writer(self, mode='wt'):
+        if self.threads > 1:
+            return BgzfWriter(self.filepath, mode=mode, threads=self.threads)
+        return gzip.open(self.filepath, mode)
+
     def __write_df(self, df, header=True, mode='w'):
         df = self.__cast_df(df)
         if self.columns:
@@ -377,6 +478,14 @@ class CsvOutput(object):
         else:
             self.columns = list(df.columns.values)
 
+        if self.threads > 1:
+            with self.open_writer(mode=mode + 't') as writer:
+                df.to_csv(
+                    writer, sep=self.sep, na_rep=self.na_rep,
+                    index=False, header=header
+                )
+            return
+
         df.to_csv(
             self.filepath, sep=self.sep, na_rep=self.na_rep,
             index=False, compression='gzip', mode=mode, header=header
@@ -402,26 +511,55 @@ class CsvOutput(object):
         header = header + '\n'
         writer.write(header)
 
-    def write_data_streams(self, csvfiles):
+    def validate_stream(self, csvfile):
+        """
+        check that the first line of a headerless input matches the columns
+        """
+        with gzip.open(csvfile, 'rt') as data_stream:
+            line = data_stream.readline()
+
+        if line and len(line.rstrip('\n').split(self.sep)) != len(self.columns):
+            raise CsvConcatException(
+                "{} does not match columns {}".format(csvfile, self.columns)
+            )
+
+    def write_gzip_members(self, csvfiles, callback=None):
+        """
+        concatenate gzipped inputs without recompressing them. inputs must
+        be headerless and have the output columns, the header is written as
+        its own gzip member.
+        :param callback: called with the parsed data of every input, the
+        copied bytes are parsed so inputs are only read once
+        """
         assert self.columns
         assert self.dtypes
-        with gzip.open(self.filepath, 'wt') as writer:
 
+        for csvfile in csvfiles:
+            self.validate_stream(csvfile)
+
+        with open(self.filepath, 'wb') as writer:
             if self.header:
-                self.write_header(writer)
+                writer.write(gzip.compress(self.header_line.encode('utf-8')))
 
             for csvfile in csvfiles:
-                with gzip.open(csvfile, 'rt') as data_stream:
-                    shutil.copyfileobj(
-                        data_stream, writer, length=16 * 1024 * 1024
-                    )
+                with open(csvfile, 'rb') as data_stream:
+                    if callback is None:
+                        shutil.copyfileobj(
+                            data_stream, writer, length=16 * 1024 * 1024
+                        )
+                        continue
+
+                    data = data_stream.read()
+
+                writer.write(data)
+                callback(CsvInput(csvfile).read_csv(buffer=data))
 
         self.write_yaml()
 
     def rewrite_csv(self, csvfile):
         assert self.columns
         assert self.dtypes
-        with gzip.open(self.filepath, 'wt') as writer:
+        with self.open_writer() as writer:
             if self.header:
                 self.write_header(writer)
 
@@ -436,7 +574,7 @@ class CsvOutput(object):
         assert self.columns
         assert self.dtypes
 
-        with gzip.open(self.filepath, 'wt') as writer:
+        with self.open_writer() as writer:
 
             if self.header:
                 self.write_header(writer)
@@ -447,6 +585,224 @@ class CsvOutput(object):
         self.write_yaml()
 
 
+COLUMNAR_EXTENSION = '.columnar'
+
+
+def is_columnar(filepath):
+    if filepath.endswith('.tmp'):
+        filepath = filepath[:-4]
+    return filepath.endswith(COLUMNAR_EXTENSION)
+
+
+def open_array_archive(filepath):
+    """
+    zip archive of compressed npy arrays, readable with numpy.load
+    """
+    return zipfile.ZipFile(filepath, 'w', zipfile.ZIP_DEFLATED)
+
+
+def write_archive_array(archive, name, array):
+    with archive.open(name + '.npy', 'w', force_zip64=True) as writer:
+        np.lib.format.write_array(writer, np.asarray(array), allow_pickle=False)
+
+
+class ColumnarOutput(object):
+    """
+    typed binary alternative to CsvOutput. every column is stored as numpy
+    arrays in row groups inside a zip archive, the yaml file is the same as
+    the csv yaml so readers can use either format.
+    """
+
+    def __init__(
+            self, filepath, dtypes, header=True, columns=None,
+            row_group_size=10 ** 5
+    ):
+        """
+        :param header: only recorded in the yaml, there is no header row
+        :param row_group_size: max number of rows per stored array
+        """
+        self.filepath = filepath
+        self.header = header
+        self.dtypes = dtypes
+        self.columns = columns
+        self.row_group_size = row_group_size
+
+        self.sep = ','
+
+        self.row_groups = []
+
+        if not is_columnar(filepath):
+            raise CsvWriterError("{} is not supported".format(filepath))
+
+    @property
+    def yaml_file(self):
+        return self.filepath + '.yaml'
+
+    def write_yaml(self):
+        type_converter = pandas_to_std_types()
+
+        yamldata = {'header': self.header, 'sep': self.sep, 'columns': []}
+        for column in self.columns:
+            data = {'name': column, 'dtype': type_converter[self.dtypes[column]]}
+            yamldata['columns'].append(data)
+
+        with open(self.yaml_file, 'wt') as f:
+            yaml.safe_dump(yamldata, f, default_flow_style=False)
+
+    def __write_column(self, archive, name, column, series):
+        dtype = pandas_to_std_types()[str(self.dtypes[column])]
+
+        if dtype == 'bool' and series.isnull().any():
+            raise Exception('NaN found in bool column:{}'.format(column))
+
+        if dtype == 'str':
+            nulls = series.isnull().values
+            values = np.array(
+                series.where(~nulls, '').astype(str).tolist(), dtype=str
+            )
+            write_archive_array(archive, name + '.null', nulls)
+        elif dtype == 'int':
+            # same cast as CsvOutput, raises on NaN unless the dtype is the
+            # nullable Int64
+            series = series.astype(self.dtypes[column])
+            nulls = series.isnull().values
+            if nulls.any():
+                write_archive_array(archive, name + '.null', nulls)
+            values = series.fillna(0).values.astype(np.int64)
+        elif dtype == 'bool':
+            values = series.values.astype(bool)
+        else:
+            values = series.values.astype(np.float64)
+
+        write_archive_array(archive, name, values)
+
+    def __write_row_group(self, archive, df):
+        row_group = len(self.row_groups)
+
+        for column in self.columns:
+            name = '{}.{}'.format(column, row_group)
+            self.__write_column(archive, name, column, df[column])
+
+        self.row_groups.append(len(df))
+
+    def __write_df(self, archive, df):
+        if self.columns:
+            assert set(df.columns.values) == set(self.columns)
+        else:
+            self.columns = list(df.columns.values)
+
+        for start in range(0, len(df), self.row_group_size):
+            self.__write_row_group(
+                archive, df.iloc[start:start + self.row_group_size]
+            )
+
+    def write_df(self, df, chunks=False):
+        if not chunks:
+            df = [df]
+
+        self.row_groups = []
+
+        with open_array_archive(self.filepath) as archive:
+            for data in df:
+                self.__write_df(archive, data)
+
+            write_archive_array(archive, 'row_groups', np.array(self.row_groups, dtype=np.int64))
+
+        self.write_yaml()
+
+
+class ColumnarInput(object):
+    """
+    reads files from ColumnarOutput, only the requested columns are
+    decompressed and data can be streamed a row group at a time
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+        metadata = parse_yaml_metadata(self.yaml_file)
+
+        self.header, self.dtypes, self.columns, self.sep = metadata
+
+        if not is_columnar(filepath):
+            raise CsvInputError("{} is not supported".format(filepath))
+
+    @property
+    def yaml_file(self):
+        return self.filepath + '.yaml'
+
+    def empty_dataframe(self, columns):
+        data = pd.DataFrame(columns=columns)
+        for column in columns:
+            if self.dtypes[column] != 'NA':
+                data[column] = data[column].astype(self.dtypes[column])
+        return data
+
+    def __read_column(self, store, column, row_group):
+        name = '{}.{}'.format(column, row_group)
+        values = store[name]
+
+        if self.dtypes[column] == 'str':
+            values = values.astype(object)
+            values[store[name + '.null']] = np.nan
+        elif self.dtypes[column] == 'int' and name + '.null' in store:
+            values = pd.arrays.IntegerArray(values, store[name + '.null'])
+
+        return values
+
+    def __read_row_group(self, store, columns, row_group):
+        return pd.DataFrame(
+            {column: self.__read_column(store, column, row_group) for column in columns},
+            columns=columns
+        )
+
+    def __read_row_groups(self, columns, chunksize, filters):
+        usecols = get_usecols(self.columns, columns, filters)
+
+        with np.load(self.filepath, allow_pickle=False) as store:
+            row_groups = store['row_groups']
+
+            if not len(row_groups):
+                yield self.empty_dataframe(columns)
+
+            for row_group in range(len(row_groups)):
+                df = self.__read_row_group(store, usecols, row_group)
+
+                if filters:
+                    df = filter_dataframe(df, filters)[columns]
+                    df = df.reset_index(drop=True)
+
+                if not chunksize:
+                    yield df
+                    continue
+
+                for start in range(0, len(df), chunksize):
+                    yield df.iloc[start:start + chunksize].reset_index(drop=True)
+
+    def read_csv(self, chunksize=None, columns=None, filters=None):
+        """
+        :param chunksize: max rows per dataframe, returns a generator if set
+        :param columns: only load these columns
+        :param filters: list of [column, operation, value], rows that fail
+        a filter are dropped row group by row group
+        """
+        if columns is None:
+            columns = self.columns
+
+        data = self.__read_row_groups(columns, chunksize, filters)
+
+        if chunksize:
+            return data
+
+        return pd.concat(list(data), ignore_index=True)
+
+
+def get_input(filepath):
+    if is_columnar(filepath):
+        return ColumnarInput(filepath)
+    return CsvInput(filepath)
+
+
 def write_metadata(infile, dtypes):
     csvinput = IrregularCsvInput(infile, dtypes)
 
@@ -474,14 +830,32 @@ def merge_dtypes(dtypes_all):
     return merged_dtypes
 
 
-def concatenate_csv(inputfiles, output, write_header=True):
+def merge_columns(columns_all):
+    """
+    union of the columns in order of first appearance
+    """
+    merged_columns = []
+
+    for columns in columns_all:
+        for column in columns:
+            if column not in merged_columns:
+                merged_columns.append(column)
+
+    return merged_columns
+
+
+def concatenate_csv(inputfiles, output, write_header=True, threads=1, callback=None):
+    """
+    :param callback: called with the data of every input file as it is
+    concatenated, to build other outputs in the same pass over the inputs
+    """
     if inputfiles == [] or inputfiles == {}:
         raise CsvConcatException("nothing provided to concat")
 
     if isinstance(inputfiles, dict):
         inputfiles = inputfiles.values()
 
-    inputs = [CsvInput(infile) for infile in inputfiles]
+    inputs = [get_input(infile) for infile in inputfiles]
 
     dtypes = merge_dtypes([csvinput.dtypes for csvinput in inputs])
 
@@ -496,12 +870,23 @@ def concatenate_csv(inputfiles, output, write_header=True):
     if not all(columns[0] == elem for elem in columns):
         low_memory = False
 
+    # gzip members can only be copied between csv files
+    if is_columnar(output) or any(is_columnar(infile) for infile in inputfiles):
+        low_memory = False
+
     if low_memory:
         columns = columns[0]
-        concatenate_csv_files_quick_lowmem(inputfiles, output, dtypes, columns, write_header=write_header)
+        concatenate_csv_files_quick_lowmem(
+            inputfiles, output, dtypes, columns, write_header=write_header,
+            threads=threads, callback=callback
+        )
 
     else:
-        concatenate_csv_files_pandas(inputfiles, output, dtypes, write_header=write_header)
+        columns = merge_columns(columns)
+        concatenate_csv_files_streaming(
+            inputfiles, output, dtypes, columns, write_header=write_header,
+            threads=threads, callback=callback
+        )
 
 
 def concatenate_csv_files_pandas(in_filenames, out_filename, dtypes, write_header=True):
@@ -516,11 +901,55 @@ def concatenate_csv_files_pandas(in_filenames, out_filename, dtypes, write_heade
     csvoutput.write_df(data)
 
 
-def concatenate_csv_files_quick_lowmem(inputfiles, output, dtypes, columns, write_header=True):
+def concatenate_csv_files_streaming(
+        in_filenames, out_filename, dtypes, columns, write_header=True,
+        chunksize=10 ** 5, threads=1, callback=None
+):
+    """
+    concatenate chunk by chunk, memory use is bounded by the chunksize.
+    chunks are reordered to the merged columns, missing columns are
+    written as na_rep
+    """
+
+    def get_chunks():
+        empty = True
+        for in_filename in in_filenames:
+            frames = []
+            for df in get_input(in_filename).read_csv(chunksize=chunksize):
+                if df.empty:
+                    continue
+                empty = False
+                df = df.reindex(columns=columns)
+                if callback is not None:
+                    frames.append(df)
+                yield df
+
+            if frames:
+                callback(pd.concat(frames, ignore_index=True))
+
+        if empty:
+            yield pd.DataFrame(columns=columns)
+
+    if is_columnar(out_filename):
+        csvoutput = ColumnarOutput(
+            out_filename, dtypes, header=write_header, columns=columns
+        )
+    else:
+        csvoutput = CsvOutput(
+            out_filename, dtypes, header=write_header, columns=columns,
+            threads=threads
+        )
+    csvoutput.write_df(get_chunks(), chunks=True)
+
+
+def concatenate_csv_files_quick_lowmem(
+        inputfiles, output, dtypes, columns, write_header=True, threads=1,
+        callback=None
+):
     csvoutput = CsvOutput(
-        output, dtypes, header=write_header, columns=columns
+        output, dtypes, header=write_header, columns=columns, threads=threads
     )
-    csvoutput.write_data_streams(inputfiles)
+    csvoutput.write_gzip_members(inputfiles, callback=callback)
 
 
 # annotation_dtypes shouldnt be default, if it is None, it breaks
@@ -586,7 +1015,14 @@ def rewrite_csv_file(filepath, outputfile, write_header=True, dtypes=None):
         assert dtypes
         csvinput = IrregularCsvInput(filepath, dtypes)
 
-    if csvinput.header:
+    if is_columnar(outputfile):
+        csvoutput = ColumnarOutput(
+            outputfile, csvinput.dtypes, header=write_header,
+            columns=csvinput.columns
+        )
+        csvoutput.write_df(csvinput.read_csv())
+
+    elif csvinput.header:
         df = csvinput.read_csv()
 
         csvoutput = CsvOutput(
@@ -690,16 +1126,21 @@ def merge_frames(frames, how, on):
         return merged_frame
 
 
-def write_dataframe_to_csv_and_yaml(df, outfile, dtypes, write_header=True):
-    csvoutput = CsvOutput(outfile, dtypes, header=write_header)
+def write_dataframe_to_csv_and_yaml(df, outfile, dtypes, write_header=True, threads=1):
+    if is_columnar(outfile):
+        csvoutput = ColumnarOutput(outfile, dtypes, header=write_header)
+    else:
+        csvoutput = CsvOutput(outfile, dtypes, header=write_header, threads=threads)
 
     csvoutput.write_df(df)
 
 
-def read_csv_and_yaml(infile, chunksize=None):
-    return CsvInput(infile).read_csv(chunksize=chunksize)
+def read_csv_and_yaml(infile, chunksize=None, columns=None, filters=None):
+    return get_input(infile).read_csv(
+        chunksize=chunksize, columns=columns, filters=filters
+    )
 
 
 def get_metadata(input):
-    csvinput = CsvInput(input)
+    csvinput = get_input(input)
     return csvinput.header, csvinput.dtypes, csvinput.columns
@@ -1,38 +1,119 @@
-import re
 from collections import defaultdict
-from itertools import islice
+from itertools import chain
+from itertools import repeat
 
 from single_cell.utils import helpers
 
+# bytes read from the fastq per parse
+BLOCK_SIZE = 4 * 1024 * 1024
 
-class FastqReader(object):
 
-    def __init__(self, filepath):
-        self.file_path = filepath
+class FastqRecord(list):
+    """
+    the four lines of a fastq read. records are lists so existing code that
+    indexes and rewrites read lines keeps working, without a per instance
+    dict
+    """
+    __slots__ = ()
 
-    def get_read_iterator(self):
-        with helpers.getFileHandle(self.file_path) as fq_reader:
-            while True:
-                fastq_read = list(islice(fq_reader, 4))
+    @property
+    def name(self):
+        return self[0]
+
+    @property
+    def sequence(self):
+        return self[1]
+
+    @property
+    def comment(self):
+        return self[2]
+
+    @property
+    def quality(self):
+        return self[3]
+
+
+def _split_lines(text):
+    # same newline handling as reading in text mode
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+
+    return text.splitlines(True)
+
+
+def _get_records(lines, nrecords):
+    names = lines[0:nrecords * 4:4]
+    comments = lines[2:nrecords * 4:4]
+
+    if not all(map(str.startswith, names, repeat('@'))):
+        raise ValueError('Expected @ as first character of read name')
+
+    if not all(map(str.startswith, comments, repeat('+'))):
+        raise ValueError('Expected = as first character of read comment')
+
+    return map(
+        FastqRecord,
+        zip(names, lines[1:nrecords * 4:4], comments, lines[3:nrecords * 4:4])
+    )
 
-                fastq_read = [line for line in fastq_read]
 
-                if not fastq_read:
-                    break
+def _parse_blocks(handle, block_size):
+    leftover = b''
+    pending = []
 
-                assert len(fastq_read) == 4, 'fastq file format error'
+    while True:
+        block = handle.read(block_size)
 
-                if not fastq_read[0].startswith('@'):
-                    raise ValueError('Expected @ as first character of read name')
+        if not block:
+            lines = pending + _split_lines(leftover.decode('utf-8'))
+            assert len(lines) % 4 == 0, 'fastq file format error'
+            yield _get_records(lines, len(lines) // 4)
+            break
 
-                if not fastq_read[2].startswith('+'):
-                    raise ValueError('Expected = as first character of read comment')
+        block = leftover + block
 
-                yield fastq_read
+        end = block.rfind(b'\n') + 1
+        leftover = block[end:]
+
+        lines = pending + _split_lines(block[:end].decode('utf-8'))
+
+        nrecords = len(lines) // 4
+        pending = lines[nrecords * 4:]
+
+        yield _get_records(lines, nrecords)
+
+
+def parse_fastq_blocks(handle, block_size=BLOCK_SIZE):
+    """
+    parse fastq records from a binary file handle. data is read and split
+    into lines a block at a time, lines and records that span blocks are
+    carried over to the next block
+    :param handle: file handle opened in binary mode
+    :param block_size: bytes per read
+    :returns iterator over FastqRecords
+    """
+    return chain.from_iterable(_parse_blocks(handle, block_size))
+
+
+class FastqReader(object):
+
+    def __init__(self, filepath):
+        self.file_path = filepath
+
+    def get_read_iterator(self):
+        with helpers.getFileHandle(self.file_path, 'rb') as fq_reader:
+            yield from parse_fastq_blocks(fq_reader)
 
 
 def _get_read_name(fastq_line1):
-    return re.split('/| |\t|#FQST:', fastq_line1.split()[0])[0].rstrip()
+    read_name = fastq_line1.split(None, 1)[0]
+
+    for sep in ('/', '#FQST:'):
+        index = read_name.find(sep)
+        if index != -1:
+            read_name = read_name[:index]
+
+    return read_name
 
 
 class PairedFastqReader(object):
@@ -61,22 +142,34 @@ class TaggedFastqReader(FastqReader):
     def __init__(self, fastq_path):
         super(TaggedFastqReader, self).__init__(fastq_path)
         self.indices = None
+        self.tag_cache = {}
 
     def get_read_tag(self, fastq_read):
-
+        """
+        tags are cached by flag string, the returned dict is shared between
+        reads and should not be modified
+        """
         read_id = fastq_read[0]
-        fq_tag = read_id[read_id.index('FQST:'):]
-        fq_tag = fq_tag.strip().split(':')
+
+        if 'FQST:' not in read_id:
+            raise ValueError('FQST tag missing in {}'.format(read_id))
 
         if not self.indices:
+            fq_tag = read_id[read_id.index('FQST:'):]
+            fq_tag = fq_tag.strip().split(':')
+
             if len(fq_tag) > 2:
                 self.indices = {i: v for i, v in enumerate(fq_tag[1:-1])}
             else:
                 raise Exception('First line in fastq file should have filter explanation')
 
-        flag = map(int, list(fq_tag[-1]))
+        flag = read_id.rstrip().rpartition(':')[2]
+
+        flag_map = self.tag_cache.get(flag)
 
-        flag_map = {self.indices[i]: 0 if v == 0 else 1 for i, v in enumerate(flag)}
+        if flag_map is None:
+            flag_map = {self.indices[i]: 0 if v == '0' else 1 for i, v in enumerate(flag)}
+            self.tag_cache[flag] = flag_map
 
         return flag_map
 
@@ -132,6 +225,7 @@ class PairedTaggedFastqReader(PairedFastqReader, TaggedFastqReader):
     def __init__(self, fastq_r1, fastq_r2):
         super(PairedTaggedFastqReader, self).__init__(fastq_r1, fastq_r2)
         self.indices = None
+        self.tag_cache = {}
 
     @staticmethod
     def __filter(genomes, filter_tags, tags_r1, tags_r2):
@@ -170,3 +264,62 @@ class PairedTaggedFastqReader(PairedFastqReader, TaggedFastqReader):
             counts["R2"][r2_flags] += 1
 
         return counts
+
+    @staticmethod
+    def regroup_tags(tags):
+        """
+        merge the tags of genomes that are split over multiple indexes
+        (genome_path0, genome_path1 ...) into a single tag per genome
+        """
+        newtags = {}
+        for tag, val in tags.items():
+            if '_path' in tag:
+                tag = tag.split('_path')[0]
+
+            if tag in newtags:
+                newtags[tag] = max(val, newtags[tag])
+            else:
+                newtags[tag] = val
+
+        return newtags
+
+    def gather_counts_and_filter(
+            self, genomes, filter_tags, writer_r1, writer_r2, regroup=False
+    ):
+        """
+        single pass over the read pairs, counts the tags of every pair and
+        writes the pairs that pass the filter with the tags in the comment
+        :param genomes: genome names in filter tag order
+        :param filter_tags: set of tag strings to remove
+        :param writer_r1: open file handle for filtered R1 reads
+        :param writer_r2: open file handle for filtered R2 reads
+        :param regroup: merge tags of genomes with multiple indexes
+        :returns counts, same as gather_counts
+        """
+        key_order = None
+        counts = {'R1': defaultdict(int), 'R2': defaultdict(int)}
+
+        for read_1, read_2 in self.get_read_pair_iterator():
+            tags_r1 = self.get_read_tag(read_1)
+            tags_r2 = self.get_read_tag(read_2)
+
+            if regroup:
+                tags_r1 = self.regroup_tags(tags_r1)
+                tags_r2 = self.regroup_tags(tags_r2)
+
+            if not key_order:
+                key_order = sorted(tags_r1.keys())
+
+            r1_flags = tuple(zip(key_order, [tags_r1[key] for key in key_order]))
+            r2_flags = tuple(zip(key_order, [tags_r2[key] for key in key_order]))
+
+            counts["R1"][r1_flags] += 1
+            counts["R2"][r2_flags] += 1
+
+            if self.__filter(genomes, filter_tags, tags_r1, tags_r2):
+                continue
+
+            writer_r1.writelines(self.add_tag_to_read_comment(read_1, tag=tags_r1))
+            writer_r2.writelines(self.add_tag_to_read_comment(read_2, tag=tags_r2))
+
+        return counts
@@ -24,6 +24,19 @@ def load_merge_cell_bams(input_yaml):
     return cell_bams
 
 
+def load_plan_regions_input(input_yaml):
+    yamldata = load_yaml(input_yaml)
+
+    validate.validate_plan_regions(yamldata)
+
+    normal_bam = yamldata['normal']['bam']
+
+    cell_bams = yamldata['cell_bams']
+    cell_bams = {cell_id: cell_bams[cell_id]['bam'] for cell_id in cell_bams}
+
+    return normal_bam, cell_bams
+
+
 def load_infer_haps_input(input_yaml):
     yamldata = load_yaml(input_yaml)
 
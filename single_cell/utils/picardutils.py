@@ -63,6 +63,7 @@ def bam_markdups(bam_filename, markduped_bam_filename, metrics_filename,
                   'METRICS_FILE=' + metrics_filename,
         'REMOVE_DUPLICATES=False',
         'ASSUME_SORTED=True',
+        'TAGGING_POLICY=All',
         'VALIDATION_STRINGENCY=LENIENT',
                   'TMP_DIR=' + tempdir,
         'MAX_RECORDS_IN_RAM=150000',
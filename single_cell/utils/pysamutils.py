@@ -3,11 +3,22 @@ Created on Jun 1, 2018
 
 @author: dgrewal
 '''
+from __future__ import division
+
+import bisect
+import heapq
+import math
+import os
 import shutil
+import struct
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pysam
+import yaml
 from single_cell.utils.bamutils import bam_index
+from single_cell.utils.helpers import makedirs
 
 
 def load_chromosome_lengths(file_name, chromosomes=None):
@@ -50,6 +61,164 @@ def get_regions(chromosome_lengths, split_size):
     return regions
 
 
+# size of the windows in the bai linear index
+BAI_WINDOW_SIZE = 2 ** 14
+
+# bin holding the start and end offsets and read counts of a reference
+BAI_PSEUDO_BIN = 37450
+
+
+def read_bai_window_sizes(bai):
+    """
+    compressed bytes of the reads starting in each linear index window
+
+    :param bai: bam index
+    :returns list with an array of window sizes per reference in the bam
+    """
+    with open(bai, 'rb') as reader:
+        data = reader.read()
+
+    if data[:4] != b'BAI\x01':
+        raise ValueError('{} is not a bam index'.format(bai))
+
+    num_refs = struct.unpack_from('<i', data, 4)[0]
+    offset = 8
+
+    window_sizes = []
+    for _ in range(num_refs):
+        num_bins = struct.unpack_from('<i', data, offset)[0]
+        offset += 4
+
+        ref_end = None
+        for _ in range(num_bins):
+            bin_id, num_chunks = struct.unpack_from('<Ii', data, offset)
+            offset += 8
+            if bin_id == BAI_PSEUDO_BIN:
+                ref_end = struct.unpack_from('<QQ', data, offset)[1]
+            offset += 16 * num_chunks
+
+        num_windows = struct.unpack_from('<i', data, offset)[0]
+        offset += 4
+        window_offsets = np.frombuffer(data, dtype='<u8', count=num_windows, offset=offset)
+        offset += 8 * num_windows
+
+        if not num_windows or ref_end is None:
+            window_sizes.append(np.zeros(num_windows))
+            continue
+
+        # block offsets from the virtual offsets, empty windows have the
+        # offset of the previous one
+        offsets = np.append(window_offsets, np.uint64(ref_end)) >> np.uint64(16)
+        offsets = np.maximum.accumulate(offsets)
+        offsets[offsets == 0] = offsets[offsets > 0].min()
+        window_sizes.append(np.diff(offsets).astype(float))
+
+    return window_sizes
+
+
+def get_bam_window_sizes(bams):
+    """
+    linear index window sizes of the bams summed per chromosome
+    """
+    if isinstance(bams, dict):
+        bams = bams.values()
+
+    window_sizes = {}
+    for bam in bams:
+        with pysam.AlignmentFile(bam, 'rb') as reader:
+            references = reader.references
+
+        for chrom, sizes in zip(references, read_bai_window_sizes(bam + '.bai')):
+            total = window_sizes.get(chrom, np.zeros(0))
+            if len(sizes) > len(total):
+                total, sizes = sizes.copy(), total
+            total[:len(sizes)] += sizes
+            window_sizes[chrom] = total
+
+    return window_sizes
+
+
+def get_balanced_regions(chromosome_lengths, window_sizes, num_regions, window_size=BAI_WINDOW_SIZE):
+    """
+    split chromosomes into about num_regions regions with similar amounts of
+    reads. chromosomes get regions in proportion to their reads and are
+    cut at the window boundaries that split their reads evenly.
+
+    :param chromosome_lengths: dict of chromosome to length
+    :param window_sizes: dict of chromosome to array of reads per window
+    :param num_regions: target number of regions
+    :param window_size: size of the windows
+    :returns list of chrom-start-end regions
+    """
+    weights = {}
+    for chrom, length in chromosome_lengths.items():
+        chrom_weights = np.zeros(int(math.ceil(length / window_size)))
+        sizes = window_sizes.get(chrom, np.zeros(0))[:len(chrom_weights)]
+        chrom_weights[:len(sizes)] = sizes
+        weights[chrom] = chrom_weights
+
+    # without reads the regions are split by length
+    if not sum(chrom_weights.sum() for chrom_weights in weights.values()):
+        weights = {chrom: np.ones(len(chrom_weights)) for chrom, chrom_weights in weights.items()}
+
+    total = sum(chrom_weights.sum() for chrom_weights in weights.values())
+
+    regions = []
+    for chrom, length in chromosome_lengths.items():
+        chrom_weights = weights[chrom]
+        num_chrom_regions = max(1, int(round(chrom_weights.sum() / total * num_regions)))
+
+        cumulative = np.cumsum(chrom_weights)
+        targets = cumulative[-1] * np.arange(1, num_chrom_regions) / num_chrom_regions
+        cuts = np.searchsorted(cumulative, targets, side='left') + 1
+        cuts = np.unique(cuts[cuts < len(chrom_weights)])
+
+        bounds = [0] + cuts.tolist() + [len(chrom_weights)]
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            regions.append(
+                '{}-{}-{}'.format(chrom, start * window_size + 1, min(end * window_size, length))
+            )
+
+    return regions
+
+
+def get_balanced_regions_from_bams(bams, reference, num_regions, chromosomes):
+    """
+    regions with similar read volumes in the bams, estimated from the
+    linear index of the bam indexes
+    """
+    chromosome_lengths = load_chromosome_lengths(reference, chromosomes=chromosomes)
+
+    return get_balanced_regions(
+        chromosome_lengths, get_bam_window_sizes(bams), num_regions
+    )
+
+
+def write_balanced_regions(normal_bam, tumour_bams, reference, num_regions, chromosomes, output):
+    """
+    plan the regions once from the normal and tumour bams together, so the
+    split normal and merged tumour region bams share the same regions
+
+    :param normal_bam: wgs normal bam
+    :param tumour_bams: dict of cell id to tumour cell bam
+    :param output: yaml file with the list of regions
+    """
+    bams = [normal_bam] + [tumour_bams[cell_id] for cell_id in sorted(tumour_bams)]
+
+    regions = get_balanced_regions_from_bams(bams, reference, num_regions, chromosomes)
+
+    with open(output, 'wt') as writer:
+        yaml.safe_dump(regions, writer, default_flow_style=False)
+
+
+def load_regions(regions_file):
+    """
+    regions from write_balanced_regions
+    """
+    with open(regions_file) as reader:
+        return yaml.safe_load(reader)
+
+
 def _fraction_softclipped(x):
     total_softclipped = 0
     for a in x.cigar:
@@ -73,3 +242,277 @@ def remove_softclipped_reads(infile, outfile, softclipped_reads_threshold):
     filteredbam.close()
 
     bam_index(outfile, outfile + '.bai')
+
+
+def parse_region(region):
+    """
+    :param region: chrom-start-end with 1 based inclusive coordinates
+    :returns chrom and 0 based half open start and end
+    """
+    chrom, start, end = region.rsplit('-', 2)
+    return chrom, int(start) - 1, int(end)
+
+
+def get_merged_header(bams):
+    """
+    header of the first bam with the read groups and programs of all bams,
+    the bams must share the same sequence dictionary
+    """
+    merged = None
+    read_groups = OrderedDict()
+    programs = OrderedDict()
+
+    for bam in bams:
+        with pysam.AlignmentFile(bam, 'rb') as reader:
+            header = reader.header.to_dict()
+
+        if merged is None:
+            merged = header
+        elif header.get('SQ') != merged.get('SQ'):
+            raise ValueError(
+                'sequence dictionary of {} does not match {}'.format(bam, bams[0])
+            )
+
+        for read_group in header.get('RG', []):
+            read_groups.setdefault(read_group['ID'], read_group)
+
+        for program in header.get('PG', []):
+            programs.setdefault(program['ID'], program)
+
+    merged['RG'] = list(read_groups.values())
+    merged['PG'] = list(programs.values())
+
+    for key in ['RG', 'PG']:
+        if not merged[key]:
+            del merged[key]
+
+    merged.setdefault('HD', {'VN': '1.6'})['SO'] = 'coordinate'
+
+    return merged
+
+
+def iterate_merged_reads(readers):
+    """
+    k way merge of the placed reads of coordinate sorted bams, ties are
+    broken by strand and then by the order of the bams
+    """
+    heap = []
+    iterators = [reader.fetch(until_eof=False) for reader in readers]
+
+    for idx, iterator in enumerate(iterators):
+        read = next(iterator, None)
+        if read is not None:
+            heap.append((read.reference_id, read.reference_start, read.is_reverse, idx, read))
+
+    heapq.heapify(heap)
+
+    while heap:
+        idx = heap[0][3]
+        yield heap[0][4]
+
+        read = next(iterators[idx], None)
+        if read is None:
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(
+                heap, (read.reference_id, read.reference_start, read.is_reverse, idx, read)
+            )
+
+
+def merge_bam_files(bams, output, header, threads=1):
+    readers = [pysam.AlignmentFile(bam, 'rb') for bam in bams]
+
+    with pysam.AlignmentFile(output, 'wb', header=header, threads=threads) as writer:
+        for read in iterate_merged_reads(readers):
+            writer.write(read)
+
+    for reader in readers:
+        reader.close()
+
+    pysam.index(output, output + '.bai')
+
+
+class RegionWriters(object):
+    """
+    writes reads in coordinate order to the regions they overlap. a region
+    is only open while the reads are within it so few files are open at once,
+    finished regions are indexed in the background.
+    """
+
+    def __init__(self, outputs, header, threads=1):
+        """
+        :param outputs: dict of region to output bam
+        :param header: header for all outputs
+        :param threads: compression and indexing threads
+        """
+        self.outputs = outputs
+        self.header = header
+        self.threads = threads
+
+        self.regions = {}
+        for region in outputs:
+            chrom, start, end = parse_region(region)
+            self.regions.setdefault(chrom, []).append((start, end, region))
+
+        self.starts = {}
+        self.max_ends = {}
+        for chrom, regions in self.regions.items():
+            regions.sort()
+            self.starts[chrom] = [start for start, _, _ in regions]
+            # max end of the regions up to each index, regions may overlap
+            max_ends = []
+            for _, end, _ in regions:
+                max_ends.append(max(end, max_ends[-1]) if max_ends else end)
+            self.max_ends[chrom] = max_ends
+
+        self.writers = {}
+        self.finished = set()
+        self.chrom = None
+        # smallest end of the open regions
+        self.next_end = None
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+        self.index_jobs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_writer(self, region, end):
+        if region not in self.writers:
+            writer = pysam.AlignmentFile(
+                self.outputs[region], 'wb', header=self.header, threads=self.threads
+            )
+            self.writers[region] = (writer, end)
+            self.next_end = end if self.next_end is None else min(self.next_end, end)
+
+        return self.writers[region][0]
+
+    def close_writer(self, region):
+        writer, _ = self.writers.pop(region)
+        writer.close()
+        self.finished.add(region)
+
+        output = self.outputs[region]
+        self.index_jobs.append(self.pool.submit(pysam.index, output, output + '.bai'))
+
+    def close_finished(self, position=None):
+        """
+        close regions that end before position, reads are sorted so no
+        later read can overlap them. all regions are closed without position
+        """
+        for region, (_, end) in list(self.writers.items()):
+            if position is None or end <= position:
+                self.close_writer(region)
+
+        ends = [end for _, end in self.writers.values()]
+        self.next_end = min(ends) if ends else None
+
+    def write(self, read):
+        chrom = read.reference_name
+        start = read.reference_start
+
+        if chrom != self.chrom:
+            self.close_finished()
+            self.chrom = chrom
+        elif self.next_end is not None and start >= self.next_end:
+            self.close_finished(start)
+
+        if chrom not in self.regions:
+            return
+
+        end = read.reference_end
+        # unmapped reads placed with their mate cover a single base
+        if end is None or end <= start:
+            end = start + 1
+
+        regions = self.regions[chrom]
+        max_ends = self.max_ends[chrom]
+
+        idx = bisect.bisect_left(self.starts[chrom], end) - 1
+        while idx >= 0 and max_ends[idx] > start:
+            _, region_end, region = regions[idx]
+            if region_end > start:
+                self.get_writer(region, region_end).write(read)
+            idx -= 1
+
+    def close(self):
+        self.close_finished()
+
+        # regions without reads get an empty bam with the merged header
+        for region in self.outputs:
+            if region not in self.finished:
+                self.get_writer(region, 0)
+                self.close_writer(region)
+
+        for job in self.index_jobs:
+            job.result()
+
+        self.pool.shutdown()
+
+
+def merge_bams_by_region(bams, outputs, regions, tempdir, ncores=1, max_open_files=500):
+    """
+    merge cell bams into one bam per region in a single pass. each bam is
+    opened once and the reads are fanned out to the region bams as they
+    come off a k way merge. with more than max_open_files bams, groups of
+    bams are first merged into intermediate bams.
+
+    :param bams: list or dict of coordinate sorted and indexed bams
+    :param outputs: dict of region to output bam
+    :param regions: regions to write, chrom-start-end
+    :param tempdir: temp dir for intermediate bams
+    :param ncores: compression and indexing threads
+    :param max_open_files: max number of input bams open at once
+    """
+    if isinstance(bams, dict):
+        bams = list(bams.values())
+    bams = list(bams)
+
+    assert max_open_files > 1
+
+    header = get_merged_header(bams)
+
+    level = 0
+    while len(bams) > max_open_files:
+        level_dir = os.path.join(tempdir, 'level_{}'.format(level))
+        makedirs(level_dir)
+
+        merged = []
+        for idx in range(0, len(bams), max_open_files):
+            output = os.path.join(level_dir, '{}.bam'.format(idx // max_open_files))
+            merge_bam_files(bams[idx:idx + max_open_files], output, header, threads=ncores)
+            merged.append(output)
+
+        bams = merged
+        level += 1
+
+    outputs = {region: outputs[region] for region in regions}
+
+    readers = [pysam.AlignmentFile(bam, 'rb') for bam in bams]
+
+    with RegionWriters(outputs, header, threads=ncores) as writers:
+        for read in iterate_merged_reads(readers):
+            writers.write(read)
+
+    for reader in readers:
+        reader.close()
+
+
+def split_bam_by_region(bam, outputs, regions, ncores=1):
+    """
+    split a coordinate sorted bam into region bams with a single sequential
+    read, reads overlapping several regions are written to each of them
+
+    :param bam: coordinate sorted and indexed bam
+    :param outputs: dict of region to output bam
+    :param regions: regions to write, chrom-start-end
+    :param ncores: decompression, compression and indexing threads
+    """
+    outputs = {region: outputs[region] for region in regions}
+
+    with pysam.AlignmentFile(bam, 'rb', threads=ncores) as reader:
+        with RegionWriters(outputs, reader.header, threads=ncores) as writers:
+            for read in reader.fetch(until_eof=False):
+                writers.write(read)
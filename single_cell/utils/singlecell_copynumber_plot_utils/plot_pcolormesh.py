@@ -19,6 +19,7 @@ from matplotlib import pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 import logging
 from single_cell.utils import helpers
+from single_cell.utils import cnmatrixutils
 from single_cell.utils import csvutils
 from .heatmap import ClusterMap
 
@@ -117,6 +118,8 @@ class PlotPcolor(object):
 
         if extension in ['.hdf', '.h5']:
             return self.read_segs_hdf()
+        elif cnmatrixutils.is_cn_matrix(self.input):
+            return self.read_segs_matrix()
         else:
             return self.read_segs_csv()
 
@@ -223,6 +226,32 @@ class PlotPcolor(object):
 
         return data
 
+    def read_segs_matrix(self):
+        """
+        read the cell by bin matrix store
+        """
+        store = cnmatrixutils.CnMatrixInput(self.input)
+
+        data = store.read_column(self.column_name)
+
+        if self.mappability_threshold:
+            mappability = store.read_column('map')
+            data = data.mask(mappability <= self.mappability_threshold)
+
+        bins = {}
+        for chrom, start, end in data.columns:
+            if chrom not in bins:
+                bins[chrom] = set()
+            bins[chrom].add((start, end))
+
+        bins = self.sort_bins_csv(bins)
+
+        data = data.sort_index().reindex(columns=pd.MultiIndex.from_tuples(bins))
+        data.index.name = None
+        data.columns = bins
+
+        return data
+
     def sort_bins_csv(self, bins):
         """
         sort the bins based on genomic coords
@@ -0,0 +1,56 @@
+import gzip
+import os
+import struct
+import single_cell.utils.bgzfutils as bgzfutils
+
+
+def get_block_sizes(filepath):
+    with open(filepath, 'rb') as reader:
+        data = reader.read()
+
+    sizes = []
+    offset = 0
+    while offset < len(data):
+        assert data[offset:offset + 4] == b'\x1f\x8b\x08\x04'
+        assert data[offset + 12:offset + 14] == b'BC'
+        bsize = struct.unpack('<H', data[offset + 16:offset + 18])[0]
+        sizes.append(bsize + 1)
+        offset += bsize + 1
+
+    assert offset == len(data)
+
+    return sizes
+
+
+def test_bgzf_writer_threads(tmpdir):
+    lines = ['{},{},cell_{}\n'.format(i, i * 0.5, i % 7) for i in range(100000)]
+
+    for threads in [1, 4]:
+        output = os.path.join(str(tmpdir), 'out_{}.csv.gz'.format(threads))
+
+        with bgzfutils.BgzfWriter(output, threads=threads) as writer:
+            for line in lines:
+                writer.write(line)
+
+        with gzip.open(output, 'rt') as reader:
+            assert reader.read() == ''.join(lines)
+
+        sizes = get_block_sizes(output)
+        assert len(sizes) > 2
+        assert all(size <= 65536 for size in sizes)
+
+        with open(output, 'rb') as reader:
+            assert reader.read()[-28:] == bgzfutils.BGZF_EOF
+
+
+def test_bgzf_writer_append(tmpdir):
+    output = os.path.join(str(tmpdir), 'out.csv.gz')
+
+    with bgzfutils.BgzfWriter(output, threads=2) as writer:
+        writer.write('a,b\n')
+
+    with bgzfutils.BgzfWriter(output, mode='at', threads=2) as writer:
+        writer.write('1,2\n')
+
+    with gzip.open(output, 'rt') as reader:
+        assert reader.read() == 'a,b\n1,2\n'
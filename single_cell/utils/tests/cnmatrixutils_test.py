@@ -0,0 +1,144 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import single_cell.utils.csvutils as csvutils
+import single_cell.utils.cnmatrixutils as cnmatrixutils
+
+READS_DTYPES = {
+    'chr': 'str', 'start': 'int', 'end': 'int', 'cell_id': 'str',
+    'state': 'float', 'copy': 'float', 'reads': 'int', 'gc': 'float',
+    'map': 'float',
+}
+
+
+################################################
+#                  helpers                     #
+################################################
+
+
+def make_reads(cell_id, n_bins=30, seed=0):
+    rng = np.random.RandomState(seed)
+
+    df = pd.DataFrame({
+        'chr': np.repeat(['1', '2', 'X'], n_bins // 3),
+        'start': np.tile(np.arange(n_bins // 3) * 1000 + 1, 3),
+    })
+    df['end'] = df['start'] + 999
+    df['cell_id'] = cell_id
+    df['state'] = rng.randint(0, 6, n_bins).astype(float)
+    df['copy'] = df['state'] + rng.normal(0, 0.1, n_bins)
+    df['reads'] = rng.poisson(50, n_bins)
+    df['gc'] = rng.uniform(size=n_bins)
+    df['map'] = rng.uniform(size=n_bins)
+
+    return df
+
+
+def write_reads(tmpdir, n_cells):
+    frames = {}
+    files = {}
+    for i in range(n_cells):
+        cell_id = 'cell{:02d}'.format(i)
+        frames[cell_id] = make_reads(cell_id, seed=i)
+        files[cell_id] = os.path.join(str(tmpdir), cell_id + '.csv.gz')
+        csvutils.write_dataframe_to_csv_and_yaml(
+            frames[cell_id], files[cell_id], READS_DTYPES
+        )
+
+    return frames, files
+
+
+################################################
+#                  tests                       #
+################################################
+
+
+class TestCnMatrix(object):
+    """
+    class to test the cell by bin matrix store
+    """
+
+    def test_read_column(self, tmpdir):
+        frames, files = write_reads(tmpdir, 7)
+        output = os.path.join(str(tmpdir), 'reads.npz')
+
+        cnmatrixutils.CnMatrixOutput(output, chunksize=3).write_csv_files(files)
+
+        data = cnmatrixutils.read_cn_matrix(output, 'copy')
+
+        assert list(data.index) == sorted(frames)
+        for cell_id, df in frames.items():
+            assert np.allclose(data.loc[cell_id].values, df['copy'].values)
+
+    def test_read_column_cell_subset(self, tmpdir):
+        frames, files = write_reads(tmpdir, 7)
+        output = os.path.join(str(tmpdir), 'reads.npz')
+
+        cnmatrixutils.CnMatrixOutput(output, chunksize=3).write_csv_files(files)
+
+        cells = ['cell06', 'cell01', 'cell03']
+        data = cnmatrixutils.read_cn_matrix(output, 'reads', cells=cells)
+
+        assert list(data.index) == cells
+        for cell_id in cells:
+            assert np.array_equal(data.loc[cell_id].values, frames[cell_id]['reads'].values)
+
+    def test_missing_bins_are_nan(self, tmpdir):
+        frames, files = write_reads(tmpdir, 2)
+
+        df = frames['cell01'].iloc[5:]
+        csvutils.write_dataframe_to_csv_and_yaml(df, files['cell01'], READS_DTYPES)
+
+        output = os.path.join(str(tmpdir), 'reads.npz')
+        cnmatrixutils.write_cn_matrix(files, output)
+
+        data = cnmatrixutils.read_cn_matrix(output, 'state', cells=['cell01'])
+
+        assert data.iloc[0, :5].isnull().all()
+        assert np.array_equal(data.iloc[0, 5:].values, df['state'].values)
+
+    def test_unknown_bins(self, tmpdir):
+        frames, files = write_reads(tmpdir, 2)
+
+        df = frames['cell01']
+        df['start'] += 1
+        csvutils.write_dataframe_to_csv_and_yaml(df, files['cell01'], READS_DTYPES)
+
+        output = os.path.join(str(tmpdir), 'reads.npz')
+        with pytest.raises(cnmatrixutils.CnMatrixError):
+            cnmatrixutils.write_cn_matrix(files, output)
+
+    def test_unknown_cell(self, tmpdir):
+        _, files = write_reads(tmpdir, 2)
+        output = os.path.join(str(tmpdir), 'reads.npz')
+        cnmatrixutils.write_cn_matrix(files, output)
+
+        with pytest.raises(cnmatrixutils.CnMatrixError):
+            cnmatrixutils.read_cn_matrix(output, 'state', cells=['cell05'])
+
+    @pytest.mark.parametrize('write_header', [True, False])
+    def test_concatenate_callback(self, tmpdir, write_header):
+        """
+        headerless inputs are copied as gzip members, others are streamed
+        """
+        frames, files = write_reads(tmpdir, 5)
+        for cell_id, df in frames.items():
+            csvutils.write_dataframe_to_csv_and_yaml(
+                df, files[cell_id], READS_DTYPES, write_header=write_header
+            )
+
+        concatenated = os.path.join(str(tmpdir), 'reads.csv.gz')
+        output = os.path.join(str(tmpdir), 'reads.npz')
+
+        with cnmatrixutils.CnMatrixOutput(output, chunksize=2) as matrix:
+            csvutils.concatenate_csv(files, concatenated, callback=matrix.add_df)
+
+        merged = csvutils.read_csv_and_yaml(concatenated)
+        assert len(merged) == sum(len(df) for df in frames.values())
+
+        data = cnmatrixutils.read_cn_matrix(output, 'copy')
+
+        assert sorted(data.index) == sorted(frames)
+        for cell_id, df in frames.items():
+            assert np.allclose(data.loc[cell_id].values, df['copy'].values)
@@ -6,6 +6,7 @@ import random
 import pytest
 import itertools
 import single_cell.utils.tests.test_helpers as helpers
+import single_cell.utils.helpers as helpers_module
 
 
 ###############################################
@@ -352,6 +353,222 @@ class TestConcatCsvFilesPandas(helpers.ConcatHelpers):
         assert self.dfs_exact_match(ref, concatenated)
 
 
+class TestConcatCsvFilesStreaming(helpers.ConcatHelpers):
+    """
+    test class for csvutils concatenate_csv_files_streaming
+    """
+    def test_concat_csv_streaming(self, tmpdir, n_rows):
+        """
+        concat csvs in chunks smaller than the inputs
+        """
+        dtypes = {v: "int" for v in 'ABCD'}
+        concatenated = os.path.join(tmpdir, 'concat.csv.gz')
+
+        dfs, csvs, ref = self.base_test_concat(n_rows, [dtypes, dtypes, dtypes],
+                                               write=True, get_ref=True,
+                                               dir=tmpdir)
+
+        csvutils.concatenate_csv_files_streaming(
+            csvs, concatenated, dtypes, list(dtypes.keys()), chunksize=2
+        )
+
+        assert self.dfs_exact_match(ref, concatenated)
+
+    def test_concat_csv_streaming_column_order(self, tmpdir, n_rows):
+        """
+        inputs with different column orders and missing columns
+        """
+        dtypes1 = {v: "float" for v in 'ABCD'}
+        dtypes2 = {v: "float" for v in 'DCBE'}
+        concatenated = os.path.join(tmpdir, 'concat.csv.gz')
+
+        dfs, csvs, ref = self.base_test_concat(n_rows, [dtypes1, dtypes2],
+                                               write=True, get_ref=True,
+                                               dir=tmpdir)
+
+        csvutils.concatenate_csv(csvs, concatenated)
+
+        assert csvutils.CsvInput(concatenated).columns == list('ABCDE')
+        assert self.dfs_exact_match(ref, concatenated)
+
+
+class TestCsvOutputThreads(helpers.ConcatHelpers):
+    """
+    test class for CsvOutput with parallel compression
+    """
+    def test_write_df_threads(self, tmpdir, n_rows):
+        dtypes = {v: "int" for v in 'ABCD'}
+        output = os.path.join(tmpdir, 'output.csv.gz')
+
+        df = self.make_test_df(dtypes, n_rows * 1000)
+
+        csvutils.write_dataframe_to_csv_and_yaml(df, output, dtypes, threads=4)
+
+        assert self.dfs_exact_match(df, output)
+
+    def test_concat_csv_threads(self, tmpdir, n_rows):
+        dtypes = {v: "int" for v in 'ABCD'}
+        concatenated = os.path.join(tmpdir, 'concat.csv.gz')
+
+        dfs, csvs, ref = self.base_test_concat(n_rows, [dtypes, dtypes],
+                                               write=True, get_ref=True,
+                                               dir=tmpdir, write_head=False)
+
+        csvutils.concatenate_csv(csvs, concatenated, threads=4)
+
+        assert self.dfs_exact_match(ref, concatenated)
+
+
+class TestColumnar(helpers.ConcatHelpers):
+    """
+    test class for the columnar binary format
+    """
+    def test_columnar_round_trip(self, tmpdir, n_rows):
+        dtypes = {'A': 'int', 'B': 'float', 'C': 'str', 'D': 'bool'}
+        output = os.path.join(tmpdir, 'output.columnar')
+
+        df = self.make_test_df(dtypes, n_rows)
+        df.loc[1, 'B'] = np.nan
+        df.loc[2, 'C'] = np.nan
+
+        csvutils.write_dataframe_to_csv_and_yaml(df, output, dtypes)
+
+        data = csvutils.read_csv_and_yaml(output)
+
+        assert list(data.columns) == list(df.columns)
+        assert data['A'].dtype == np.int64
+        assert data['D'].dtype == bool
+        assert np.isnan(data.loc[1, 'B'])
+        assert pd.isnull(data.loc[2, 'C'])
+        assert self.dfs_exact_match(df, data)
+
+        assert csvutils.get_metadata(output)[1] == dtypes
+
+    def test_columnar_int_nans(self, tmpdir, n_rows):
+        dtypes = {'A': 'int', 'B': 'float'}
+        output = os.path.join(tmpdir, 'output.columnar')
+
+        df = self.make_test_df(dtypes, n_rows)
+        df['A'] = df['A'].astype(float)
+        df.loc[1, 'A'] = np.nan
+
+        with pytest.raises(pd.errors.IntCastingNaNError):
+            csvutils.write_dataframe_to_csv_and_yaml(df, output, dtypes)
+
+        with pytest.raises(pd.errors.IntCastingNaNError):
+            csvutils.write_dataframe_to_csv_and_yaml(df, output.replace('.columnar', '.csv.gz'), dtypes)
+
+        # nullable ints keep their nulls
+        csvutils.write_dataframe_to_csv_and_yaml(df, output, {'A': 'Int64', 'B': 'float'})
+
+        data = csvutils.read_csv_and_yaml(output)
+
+        assert pd.isnull(data.loc[1, 'A'])
+        assert data['A'].drop(1).tolist() == df['A'].drop(1).astype(int).tolist()
+
+    def test_columnar_row_groups(self, tmpdir, n_rows):
+        dtypes = {'A': 'int', 'B': 'float', 'C': 'str'}
+        output = os.path.join(tmpdir, 'output.columnar')
+
+        df = self.make_test_df(dtypes, n_rows)
+
+        csvoutput = csvutils.ColumnarOutput(output, dtypes, row_group_size=3)
+        csvoutput.write_df(df)
+
+        csvinput = csvutils.ColumnarInput(output)
+
+        chunks = list(csvinput.read_csv(chunksize=2, columns=['C', 'A']))
+        assert all(len(chunk) <= 2 for chunk in chunks)
+
+        data = pd.concat(chunks, ignore_index=True)
+        assert list(data.columns) == ['C', 'A']
+        assert self.dfs_exact_match(df[['C', 'A']], data)
+
+    def test_columnar_empty(self, tmpdir):
+        dtypes = {'A': 'int', 'B': 'str'}
+        output = os.path.join(tmpdir, 'output.columnar')
+
+        df = pd.DataFrame(columns=['A', 'B'])
+        csvutils.write_dataframe_to_csv_and_yaml(df, output, dtypes)
+
+        data = csvutils.read_csv_and_yaml(output)
+        assert data.empty
+        assert list(data.columns) == ['A', 'B']
+
+    def test_concat_columnar(self, tmpdir, n_rows):
+        dtypes = {v: "int" for v in 'ABCD'}
+        concatenated = os.path.join(tmpdir, 'concat.csv.gz')
+
+        dfs = self.make_test_dfs([dtypes, dtypes], n_rows)
+
+        inputs = []
+        for i, df in enumerate(dfs):
+            filename = os.path.join(tmpdir, 'input_{}.columnar'.format(i))
+            csvutils.write_dataframe_to_csv_and_yaml(
+                df, filename, dtypes, write_header=False
+            )
+            inputs.append(filename)
+
+        csvutils.concatenate_csv(inputs, concatenated)
+
+        ref = pd.concat(dfs, ignore_index=True)
+        assert self.dfs_exact_match(ref, concatenated)
+
+
+class TestReadCsvProjection(helpers.ConcatHelpers):
+    """
+    test class for column projection and row filters in read_csv_and_yaml
+    """
+    def get_test_file(self, tmpdir, n_rows, extension, write_header=True):
+        dtypes = {'A': 'int', 'B': 'float', 'C': 'str', 'D': 'bool'}
+        output = os.path.join(tmpdir, 'output' + extension)
+
+        df = self.make_test_df(dtypes, n_rows)
+        csvutils.write_dataframe_to_csv_and_yaml(
+            df, output, dtypes, write_header=write_header
+        )
+
+        return df, output
+
+    @pytest.mark.parametrize("extension", ['.csv.gz', '.columnar'])
+    def test_read_columns(self, tmpdir, n_rows, extension):
+        df, output = self.get_test_file(tmpdir, n_rows, extension)
+
+        data = csvutils.read_csv_and_yaml(output, columns=['C', 'A'])
+
+        assert list(data.columns) == ['C', 'A']
+        assert self.dfs_exact_match(df[['C', 'A']], data)
+
+    @pytest.mark.parametrize("extension", ['.csv.gz', '.columnar'])
+    def test_read_filters(self, tmpdir, n_rows, extension):
+        df, output = self.get_test_file(tmpdir, n_rows, extension)
+
+        cells = list(df['C'].iloc[::2])
+        filters = [['C', 'in', cells], ['A', 'ge', 1], ['D', 'in', [True]]]
+
+        data = csvutils.read_csv_and_yaml(output, columns=['A'], filters=filters)
+
+        ref = helpers_module.filter_metrics(df, filters)
+        assert list(data.columns) == ['A']
+        assert data['A'].tolist() == ref['A'].tolist()
+
+    def test_read_filters_chunks_no_header(self, tmpdir, n_rows):
+        df, output = self.get_test_file(tmpdir, n_rows, '.csv.gz', write_header=False)
+
+        filters = [['A', 'lt', 2]]
+        chunks = csvutils.read_csv_and_yaml(output, chunksize=2, filters=filters)
+        data = pd.concat(list(chunks), ignore_index=True)
+
+        assert data['A'].tolist() == [0, 1]
+        assert set(data.columns) == set(df.columns)
+
+    def test_read_unknown_column(self, tmpdir, n_rows):
+        _, output = self.get_test_file(tmpdir, n_rows, '.csv.gz')
+
+        with pytest.raises(csvutils.CsvParseError):
+            csvutils.read_csv_and_yaml(output, columns=['A', 'E'])
+
+
 class TestConcatCsvFilesQuickLowMem(helpers.ConcatHelpers):
     """
     test class for csvutils concat_csv_files_quick_lowmem
@@ -387,6 +604,42 @@ class TestConcatCsvFilesQuickLowMem(helpers.ConcatHelpers):
 
         assert self.dfs_exact_match(ref, concatenated)
 
+    def test_quick_concat_copies_gzip_members(self, tmpdir, n_rows):
+        """
+        inputs are appended as is after the header member
+        """
+        dtypes = {v: "int" for v in 'ABCD'}
+        concatenated = os.path.join(tmpdir, 'concat.csv.gz')
+
+        dfs, csvs, ref = self.base_test_concat(n_rows, [dtypes, dtypes],
+                                               write=True, get_ref=True,
+                                               dir=tmpdir, write_head=False)
+
+        csvutils.concatenate_csv_files_quick_lowmem(csvs, concatenated, dtypes, list(dtypes.keys()))
+
+        with open(concatenated, 'rb') as reader:
+            data = reader.read()
+
+        for csv in csvs:
+            with open(csv, 'rb') as reader:
+                assert reader.read() in data
+
+        assert self.dfs_exact_match(ref, concatenated)
+
+    def test_quick_concat_column_mismatch(self, tmpdir, n_rows):
+        """
+        inputs with a different number of fields are rejected
+        """
+        dtypes = {v: "int" for v in 'ABCD'}
+        concatenated = os.path.join(tmpdir, 'concat.csv.gz')
+
+        dfs, csvs = self.base_test_concat(n_rows, [dtypes, {v: "int" for v in 'ABC'}],
+                                          write=True, dir=tmpdir, write_head=False)
+
+        assert self._raises_correct_error(csvutils.concatenate_csv_files_quick_lowmem,
+                                          csvs, concatenated, dtypes, list(dtypes.keys()),
+                                          expected_error=csvutils.CsvConcatException)
+
 
 class TestWriteMetadata(helpers.WriteHelpers):
     """
@@ -0,0 +1,113 @@
+import gzip
+import itertools
+import os
+import random
+
+import pytest
+
+import single_cell.workflows.align.fastqscreen_utils as utils
+from single_cell.utils import fastqutils
+
+GENOMES = ['grch37_path0', 'grch37_path1', 'mm10', 'salmon']
+
+
+def simulate_tagged_fastqs(r1, r2, n_reads, seed=0):
+    rng = random.Random(seed)
+
+    with gzip.open(r1, 'wt') as r1_out, gzip.open(r2, 'wt') as r2_out:
+        for i in range(n_reads):
+            for writer in [r1_out, r2_out]:
+                flags = ''.join(str(rng.choice([0, 1, 2])) for _ in GENOMES)
+                if i == 0:
+                    flags = ':'.join(GENOMES) + ':' + flags
+                writer.write('@READ{}#FQST:{}\n'.format(i, flags))
+                writer.write('ACGT' * 10 + '\n')
+                writer.write('+\n')
+                writer.write('IIII' * 10 + '\n')
+
+
+def read_lines(filepath):
+    with gzip.open(filepath, 'rt') as reader:
+        return reader.readlines()
+
+
+def test_filter_and_count_matches_separate_passes(tmpdir):
+    tmpdir = str(tmpdir)
+
+    r1 = os.path.join(tmpdir, 'R1.fastq.gz')
+    r2 = os.path.join(tmpdir, 'R2.fastq.gz')
+    simulate_tagged_fastqs(r1, r2, 500)
+
+    params = {
+        'genomes': [
+            {'name': 'grch37', 'paths': ['a', 'b']},
+            {'name': 'mm10', 'paths': 'c'},
+            {'name': 'salmon', 'paths': 'd'},
+        ],
+        'filter_tags': ['010', '001'],
+    }
+
+    # regroup, count and filter with a pass each
+    fixed_r1 = os.path.join(tmpdir, 'R1.fixed.fastq.gz')
+    fixed_r2 = os.path.join(tmpdir, 'R2.fixed.fastq.gz')
+    utils.regroup_genomes(r1, fixed_r1)
+    utils.regroup_genomes(r2, fixed_r2)
+
+    ref_counts = fastqutils.PairedTaggedFastqReader(fixed_r1, fixed_r2).gather_counts()
+
+    ref_r1 = os.path.join(tmpdir, 'R1.ref.fastq.gz')
+    ref_r2 = os.path.join(tmpdir, 'R2.ref.fastq.gz')
+    utils.filter_tag_reads(fixed_r1, fixed_r2, ref_r1, ref_r2, params)
+
+    out_r1 = os.path.join(tmpdir, 'R1.out.fastq.gz')
+    out_r2 = os.path.join(tmpdir, 'R2.out.fastq.gz')
+    counts = utils.filter_and_count_tag_reads(r1, r2, out_r1, out_r2, params)
+
+    assert counts == ref_counts
+    assert read_lines(out_r1) == read_lines(ref_r1)
+    assert read_lines(out_r2) == read_lines(ref_r2)
+    assert 0 < len(read_lines(out_r1)) < 500 * 4
+
+
+def read_records_with_islice(filepath):
+    records = []
+    with gzip.open(filepath, 'rt') as reader:
+        while True:
+            record = list(itertools.islice(reader, 4))
+            if not record:
+                break
+            records.append(record)
+    return records
+
+
+def test_block_parser_matches_line_reader(tmpdir):
+    tmpdir = str(tmpdir)
+
+    r1 = os.path.join(tmpdir, 'R1.fastq.gz')
+    r2 = os.path.join(tmpdir, 'R2.fastq.gz')
+    simulate_tagged_fastqs(r1, r2, 500)
+
+    expected = read_records_with_islice(r1)
+
+    # block sizes that split lines and records
+    for block_size in [7, 100, 1000, fastqutils.BLOCK_SIZE]:
+        with open(r1, 'rb') as reader:
+            reader = gzip.GzipFile(fileobj=reader)
+            records = list(fastqutils.parse_fastq_blocks(reader, block_size=block_size))
+
+        assert [list(record) for record in records] == expected
+
+
+def test_block_parser_truncated_record(tmpdir):
+    fastq = os.path.join(str(tmpdir), 'R1.fastq.gz')
+    with gzip.open(fastq, 'wt') as writer:
+        writer.write('@READ1\nACGT\n+\nIIII\n@READ2\nACGT\n')
+
+    with pytest.raises(AssertionError):
+        list(fastqutils.FastqReader(fastq).get_read_iterator())
+
+
+def test_read_name():
+    assert fastqutils._get_read_name('@HISEQ101_144:5:1101:6674:43220#FQST:1000\n') == '@HISEQ101_144:5:1101:6674:43220'
+    assert fastqutils._get_read_name('@READ1/1 1:N:0:ACGT\n') == '@READ1'
+    assert fastqutils._get_read_name('@READ1\tFS:Z:grch37_1\n') == '@READ1'
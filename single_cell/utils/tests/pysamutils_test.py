@@ -0,0 +1,268 @@
+import os
+import random
+
+import pysam
+import pytest
+import single_cell.utils.pysamutils as pysamutils
+import yaml
+from single_cell.utils import inpututils
+
+CHROMS = [('1', 5000), ('2', 3000), ('3', 1000)]
+
+REGIONS = ['1-1-2000', '1-2001-4000', '1-4001-5000', '2-1-3000', '3-1-1000']
+
+
+def simulate_cell_bam(bamfile, cell_id, n_reads=200, seed=0):
+    rng = random.Random(seed)
+
+    header = {
+        'HD': {'VN': '1.6', 'SO': 'coordinate'},
+        'SQ': [{'SN': name, 'LN': length} for name, length in CHROMS],
+        'RG': [{'ID': cell_id, 'SM': cell_id, 'LB': 'lib'}],
+        'PG': [{'ID': 'bwa', 'PN': 'bwa'}],
+    }
+
+    # chromosome 3 has no reads so its region bam is empty
+    reads = []
+    for i in range(n_reads):
+        ref_id = rng.randint(0, 1)
+        read = pysam.AlignedSegment()
+        read.query_name = '{}_{}'.format(cell_id, i)
+        read.query_sequence = 'A' * 100
+        read.query_qualities = pysam.qualitystring_to_array('I' * 100)
+        read.reference_id = ref_id
+        read.reference_start = rng.randint(0, CHROMS[ref_id][1] - 100)
+        read.cigarstring = rng.choice(['100M', '50M200N50M'])
+        read.flag = 16 if rng.random() < 0.5 else 0
+        read.mapping_quality = 60
+        read.set_tag('RG', cell_id)
+
+        if rng.random() < 0.05:
+            # unmapped read placed with its mate
+            read.flag |= 1 | 4
+            read.cigarstring = None
+
+        reads.append(read)
+
+    reads.sort(key=lambda read: (read.reference_id, read.reference_start))
+
+    with pysam.AlignmentFile(bamfile, 'wb', header=header) as writer:
+        for read in reads:
+            writer.write(read)
+
+    pysam.index(bamfile)
+
+
+def expected_region_reads(bams, region):
+    chrom, start, end = pysamutils.parse_region(region)
+
+    reads = []
+    for bam in bams:
+        with pysam.AlignmentFile(bam, 'rb') as reader:
+            reads.extend(read.to_string() for read in reader.fetch(chrom, start, end))
+
+    return reads
+
+
+def read_bam(bamfile):
+    with pysam.AlignmentFile(bamfile, 'rb') as reader:
+        header = reader.header.to_dict()
+        reads = [read.to_string() for read in reader.fetch()]
+
+    return header, reads
+
+
+def get_position(read):
+    return int(read.split('\t')[3])
+
+
+@pytest.fixture
+def cell_bams(tmpdir):
+    bams = {}
+    for i in range(5):
+        cell_id = 'cell{}'.format(i)
+        bams[cell_id] = os.path.join(str(tmpdir), cell_id + '.bam')
+        simulate_cell_bam(bams[cell_id], cell_id, seed=i)
+
+    return bams
+
+
+@pytest.mark.parametrize('max_open_files', [500, 2])
+def test_merge_bams_by_region(tmpdir, cell_bams, max_open_files):
+    outdir = os.path.join(str(tmpdir), 'merged')
+    os.makedirs(outdir)
+    outputs = {region: os.path.join(outdir, region + '.bam') for region in REGIONS}
+
+    pysamutils.merge_bams_by_region(
+        cell_bams, outputs, REGIONS, os.path.join(str(tmpdir), 'temp'),
+        ncores=2, max_open_files=max_open_files
+    )
+
+    bams = list(cell_bams.values())
+
+    for region in REGIONS:
+        header, reads = read_bam(outputs[region])
+
+        assert os.path.exists(outputs[region] + '.bai')
+        assert [rg['ID'] for rg in header['RG']] == list(cell_bams.keys())
+        assert [pg['ID'] for pg in header['PG']] == ['bwa']
+
+        expected = expected_region_reads(bams, region)
+        assert sorted(reads) == sorted(expected)
+
+        positions = [get_position(read) for read in reads]
+        assert positions == sorted(positions)
+
+        # reads of a cell keep their order in the cell bam
+        for cell_id in cell_bams:
+            cell_reads = [read for read in reads if read.endswith('RG:Z:' + cell_id)]
+            assert cell_reads == [read for read in expected if read.endswith('RG:Z:' + cell_id)]
+
+    assert read_bam(outputs['3-1-1000'])[1] == []
+
+
+def test_merge_bams_mismatched_sequences(tmpdir, cell_bams):
+    other = os.path.join(str(tmpdir), 'other.bam')
+    header = {'HD': {'VN': '1.6'}, 'SQ': [{'SN': '1', 'LN': 10}]}
+    with pysam.AlignmentFile(other, 'wb', header=header):
+        pass
+
+    with pytest.raises(ValueError):
+        pysamutils.get_merged_header(list(cell_bams.values()) + [other])
+
+
+def test_split_bam_by_region(tmpdir, cell_bams):
+    bam = cell_bams['cell0']
+
+    outdir = os.path.join(str(tmpdir), 'split')
+    os.makedirs(outdir)
+    outputs = {region: os.path.join(outdir, region + '.bam') for region in REGIONS}
+
+    pysamutils.split_bam_by_region(bam, outputs, REGIONS, ncores=2)
+
+    with pysam.AlignmentFile(bam, 'rb') as reader:
+        input_header = reader.header.to_dict()
+
+    for region in REGIONS:
+        header, reads = read_bam(outputs[region])
+
+        assert os.path.exists(outputs[region] + '.bai')
+        assert header == input_header
+        assert reads == expected_region_reads([bam], region)
+
+
+def simulate_dense_bam(bamfile, seed=0):
+    rng = random.Random(seed)
+
+    lengths = [('1', 2000000), ('2', 1000000)]
+    header = {
+        'HD': {'VN': '1.6', 'SO': 'coordinate'},
+        'SQ': [{'SN': name, 'LN': length} for name, length in lengths],
+    }
+
+    # most of the reads pile up in the first 200kb of chromosome 1
+    starts = [(0, rng.randint(0, 200000)) for _ in range(40000)]
+    starts += [(0, rng.randint(0, 1999900)) for _ in range(10000)]
+    starts += [(1, rng.randint(0, 999900)) for _ in range(10000)]
+
+    with pysam.AlignmentFile(bamfile, 'wb', header=header) as writer:
+        for i, (ref_id, start) in enumerate(sorted(starts)):
+            read = pysam.AlignedSegment()
+            read.query_name = 'read{}'.format(i)
+            read.query_sequence = ''.join(rng.choice('ACGT') for _ in range(100))
+            read.query_qualities = pysam.qualitystring_to_array('I' * 100)
+            read.reference_id = ref_id
+            read.reference_start = start
+            read.cigarstring = '100M'
+            read.mapping_quality = 60
+            writer.write(read)
+
+    pysam.index(bamfile)
+
+    return dict(lengths)
+
+
+def count_region_reads(bam, region):
+    chrom, start, end = pysamutils.parse_region(region)
+
+    # count reads by start so reads on region boundaries count once
+    with pysam.AlignmentFile(bam, 'rb') as reader:
+        return sum(start <= read.reference_start < end for read in reader.fetch(chrom, start, end))
+
+
+def test_get_balanced_regions(tmpdir):
+    bam = os.path.join(str(tmpdir), 'dense.bam')
+    lengths = simulate_dense_bam(bam)
+
+    window_sizes = pysamutils.get_bam_window_sizes([bam])
+    regions = pysamutils.get_balanced_regions(lengths, window_sizes, 10)
+
+    # regions tile the chromosomes
+    for chrom, length in lengths.items():
+        bounds = [pysamutils.parse_region(region)[1:] for region in regions
+                  if region.startswith(chrom + '-')]
+        assert bounds[0][0] == 0
+        assert bounds[-1][1] == length
+        assert all(prev[1] == curr[0] for prev, curr in zip(bounds, bounds[1:]))
+
+    counts = [count_region_reads(bam, region) for region in regions]
+    assert sum(counts) == 60000
+
+    fixed = pysamutils.get_regions(lengths, 300000)
+    fixed_counts = [count_region_reads(bam, region) for region in fixed]
+
+    assert 8 <= len(regions) <= 12
+    assert max(counts) < 0.5 * max(fixed_counts)
+    assert max(counts) < 2 * sum(counts) / len(counts)
+
+
+def test_get_balanced_regions_without_reads():
+    lengths = {'1': 100000, '2': 50000}
+
+    regions = pysamutils.get_balanced_regions(lengths, {}, 3, window_size=10000)
+
+    assert regions == ['1-1-50000', '1-50001-100000', '2-1-50000']
+
+
+def test_write_balanced_regions_shared(tmpdir, cell_bams):
+    reference = os.path.join(str(tmpdir), 'ref.fa')
+    with open(reference, 'w') as writer:
+        for name, length in CHROMS:
+            writer.write('>{}\n{}\n'.format(name, 'A' * length))
+
+    normal_bam = os.path.join(str(tmpdir), 'normal.bam')
+    simulate_cell_bam(normal_bam, 'normal', n_reads=1000, seed=10)
+
+    regions_file = os.path.join(str(tmpdir), 'regions.yaml')
+    pysamutils.write_balanced_regions(
+        normal_bam, cell_bams, reference, 4, ['1', '2', '3'], regions_file
+    )
+
+    regions = pysamutils.load_regions(regions_file)
+
+    splitdir = os.path.join(str(tmpdir), 'split')
+    mergedir = os.path.join(str(tmpdir), 'merged')
+    os.makedirs(splitdir)
+    os.makedirs(mergedir)
+
+    normals = {region: os.path.join(splitdir, region + '.bam') for region in regions}
+    tumours = {region: os.path.join(mergedir, region + '.bam') for region in regions}
+
+    pysamutils.split_bam_by_region(normal_bam, normals, regions)
+    pysamutils.merge_bams_by_region(
+        cell_bams, tumours, regions, os.path.join(str(tmpdir), 'temp')
+    )
+
+    # variant calling pairs the normal and tumour region bams by region
+    input_yaml = os.path.join(str(tmpdir), 'input.yaml')
+    with open(input_yaml, 'w') as writer:
+        yaml.safe_dump({
+            'normal': {region: {'bam': normals[region]} for region in regions},
+            'tumour': {region: {'bam': tumours[region]} for region in regions},
+        }, writer)
+
+    normal_bams, tumour_bams = inpututils.load_variant_calling_input(input_yaml)
+
+    assert normal_bams.keys() == tumour_bams.keys() == set(regions)
+    assert all(os.path.exists(bam) for bam in list(normal_bams.values()) + list(tumour_bams.values()))
+    assert len(regions) >= 3
@@ -47,6 +47,11 @@ def validate_split_wgs_bam(yamldata):
     utils.check_data_type(['bam'], str, data)
 
 
+def validate_plan_regions(yamldata):
+    validate_split_wgs_bam(yamldata)
+    validate_merge_cell_bams(yamldata)
+
+
 def validate_variant_calling(yamldata):
     normals = yamldata['normal']
     for region in normals:
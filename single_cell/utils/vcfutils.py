@@ -10,6 +10,7 @@ import os
 import biowrappers.components.io.vcf.tasks as vcf_tasks
 import vcf
 from single_cell.utils import helpers
+from single_cell.workflows.strelka import _merge
 
 
 def _get_header(infile):
@@ -72,7 +73,7 @@ def concatenate_vcf(infiles, outfile):
                     ofile.write(l)
 
 
-def merge_vcf(infiles, outfile, tempdir):
+def merge_vcf(infiles, outfile, tempdir, ncores=1):
     vcf_files = []
     for infile in infiles:
         if isinstance(infile, str):
@@ -87,7 +88,10 @@ def merge_vcf(infiles, outfile, tempdir):
     helpers.makedirs(tempdir)
     temp_output = os.path.join(tempdir, 'merged.vcf')
 
-    vcf_tasks.merge_vcfs(vcf_files, temp_output)
+    _merge.merge_vcfs(
+        vcf_files, temp_output, ncores=ncores,
+        tempdir=os.path.join(tempdir, 'parts')
+    )
 
     vcf_tasks.finalise_vcf(temp_output, outfile)
 
@@ -4,8 +4,11 @@ Created on Jul 6, 2017
 @author: dgrewal
 '''
 
+from collections import Counter
+
 import pypeliner
 import pypeliner.managed as mgd
+from single_cell.workflows.align.align_tasks import get_align_lanes_memory
 from single_cell.workflows.align.dtypes import dtypes
 
 
@@ -58,50 +61,113 @@ def bam_metrics_workflow(
         value=cell_ids,
     )
 
-    workflow.transform(
-        name='get_duplication_wgs_flagstat_metrics',
-        axes=('cell_id',),
-        func="single_cell.workflows.align.tasks.picard_wgs_dup",
-        args=(
-            mgd.InputFile('sorted_markdups', 'cell_id', fnames=bam_filename),
-            mgd.TempOutputFile("temp_markdup_bam.bam", 'cell_id'),
-            mgd.OutputFile('markdups_metrics', 'cell_id', fnames=markdups_metrics_percell),
-            mgd.TempSpace('tempdir_markdups', 'cell_id'),
-            ref_genome,
-            mgd.OutputFile('wgs_metrics_percell', 'cell_id', fnames=wgs_metrics_percell),
-            config['picard_wgs_params'],
-        ),
-    )
+    if config['combined_bam_metrics']:
+        workflow.transform(
+            name='get_reference_stats',
+            ctx={'mem': config['memory']['med'], 'ncpus': 1},
+            func="single_cell.workflows.align.bam_metrics.get_reference_stats",
+            args=(
+                ref_genome,
+                mgd.TempOutputFile('reference_stats.yaml'),
+            ),
+        )
 
-    workflow.transform(
-        name='bam_collect_gc_insert_metrics',
-        ctx={'mem': config['memory']['med'], 'ncpus': 1},
-        func="single_cell.workflows.align.tasks.picard_insert_gc_flagstat",
-        axes=('cell_id',),
-        args=(
-            mgd.InputFile('sorted_markdups', 'cell_id', fnames=bam_filename),
-            ref_genome,
-            mgd.OutputFile('gc_metrics_percell', 'cell_id', fnames=gc_metrics_percell),
-            mgd.OutputFile('gc_metrics_summary_percell', 'cell_id', fnames=gc_metrics_summary_percell),
-            mgd.OutputFile('gc_metrics_pdf_percell', 'cell_id', fnames=gc_metrics_pdf_percell),
-            mgd.TempSpace('gc_tempdir', 'cell_id'),
-            mgd.OutputFile('flagstat_metrics_percell', 'cell_id', fnames=flagstat_metrics_percell),
-            mgd.OutputFile('insert_metrics_percell', 'cell_id', fnames=insert_metrics_percell),
-            mgd.OutputFile('insert_metrics_pdf_percell', 'cell_id', fnames=insert_metrics_pdf_percell),
-        ),
-    )
+        workflow.transform(
+            name='bam_collect_all_metrics',
+            ctx={'mem': config['memory']['med'], 'ncpus': 1},
+            func="single_cell.workflows.align.bam_metrics.collect_bam_metrics",
+            axes=('cell_id',),
+            args=(
+                mgd.InputFile('sorted_markdups', 'cell_id', fnames=bam_filename, extensions=['.bai']),
+                ref_genome,
+                mgd.TempInputFile('reference_stats.yaml'),
+                mgd.OutputFile('markdups_metrics', 'cell_id', fnames=markdups_metrics_percell),
+                mgd.OutputFile('flagstat_metrics_percell', 'cell_id', fnames=flagstat_metrics_percell),
+                mgd.OutputFile('wgs_metrics_percell', 'cell_id', fnames=wgs_metrics_percell),
+                mgd.OutputFile('gc_metrics_percell', 'cell_id', fnames=gc_metrics_percell),
+                mgd.OutputFile('gc_metrics_summary_percell', 'cell_id', fnames=gc_metrics_summary_percell),
+                mgd.OutputFile('gc_metrics_pdf_percell', 'cell_id', fnames=gc_metrics_pdf_percell),
+                mgd.OutputFile('insert_metrics_percell', 'cell_id', fnames=insert_metrics_percell),
+                mgd.OutputFile('insert_metrics_pdf_percell', 'cell_id', fnames=insert_metrics_pdf_percell),
+                mgd.TempOutputFile('coverage_metrics.yaml', 'cell_id'),
+                mgd.InputInstance('cell_id'),
+                config['picard_wgs_params'],
+            ),
+            kwargs={
+                'alignment_metrics': mgd.TempOutputFile(
+                    'alignment_metrics_percell.csv.gz', 'cell_id', extensions=['.yaml']
+                ),
+            }
+        )
 
-    workflow.transform(
-        name='bam_coverage_metrics',
-        ctx={'mem': config['memory']['med'], 'ncpus': 1},
-        func="single_cell.workflows.align.coverage_metrics.get_coverage_data",
-        axes=('cell_id',),
-        args=(
-            mgd.InputFile('sorted_markdups', 'cell_id', fnames=bam_filename, extensions=['.bai']),
-            mgd.TempOutputFile('coverage_metrics.yaml', 'cell_id'),
-            mgd.InputInstance('cell_id')
-        ),
-    )
+        workflow.transform(
+            name='collect_metrics',
+            ctx={'mem': config['memory']['med'], 'ncpus': 1},
+            func="single_cell.utils.csvutils.concatenate_csv",
+            args=(
+                mgd.TempInputFile('alignment_metrics_percell.csv.gz', 'cell_id', extensions=['.yaml']),
+                mgd.TempOutputFile("alignment_metrics.csv.gz", extensions=['.yaml']),
+            ),
+        )
+    else:
+        workflow.transform(
+            name='get_duplication_wgs_flagstat_metrics',
+            axes=('cell_id',),
+            func="single_cell.workflows.align.tasks.picard_wgs_dup",
+            args=(
+                mgd.InputFile('sorted_markdups', 'cell_id', fnames=bam_filename),
+                mgd.TempOutputFile("temp_markdup_bam.bam", 'cell_id'),
+                mgd.OutputFile('markdups_metrics', 'cell_id', fnames=markdups_metrics_percell),
+                mgd.TempSpace('tempdir_markdups', 'cell_id'),
+                ref_genome,
+                mgd.OutputFile('wgs_metrics_percell', 'cell_id', fnames=wgs_metrics_percell),
+                config['picard_wgs_params'],
+            ),
+        )
+
+        workflow.transform(
+            name='bam_collect_gc_insert_metrics',
+            ctx={'mem': config['memory']['med'], 'ncpus': 1},
+            func="single_cell.workflows.align.tasks.picard_insert_gc_flagstat",
+            axes=('cell_id',),
+            args=(
+                mgd.InputFile('sorted_markdups', 'cell_id', fnames=bam_filename),
+                ref_genome,
+                mgd.OutputFile('gc_metrics_percell', 'cell_id', fnames=gc_metrics_percell),
+                mgd.OutputFile('gc_metrics_summary_percell', 'cell_id', fnames=gc_metrics_summary_percell),
+                mgd.OutputFile('gc_metrics_pdf_percell', 'cell_id', fnames=gc_metrics_pdf_percell),
+                mgd.TempSpace('gc_tempdir', 'cell_id'),
+                mgd.OutputFile('flagstat_metrics_percell', 'cell_id', fnames=flagstat_metrics_percell),
+                mgd.OutputFile('insert_metrics_percell', 'cell_id', fnames=insert_metrics_percell),
+                mgd.OutputFile('insert_metrics_pdf_percell', 'cell_id', fnames=insert_metrics_pdf_percell),
+            ),
+        )
+
+        workflow.transform(
+            name='bam_coverage_metrics',
+            ctx={'mem': config['memory']['med'], 'ncpus': 1},
+            func="single_cell.workflows.align.coverage_metrics.get_coverage_data",
+            axes=('cell_id',),
+            args=(
+                mgd.InputFile('sorted_markdups', 'cell_id', fnames=bam_filename, extensions=['.bai']),
+                mgd.TempOutputFile('coverage_metrics.yaml', 'cell_id'),
+                mgd.InputInstance('cell_id')
+            ),
+        )
+
+        workflow.transform(
+            name='collect_metrics',
+            ctx={'mem': config['memory']['med'], 'ncpus': 1},
+            func="single_cell.workflows.align.tasks.collect_metrics",
+            args=(
+                mgd.InputFile('flagstat_metrics', 'cell_id', axes_origin=[], fnames=flagstat_metrics_percell),
+                mgd.InputFile('markdups_metrics', 'cell_id', axes_origin=[], fnames=markdups_metrics_percell),
+                mgd.InputFile('insert_metrics_percell', 'cell_id', axes_origin=[], fnames=insert_metrics_percell),
+                mgd.InputFile('wgs_metrics_percell', 'cell_id', axes_origin=[], fnames=wgs_metrics_percell),
+                mgd.TempSpace("tempdir_collect_metrics"),
+                mgd.TempOutputFile("alignment_metrics.csv.gz", extensions=['.yaml']),
+            ),
+        )
 
     workflow.transform(
         name="collect_gc_metrics",
@@ -114,20 +180,6 @@ def bam_metrics_workflow(
         ),
     )
 
-    workflow.transform(
-        name='collect_metrics',
-        ctx={'mem': config['memory']['med'], 'ncpus': 1},
-        func="single_cell.workflows.align.tasks.collect_metrics",
-        args=(
-            mgd.InputFile('flagstat_metrics', 'cell_id', axes_origin=[], fnames=flagstat_metrics_percell),
-            mgd.InputFile('markdups_metrics', 'cell_id', axes_origin=[], fnames=markdups_metrics_percell),
-            mgd.InputFile('insert_metrics_percell', 'cell_id', axes_origin=[], fnames=insert_metrics_percell),
-            mgd.InputFile('wgs_metrics_percell', 'cell_id', axes_origin=[], fnames=wgs_metrics_percell),
-            mgd.TempSpace("tempdir_collect_metrics"),
-            mgd.TempOutputFile("alignment_metrics.csv.gz", extensions=['.yaml']),
-        ),
-    )
-
     workflow.transform(
         name='annotate_metrics',
         ctx={'mem': config['memory']['med'], 'ncpus': 1},
@@ -213,8 +265,16 @@ def create_alignment_workflow(
         value=list(fastq_1_filename.keys()),
     )
 
+    # each lane aligned in parallel needs memory for its own bwa index
+    lanes_per_cell = Counter(cell_id for cell_id, _ in fastq_1_filename.keys())
+    align_memory = get_align_lanes_memory(
+        max(lanes_per_cell.values()), config['max_cores'],
+        max_lanes=config['max_parallel_lanes']
+    )
+
     workflow.transform(
         name='align_reads',
+        ctx={'mem': align_memory, 'ncpus': config['max_cores']},
         axes=('cell_id',),
         func="single_cell.workflows.align.align_tasks.align_lanes",
         args=(
@@ -236,6 +296,11 @@ def create_alignment_workflow(
             trim,
             center
         ),
+        kwargs={
+            'ncores': config['max_cores'],
+            'streaming': config['streaming_alignment'],
+            'max_lanes': config['max_parallel_lanes'],
+        }
     )
 
     workflow.transform(
@@ -1,5 +1,6 @@
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 import pypeliner
 import single_cell.workflows.align.fastqscreen as fastqscreen
@@ -12,13 +13,20 @@ from .scripts import RunTrimGalore
 
 def merge_postprocess_bams(inputs, output, tempdir):
     helpers.makedirs(tempdir)
-    merged_out = os.path.join(tempdir, 'merged_lanes.bam')
 
-    picardutils.merge_bams(inputs, merged_out)
-    bamutils.bam_index(merged_out, merged_out + '.bai')
+    # lane bams are sorted, merging keeps coordinate order so the merged
+    # bam only needs sorting if an input wasnt
+    if len(inputs) == 1:
+        merged_out = inputs[0]
+    else:
+        merged_out = os.path.join(tempdir, 'merged_lanes.bam')
+        picardutils.merge_bams(inputs, merged_out)
 
-    sorted_bam = os.path.join(tempdir, 'sorted.bam')
-    picardutils.bam_sort(merged_out, sorted_bam, tempdir)
+    if all(bamutils.is_coordinate_sorted(bam) for bam in inputs):
+        sorted_bam = merged_out
+    else:
+        sorted_bam = os.path.join(tempdir, 'sorted.bam')
+        picardutils.bam_sort(merged_out, sorted_bam, tempdir)
 
     markdups_metrics = os.path.join(tempdir, 'markdups_metrics.txt')
     picardutils.bam_markdups(sorted_bam, output, markdups_metrics, tempdir)
@@ -115,11 +123,13 @@ def trim_fastqs(fastq1, fastq2, cell_id, tempdir, adapter, adapter2):
 
 
 def align_pe_with_bwa(
-        fastq1, fastq2, output, reference, readgroup, tempdir
+        fastq1, fastq2, output, reference, readgroup, tempdir, threads=1
 ):
     samfile = os.path.join(tempdir, "bwamem.sam")
 
-    bamutils.bwa_mem_paired_end(fastq1, fastq2, samfile, reference, readgroup)
+    bamutils.bwa_mem_paired_end(
+        fastq1, fastq2, samfile, reference, readgroup, threads=threads
+    )
 
     bamutils.samtools_sam_to_bam(samfile, output)
 
@@ -128,7 +138,8 @@ def align_pe(
         fastq1, fastq2, output, reports_dir, tempdir, reference,
         trim, center, sample_info, cell_id, lane_id, library_id,
         adapter, adapter2, fastqscreen_detailed_metrics,
-        fastqscreen_summary_metrics, fastqscreen_params,
+        fastqscreen_summary_metrics, fastqscreen_params, bwa_threads=1,
+        streaming=False
 ):
     fastqscreen_tempdir = os.path.join(tempdir, 'fastq_screen')
     helpers.makedirs(fastqscreen_tempdir)
@@ -156,12 +167,18 @@ def align_pe(
             adapter, adapter2
         )
 
-    align_pe_with_bwa(
-        filtered_fastq_r1, filtered_fastq_r2, aln_temp, reference, readgroup,
-        tempdir
-    )
+    if streaming:
+        bamutils.bwa_mem_to_sorted_bam(
+            filtered_fastq_r1, filtered_fastq_r2, output, reference,
+            readgroup, os.path.join(tempdir, 'sort'), threads=bwa_threads
+        )
+    else:
+        align_pe_with_bwa(
+            filtered_fastq_r1, filtered_fastq_r2, aln_temp, reference, readgroup,
+            tempdir, threads=bwa_threads
+        )
 
-    picardutils.bam_sort(aln_temp, output, tempdir)
+        picardutils.bam_sort(aln_temp, output, tempdir)
 
     metrics = os.path.join(reports_dir, 'flagstat_metrics.txt')
     bamutils.bam_flagstat(output, metrics)
@@ -175,15 +192,67 @@ def extract_mt_chromosome(input_bam, mt_bam, mt_chrom_name='MT'):
     pypeliner.commandline.execute(*cmd)
 
 
+def get_lane_parallelism(num_lanes, ncores, max_lanes=None):
+    """
+    split the cores of the job between lanes, cores left over
+    are used as bwa threads
+    :param max_lanes: cap on the lanes aligned at the same time, every
+    bwa mem process loads its own copy of the reference index
+    :returns number of lanes to align in parallel, bwa threads per lane
+    """
+    ncores = max(ncores or 1, 1)
+
+    lane_workers = max(min(num_lanes, ncores, max_lanes or num_lanes), 1)
+
+    return lane_workers, max(ncores // lane_workers, 1)
+
+
+def get_align_lanes_memory(num_lanes, ncores, max_lanes=None, lane_memory=7):
+    """
+    memory for an align_lanes job, lane_memory per lane aligned in parallel
+    """
+    lane_workers, _ = get_lane_parallelism(num_lanes, ncores, max_lanes=max_lanes)
+
+    return lane_memory * lane_workers
+
+
+def run_lane_alignments(lane_args, ncores, streaming=False, max_lanes=None):
+    """
+    :param lane_args: list of align_pe args, one per lane
+    :param ncores: cores allocated to the job
+    :param streaming: pipe bwa into samtools sort
+    :param max_lanes: max number of lanes aligned in parallel
+    """
+    lane_workers, bwa_threads = get_lane_parallelism(len(lane_args), ncores, max_lanes=max_lanes)
+
+    kwargs = {'bwa_threads': bwa_threads, 'streaming': streaming}
+
+    if lane_workers == 1:
+        for args in lane_args:
+            align_pe(*args, **kwargs)
+        return
+
+    with ProcessPoolExecutor(max_workers=lane_workers) as executor:
+        jobs = [
+            executor.submit(align_pe, *args, **kwargs)
+            for args in lane_args
+        ]
+
+        for job in jobs:
+            job.result()
+
+
 def align_lanes(
         fastq1, fastq2, output, output_mt, reports, tempdir, reference,
         sample_info, cell_id, library_id, adapter,
         adapter2, fastqscreen_detailed_metrics,
-        fastqscreen_summary_metrics, fastqscreen_params, trim, center, mt_chrom_name='MT'
+        fastqscreen_summary_metrics, fastqscreen_params, trim, center, mt_chrom_name='MT',
+        ncores=1, streaming=False, max_lanes=None
 ):
     lane_bams = []
     detailed_counts = []
     summary_counts = []
+    lane_args = []
 
     for lane_id in fastq1:
         reports_dir = os.path.join(tempdir, 'reports_per_lane', lane_id)
@@ -201,12 +270,14 @@ def align_lanes(
         detailed_counts.append(screen_detailed)
         summary_counts.append(screen_summary)
 
-        align_pe(
+        lane_args.append((
             fastq1[lane_id], fastq2[lane_id], lane_bam, reports_dir,
             lane_tempdir, reference, trim, center, sample_info, cell_id, lane_id,
             library_id, adapter, adapter2,
             screen_detailed, screen_summary, fastqscreen_params,
-        )
+        ))
+
+    run_lane_alignments(lane_args, ncores, streaming=streaming, max_lanes=max_lanes)
 
     helpers.make_tarfile(reports, os.path.join(tempdir, 'reports_per_lane'))
 
@@ -0,0 +1,157 @@
+import os
+from unittest import mock
+
+import pypeliner
+import pysam
+from single_cell.utils import bamutils
+from single_cell.workflows.align import align_tasks
+from single_cell.workflows.align.align_tasks import get_align_lanes_memory, get_lane_parallelism
+
+
+def write_lane_bam(bamfile, sort_order):
+    header = {
+        'HD': {'VN': '1.6', 'SO': sort_order},
+        'SQ': [{'SN': '1', 'LN': 1000}],
+    }
+    with pysam.AlignmentFile(bamfile, 'wb', header=header):
+        pass
+
+    return bamfile
+
+
+def run_merge_postprocess_bams(tmpdir, sort_orders):
+    tmpdir = str(tmpdir)
+
+    inputs = [
+        write_lane_bam(os.path.join(tmpdir, 'lane{}.bam'.format(i)), sort_order)
+        for i, sort_order in enumerate(sort_orders)
+    ]
+    output = os.path.join(tmpdir, 'output.bam')
+    tempdir = os.path.join(tmpdir, 'temp')
+
+    with mock.patch.object(align_tasks, 'picardutils') as picardutils, \
+            mock.patch.object(bamutils, 'bam_index') as bam_index:
+        align_tasks.merge_postprocess_bams(inputs, output, tempdir)
+
+    bam_index.assert_called_once_with(output, output + '.bai')
+
+    return inputs, output, tempdir, picardutils
+
+
+def test_lane_parallelism_single_core():
+    assert get_lane_parallelism(4, 1) == (1, 1)
+    assert get_lane_parallelism(4, None) == (1, 1)
+
+
+def test_lane_parallelism_cores_per_lane():
+    assert get_lane_parallelism(4, 8) == (4, 2)
+    assert get_lane_parallelism(3, 8) == (3, 2)
+
+
+def test_lane_parallelism_more_lanes_than_cores():
+    assert get_lane_parallelism(8, 4) == (4, 1)
+    assert get_lane_parallelism(1, 4) == (1, 4)
+
+
+def test_lane_parallelism_max_lanes():
+    assert get_lane_parallelism(4, 8, max_lanes=2) == (2, 4)
+    assert get_lane_parallelism(1, 8, max_lanes=2) == (1, 8)
+
+
+def test_align_lanes_memory():
+    assert get_align_lanes_memory(4, 1) == 7
+    assert get_align_lanes_memory(4, 8, max_lanes=2) == 14
+    assert get_align_lanes_memory(1, 8, max_lanes=2) == 7
+
+
+def test_merge_postprocess_bams_single_lane(tmpdir):
+    inputs, output, tempdir, picardutils = run_merge_postprocess_bams(
+        tmpdir, ['coordinate']
+    )
+
+    # single sorted lane goes straight to markdups
+    picardutils.merge_bams.assert_not_called()
+    picardutils.bam_sort.assert_not_called()
+    picardutils.bam_markdups.assert_called_once_with(
+        inputs[0], output, os.path.join(tempdir, 'markdups_metrics.txt'), tempdir
+    )
+
+
+def test_merge_postprocess_bams_single_unsorted_lane(tmpdir):
+    inputs, output, tempdir, picardutils = run_merge_postprocess_bams(
+        tmpdir, ['unsorted']
+    )
+
+    sorted_bam = os.path.join(tempdir, 'sorted.bam')
+
+    picardutils.merge_bams.assert_not_called()
+    picardutils.bam_sort.assert_called_once_with(inputs[0], sorted_bam, tempdir)
+    assert picardutils.bam_markdups.call_args[0][0] == sorted_bam
+
+
+def test_merge_postprocess_bams_sorted_lanes(tmpdir):
+    inputs, output, tempdir, picardutils = run_merge_postprocess_bams(
+        tmpdir, ['coordinate', 'coordinate', 'coordinate']
+    )
+
+    merged = os.path.join(tempdir, 'merged_lanes.bam')
+
+    # merging sorted lanes keeps the order, no re-sort
+    picardutils.merge_bams.assert_called_once_with(inputs, merged)
+    picardutils.bam_sort.assert_not_called()
+    assert picardutils.bam_markdups.call_args[0][0] == merged
+
+
+def test_merge_postprocess_bams_unsorted_lanes(tmpdir):
+    inputs, output, tempdir, picardutils = run_merge_postprocess_bams(
+        tmpdir, ['coordinate', 'queryname']
+    )
+
+    merged = os.path.join(tempdir, 'merged_lanes.bam')
+    sorted_bam = os.path.join(tempdir, 'sorted.bam')
+
+    picardutils.merge_bams.assert_called_once_with(inputs, merged)
+    picardutils.bam_sort.assert_called_once_with(merged, sorted_bam, tempdir)
+    assert picardutils.bam_markdups.call_args[0][0] == sorted_bam
+
+
+def test_bwa_mem_to_sorted_bam(tmpdir):
+    tempdir = os.path.join(str(tmpdir), 'temp')
+
+    with mock.patch.object(pypeliner.commandline, 'execute') as execute, \
+            mock.patch.object(bamutils, 'bam_index') as bam_index:
+        bamutils.bwa_mem_to_sorted_bam(
+            'R1.fq.gz', 'R2.fq.gz', 'out.bam', 'ref.fa', '@RG\\tID:1',
+            tempdir, threads=4
+        )
+
+    execute.assert_called_once_with(
+        'bwa', 'mem', '-C', '-M', '-t', 4, '-R', '"@RG\\tID:1"',
+        'ref.fa', 'R1.fq.gz', 'R2.fq.gz', '|',
+        'samtools', 'sort', '-@', 4, '-T', os.path.join(tempdir, 'sort'),
+        '-o', 'out.bam', '-'
+    )
+    bam_index.assert_called_once_with('out.bam', 'out.bam.bai')
+
+    assert os.path.isdir(tempdir)
+
+
+def test_bwa_mem_to_sorted_bam_unquoted_readgroup(tmpdir):
+    tempdir = os.path.join(str(tmpdir), 'temp')
+
+    # bwa versions that reject the quoted readgroup are rerun without quotes
+    execute = mock.Mock(
+        side_effect=[pypeliner.commandline.CommandLineException(('bwa',), 'bwa', 1), None]
+    )
+
+    with mock.patch.object(pypeliner.commandline, 'execute', execute), \
+            mock.patch.object(bamutils, 'bam_index'):
+        bamutils.bwa_mem_to_sorted_bam(
+            'R1.fq.gz', 'R2.fq.gz', 'out.bam', 'ref.fa', '@RG\\tID:1',
+            tempdir
+        )
+
+    assert execute.call_count == 2
+    args = execute.call_args[0]
+    assert args[args.index('-R') + 1] == '@RG\\tID:1'
+    assert args[args.index('|') + 1:args.index('|') + 3] == ('samtools', 'sort')
@@ -0,0 +1,895 @@
+'''
+Created on Oct 18, 2026
+
+flagstat, duplication, wgs, insert size, gc bias and coverage metrics from a
+single pass over a cell bam. the reports are written in the samtools and
+picard text formats so CollectMetrics and collect_gc parse them unchanged.
+optical duplicates come from the DT tags markduplicates writes with
+TAGGING_POLICY=All, bams marked without it report no optical duplicates.
+'''
+from __future__ import division
+
+import collections
+import itertools
+import math
+
+import matplotlib
+import numpy as np
+import pandas as pd
+import pysam
+import yaml
+
+matplotlib.use('Agg')
+from matplotlib import pyplot as plt
+
+from single_cell.utils import csvutils
+from single_cell.workflows.align.coverage_metrics import CoverageData
+from single_cell.workflows.align.coverage_metrics import get_batches
+from single_cell.workflows.align.dtypes import dtypes
+
+COVERAGE_CAP = 500
+
+GC_WINDOW_SIZE = 100
+
+# windows with more N bases than this are not assigned a gc bin
+GC_MAX_N = 4
+
+INSERT_DEVIATIONS = 10
+
+# orientations with fewer inserts than this fraction are not reported
+INSERT_MIN_PCT = 0.05
+
+PAIR_ORIENTATIONS = ['FR', 'RF', 'TANDEM']
+
+NO_CALL = np.array([ord('N'), ord('n'), ord('.')], dtype=np.uint8)
+
+FLAGSTAT_FIELDS = [
+    ('total', 'in total (QC-passed reads + QC-failed reads)'),
+    ('secondary', 'secondary'),
+    ('supplementary', 'supplementary'),
+    ('duplicates', 'duplicates'),
+    ('mapped', 'mapped'),
+    ('paired', 'paired in sequencing'),
+    ('read1', 'read1'),
+    ('read2', 'read2'),
+    ('properly_paired', 'properly paired'),
+    ('pair_mapped', 'with itself and mate mapped'),
+    ('singletons', 'singletons'),
+    ('diff_chrom', 'with mate mapped to a different chr'),
+    ('diff_chrom_mapq5', 'with mate mapped to a different chr (mapQ>=5)'),
+]
+
+# flagstat lines followed by a percentage and the field it is relative to
+FLAGSTAT_PERCENT = {
+    'mapped': 'total', 'properly_paired': 'paired', 'singletons': 'paired'
+}
+
+
+def format_value(value):
+    """
+    format values the way picard writes metrics, ? for undefined values
+    """
+    if value is None:
+        return ''
+
+    if isinstance(value, (float, np.floating)):
+        if math.isnan(value):
+            return '?'
+        value = '{:.6f}'.format(value).rstrip('0').rstrip('.')
+        return '0' if value == '-0' else value
+
+    return str(value)
+
+
+def write_metrics_file(output, metrics_class, header, rows, histogram=None):
+    """
+    write a picard style metrics file
+    :param histogram: tuple of header and rows for the histogram section
+    """
+    with open(output, 'wt') as writer:
+        writer.write('## htsjdk.samtools.metrics.StringHeader\n')
+        writer.write('# single_cell.workflows.align.bam_metrics\n\n')
+
+        writer.write('## METRICS CLASS\t{}\n'.format(metrics_class))
+        writer.write('\t'.join(header) + '\n')
+        for row in rows:
+            writer.write('\t'.join(map(format_value, row)) + '\n')
+        writer.write('\n')
+
+        if histogram:
+            hist_header, hist_rows = histogram
+            writer.write('## HISTOGRAM\tjava.lang.Integer\n')
+            writer.write('\t'.join(hist_header) + '\n')
+            for row in hist_rows:
+                writer.write('\t'.join(map(format_value, row)) + '\n')
+            writer.write('\n')
+
+
+def get_window_gc(sequence, starts, window_size=GC_WINDOW_SIZE):
+    """
+    gc percent of the windows starting at offsets into sequence
+    :returns int array, -1 for windows with too many N bases
+    """
+    bases = np.frombuffer(sequence.upper().encode(), dtype=np.uint8)
+
+    is_gc = (bases == ord('G')) | (bases == ord('C'))
+    is_at = (bases == ord('A')) | (bases == ord('T'))
+
+    gc_sum = np.concatenate([[0], np.cumsum(is_gc, dtype=np.int64)])
+    at_sum = np.concatenate([[0], np.cumsum(is_at, dtype=np.int64)])
+
+    gc_count = gc_sum[starts + window_size] - gc_sum[starts]
+    at_count = at_sum[starts + window_size] - at_sum[starts]
+
+    valid = window_size - gc_count - at_count <= GC_MAX_N
+
+    gc_bins = np.full(len(starts), -1, dtype=np.int64)
+    gc_bins[valid] = (gc_count[valid] * 100) // (gc_count[valid] + at_count[valid])
+
+    return gc_bins
+
+
+def get_reference_stats(ref_genome, output, window_size=GC_WINDOW_SIZE, chunksize=10 ** 7):
+    """
+    genome territory (non N bases) and number of windows per gc bin, these
+    only depend on the reference so are computed once for all cells
+    """
+    territory = 0
+    windows = np.zeros(101, dtype=np.int64)
+
+    with pysam.FastaFile(ref_genome) as fasta:
+        for chrom, length in zip(fasta.references, fasta.lengths):
+            for start in range(0, length, chunksize):
+                end = min(start + chunksize, length)
+                # windows starting in the chunk extend into the next one
+                sequence = fasta.fetch(chrom, start, min(end + window_size - 1, length))
+
+                bases = np.frombuffer(sequence[:end - start].encode(), dtype=np.uint8)
+                territory += int((~np.isin(bases, NO_CALL)).sum())
+
+                num_windows = len(sequence) - window_size + 1
+                if num_windows < 1:
+                    continue
+
+                gc_bins = get_window_gc(sequence, np.arange(num_windows), window_size)
+                windows += np.bincount(gc_bins[gc_bins >= 0], minlength=101)
+
+    outdata = {
+        'window_size': window_size,
+        'genome_territory': territory,
+        'gc_windows': windows.tolist(),
+    }
+
+    with open(output, 'wt') as writer:
+        yaml.dump(outdata, writer)
+
+
+def load_reference_stats(reference_stats):
+    with open(reference_stats, 'rt') as reader:
+        return yaml.safe_load(reader)
+
+
+def estimate_library_size(read_pairs, unique_read_pairs):
+    """
+    picard library size estimate from the number of read pairs and the
+    number of unique read pairs
+    """
+    read_pair_duplicates = read_pairs - unique_read_pairs
+
+    if unique_read_pairs <= 0 or read_pair_duplicates <= 0:
+        return None
+
+    def func(x, c, n):
+        return c / x - 1 + math.exp(-n / x)
+
+    lower = 1.0
+    upper = 100.0
+
+    if unique_read_pairs >= read_pairs or func(lower * unique_read_pairs, unique_read_pairs, read_pairs) < 0:
+        raise ValueError(
+            'Invalid values for pairs and unique pairs: {}, {}'.format(
+                read_pairs, unique_read_pairs)
+        )
+
+    while func(upper * unique_read_pairs, unique_read_pairs, read_pairs) > 0:
+        upper *= 10.0
+
+    for _ in range(40):
+        ratio = (lower + upper) / 2.0
+        value = func(ratio * unique_read_pairs, unique_read_pairs, read_pairs)
+        if value == 0:
+            break
+        elif value > 0:
+            lower = ratio
+        else:
+            upper = ratio
+
+    return int(unique_read_pairs * (lower + upper) / 2.0)
+
+
+def get_histogram_median(values, counts):
+    """
+    median of a histogram, picard style
+    """
+    total = counts.sum()
+
+    if total % 2 == 0:
+        mid_low = total / 2
+        mid_high = mid_low + 1
+    else:
+        mid_low = mid_high = math.ceil(total / 2)
+
+    cumulative = np.cumsum(counts)
+    low = values[np.searchsorted(cumulative, mid_low)]
+    high = values[np.searchsorted(cumulative, mid_high)]
+
+    return (low + high) / 2
+
+
+def get_insert_size_stats(insert_sizes):
+    """
+    picard insert size stats, the mean and standard deviation are computed
+    after trimming inserts past median + 10 median absolute deviations
+    :param insert_sizes: Counter of insert sizes
+    :returns list of median, mad, min, max, mean, stdev and count
+    """
+    values = np.array(sorted(insert_sizes), dtype=np.int64)
+    counts = np.array([insert_sizes[v] for v in values], dtype=np.int64)
+
+    median = get_histogram_median(values, counts)
+
+    deviations, inverse = np.unique(np.abs(values - median), return_inverse=True)
+    deviation_counts = np.bincount(inverse, weights=counts).astype(np.int64)
+    mad = get_histogram_median(deviations, deviation_counts)
+
+    keep = values <= int(median + INSERT_DEVIATIONS * mad)
+    trim_values = values[keep]
+    trim_counts = counts[keep]
+
+    num_inserts = trim_counts.sum()
+    mean = (trim_values * trim_counts).sum() / num_inserts
+    if num_inserts > 1:
+        stdev = math.sqrt((trim_counts * (trim_values - mean) ** 2).sum() / (num_inserts - 1))
+    else:
+        stdev = float('nan')
+
+    return [
+        median, mad, int(values[0]), int(values[-1]), mean, stdev,
+        int(counts.sum())
+    ]
+
+
+def get_pair_orientation(read):
+    """
+    orientation of a read pair, positions as in picard SamPairUtil
+    """
+    if read.is_reverse == read.mate_is_reverse:
+        return 'TANDEM'
+
+    if read.is_reverse:
+        positive_five_prime = read.next_reference_start + 1
+        negative_five_prime = read.reference_end
+    else:
+        positive_five_prime = read.reference_start + 1
+        negative_five_prime = read.reference_start + 1 + read.template_length
+
+    return 'FR' if positive_five_prime < negative_five_prime else 'RF'
+
+
+class BamMetrics(object):
+    """
+    collects the metrics of a coordinate sorted bam from reads fed in batches
+    """
+
+    def __init__(
+            self, ref_genome, reference_stats, min_bqual=20, min_mqual=20,
+            count_unpaired=False, coverage_cap=COVERAGE_CAP
+    ):
+        """
+        :param ref_genome: reference fasta with index
+        :param reference_stats: dict from get_reference_stats
+        :param min_bqual: min base quality for wgs coverage
+        :param min_mqual: min mapping quality for wgs coverage
+        :param count_unpaired: count unpaired reads in wgs coverage
+        :param coverage_cap: wgs coverage is capped at this depth
+        """
+        self.fasta = pysam.FastaFile(ref_genome)
+        self.reference_stats = reference_stats
+        self.window_size = reference_stats['window_size']
+        self.min_bqual = min_bqual
+        self.min_mqual = min_mqual
+        self.count_unpaired = count_unpaired
+        self.coverage_cap = coverage_cap
+
+        # qc passed and qc failed counts
+        self.flagstat = (collections.Counter(), collections.Counter())
+
+        self.duplication = collections.Counter()
+        self.library = None
+
+        self.insert_sizes = {orientation: collections.Counter() for orientation in PAIR_ORIENTATIONS}
+
+        self.reads_by_gc = np.zeros(101, dtype=np.int64)
+        self.total_clusters = 0
+        self.aligned_reads = 0
+
+        self.depth_histogram = np.zeros(coverage_cap + 1, dtype=np.int64)
+        self._chrom = None
+        # position << 32 | read name id of covered bases not yet final
+        self._pending = []
+        self._name_id = 0
+        # name ids of reads with an overlapping mate still to come
+        self._mate_ids = {}
+
+    def close(self):
+        self.fasta.close()
+
+    def _add_flagstat(self, read):
+        counts = self.flagstat[1 if read.is_qcfail else 0]
+
+        counts['total'] += 1
+
+        if read.is_secondary:
+            counts['secondary'] += 1
+        elif read.is_supplementary:
+            counts['supplementary'] += 1
+        elif read.is_paired:
+            counts['paired'] += 1
+            if read.is_proper_pair and not read.is_unmapped:
+                counts['properly_paired'] += 1
+            if read.is_read1:
+                counts['read1'] += 1
+            if read.is_read2:
+                counts['read2'] += 1
+            if read.mate_is_unmapped and not read.is_unmapped:
+                counts['singletons'] += 1
+            if not read.is_unmapped and not read.mate_is_unmapped:
+                counts['pair_mapped'] += 1
+                if read.next_reference_id != read.reference_id:
+                    counts['diff_chrom'] += 1
+                    if read.mapping_quality >= 5:
+                        counts['diff_chrom_mapq5'] += 1
+
+        if not read.is_unmapped:
+            counts['mapped'] += 1
+
+        if read.is_duplicate:
+            counts['duplicates'] += 1
+
+    def _add_duplication(self, read):
+        """
+        duplication counts from the duplicate flags set by markduplicates
+        """
+        if read.is_secondary or read.is_supplementary:
+            self.duplication['secondary_or_supplementary'] += 1
+        elif read.is_unmapped:
+            self.duplication['unmapped'] += 1
+        elif not read.is_paired or read.mate_is_unmapped:
+            self.duplication['unpaired'] += 1
+            if read.is_duplicate:
+                self.duplication['unpaired_duplicates'] += 1
+        else:
+            self.duplication['paired'] += 1
+            if read.is_duplicate:
+                self.duplication['paired_duplicates'] += 1
+                # DT:SQ is only set with the markduplicates TAGGING_POLICY=All
+                if read.has_tag('DT') and read.get_tag('DT') == 'SQ':
+                    self.duplication['paired_optical_duplicates'] += 1
+
+    def _add_insert_size(self, read):
+        if not read.is_paired or read.is_unmapped or read.mate_is_unmapped:
+            return
+
+        if read.is_read1 or read.is_secondary or read.is_supplementary:
+            return
+
+        if read.is_duplicate or read.template_length == 0:
+            return
+
+        self.insert_sizes[get_pair_orientation(read)][abs(read.template_length)] += 1
+
+    def _add_gc_read(self, read):
+        """
+        start of the gc window at the 5' end of the read, None if the read
+        isnt used for gc bias
+        """
+        if not read.is_paired or read.is_read1:
+            if not read.is_secondary and not read.is_supplementary:
+                self.total_clusters += 1
+
+        if read.is_unmapped or read.is_secondary or read.is_supplementary or read.is_qcfail:
+            return None
+
+        self.aligned_reads += 1
+
+        start = read.reference_end - self.window_size if read.is_reverse else read.reference_start
+
+        if start < 0:
+            return None
+
+        return start
+
+    def _use_for_depth(self, read):
+        if read.is_unmapped or read.is_secondary or read.is_qcfail or read.is_duplicate:
+            return False
+
+        if read.mapping_quality < self.min_mqual:
+            return False
+
+        if not self.count_unpaired and (not read.is_paired or read.mate_is_unmapped):
+            return False
+
+        return read.query_sequence is not None
+
+    def _get_name_id(self, read):
+        """
+        bases of overlapping mates share an id so they are counted once
+        """
+        if read.query_name in self._mate_ids:
+            return self._mate_ids.pop(read.query_name)
+
+        self._name_id = (self._name_id + 1) % 2 ** 32
+
+        if read.is_paired and not read.mate_is_unmapped and \
+                read.next_reference_id == read.reference_id and \
+                read.reference_start <= read.next_reference_start < read.reference_end:
+            self._mate_ids[read.query_name] = self._name_id
+
+        return self._name_id
+
+    def _get_covered_bases(self, reads, ref_start, ref_bases):
+        """
+        keys of the bases of the reads that count towards wgs coverage
+        """
+        seg_ref = []
+        seg_query = []
+        seg_length = []
+        seg_name = []
+
+        sequences = []
+        qualities = []
+        query_offset = 0
+
+        for read in reads:
+            name_id = self._get_name_id(read)
+
+            ref_pos = read.reference_start
+            query_pos = query_offset
+            for op, length in read.cigartuples:
+                # aligned bases, match or mismatch
+                if op in (0, 7, 8):
+                    seg_ref.append(ref_pos)
+                    seg_query.append(query_pos)
+                    seg_length.append(length)
+                    seg_name.append(name_id)
+                    ref_pos += length
+                    query_pos += length
+                elif op in (1, 4):
+                    query_pos += length
+                elif op in (2, 3):
+                    ref_pos += length
+
+            sequence = read.query_sequence
+            quals = read.query_qualities
+            quals = b'\xff' * len(sequence) if quals is None else bytes(quals)
+
+            sequences.append(sequence)
+            qualities.append(quals)
+            query_offset += len(sequence)
+
+        if not seg_length:
+            return np.zeros(0, dtype=np.int64)
+
+        seg_length = np.array(seg_length, dtype=np.int64)
+        seg_offsets = np.cumsum(seg_length) - seg_length
+        base_offsets = np.arange(seg_length.sum()) - np.repeat(seg_offsets, seg_length)
+
+        query_idx = np.repeat(seg_query, seg_length) + base_offsets
+        ref_idx = np.repeat(seg_ref, seg_length) + base_offsets
+        name_ids = np.repeat(seg_name, seg_length)
+
+        sequences = np.frombuffer(''.join(sequences).encode(), dtype=np.uint8)
+        qualities = np.frombuffer(b''.join(qualities), dtype=np.uint8)
+
+        keep = qualities[query_idx] >= self.min_bqual
+        keep &= ~np.isin(sequences[query_idx], NO_CALL)
+        keep &= ~np.isin(ref_bases[ref_idx - ref_start], NO_CALL)
+
+        return (ref_idx[keep].astype(np.int64) << 32) | name_ids[keep]
+
+    def _flush_depth(self, position=None):
+        """
+        add the depth of bases before position to the histogram, reads are
+        sorted so later reads cannot cover them
+        """
+        if not self._pending:
+            return
+
+        keys = np.concatenate(self._pending)
+
+        if position is None:
+            final = np.ones(len(keys), dtype=bool)
+        else:
+            final = (keys >> 32) < position
+
+        self._pending = [keys[~final]]
+
+        keys = np.unique(keys[final])
+        _, depth = np.unique(keys >> 32, return_counts=True)
+
+        depth = np.minimum(depth, self.coverage_cap)
+        self.depth_histogram += np.bincount(depth, minlength=self.coverage_cap + 1)
+
+    def _add_chrom_reads(self, chrom, reads):
+        if chrom != self._chrom:
+            self._flush_depth()
+            self._chrom = chrom
+            self._pending = []
+            self._mate_ids = {}
+
+        gc_reads = []
+        gc_starts = []
+        depth_reads = []
+        for read in reads:
+            start = self._add_gc_read(read)
+            if start is not None:
+                gc_reads.append(read)
+                gc_starts.append(start)
+
+            if self._use_for_depth(read):
+                depth_reads.append(read)
+
+        chrom_length = self.fasta.get_reference_length(chrom)
+
+        ends = [start + self.window_size for start in gc_starts]
+        ends += [read.reference_end for read in depth_reads]
+        starts = gc_starts + [read.reference_start for read in depth_reads]
+
+        if starts:
+            ref_start = min(starts)
+            ref_end = min(max(ends), chrom_length)
+            sequence = self.fasta.fetch(chrom, ref_start, ref_end)
+
+            gc_starts = np.array(gc_starts, dtype=np.int64) - ref_start
+            gc_starts = gc_starts[gc_starts + self.window_size <= len(sequence)]
+            if len(gc_starts):
+                gc_bins = get_window_gc(sequence, gc_starts, self.window_size)
+                self.reads_by_gc += np.bincount(gc_bins[gc_bins >= 0], minlength=101)
+
+            ref_bases = np.frombuffer(sequence.encode(), dtype=np.uint8)
+            self._pending.append(self._get_covered_bases(depth_reads, ref_start, ref_bases))
+
+        self._flush_depth(reads[-1].reference_start)
+
+    def add_reads(self, reads):
+        for read in reads:
+            self._add_flagstat(read)
+            self._add_duplication(read)
+            self._add_insert_size(read)
+
+        for chrom, chrom_reads in itertools.groupby(reads, key=lambda read: read.reference_name):
+            chrom_reads = list(chrom_reads)
+
+            # unplaced unmapped reads only count towards flagstat and clusters
+            if chrom is None:
+                for read in chrom_reads:
+                    self._add_gc_read(read)
+                continue
+
+            self._add_chrom_reads(chrom, chrom_reads)
+
+    def finish(self):
+        self._flush_depth()
+        self._pending = []
+        self._mate_ids = {}
+
+    def set_library(self, header):
+        libraries = [rg['LB'] for rg in header.to_dict().get('RG', []) if 'LB' in rg]
+        self.library = libraries[0] if libraries else 'Unknown Library'
+
+    def write_flagstat(self, output):
+        passed, failed = self.flagstat
+
+        def percent(value, total):
+            return 'N/A' if total == 0 else '{:.2f}%'.format(100 * value / total)
+
+        with open(output, 'wt') as writer:
+            for field, label in FLAGSTAT_FIELDS:
+                line = '{} + {} {}'.format(passed[field], failed[field], label)
+
+                if field in FLAGSTAT_PERCENT:
+                    total = FLAGSTAT_PERCENT[field]
+                    line += ' ({} : {})'.format(
+                        percent(passed[field], passed[total]),
+                        percent(failed[field], failed[total])
+                    )
+
+                writer.write(line + '\n')
+
+    def get_duplication_metrics(self):
+        """
+        :returns picard duplication metrics in report order
+        """
+        dups = self.duplication
+
+        read_pairs = dups['paired'] // 2
+        read_pair_duplicates = dups['paired_duplicates'] // 2
+        optical_duplicates = dups['paired_optical_duplicates'] // 2
+
+        try:
+            percent_duplication = (dups['unpaired_duplicates'] + read_pair_duplicates * 2) / (
+                    dups['unpaired'] + read_pairs * 2)
+        except ZeroDivisionError:
+            percent_duplication = 0.0
+
+        library_size = estimate_library_size(
+            read_pairs - optical_duplicates, read_pairs - read_pair_duplicates
+        )
+
+        return collections.OrderedDict([
+            ('LIBRARY', self.library),
+            ('UNPAIRED_READS_EXAMINED', dups['unpaired']),
+            ('READ_PAIRS_EXAMINED', read_pairs),
+            ('SECONDARY_OR_SUPPLEMENTARY_RDS', dups['secondary_or_supplementary']),
+            ('UNMAPPED_READS', dups['unmapped']),
+            ('UNPAIRED_READ_DUPLICATES', dups['unpaired_duplicates']),
+            ('READ_PAIR_DUPLICATES', read_pair_duplicates),
+            ('READ_PAIR_OPTICAL_DUPLICATES', optical_duplicates),
+            ('PERCENT_DUPLICATION', percent_duplication),
+            ('ESTIMATED_LIBRARY_SIZE', library_size),
+        ])
+
+    def write_duplication_metrics(self, output):
+        metrics = self.get_duplication_metrics()
+
+        write_metrics_file(
+            output, 'picard.sam.DuplicationMetrics', list(metrics.keys()),
+            [list(metrics.values())]
+        )
+
+    def get_wgs_histogram(self):
+        histogram = self.depth_histogram.copy()
+        # bases without reads are never seen in the pass over the bam
+        histogram[0] = self.reference_stats['genome_territory'] - histogram[1:].sum()
+        return histogram
+
+    def write_wgs_metrics(self, output):
+        territory = self.reference_stats['genome_territory']
+        histogram = self.get_wgs_histogram()
+
+        depths = np.arange(len(histogram))
+        mean = (depths * histogram).sum() / territory
+        sd = math.sqrt((histogram * (depths - mean) ** 2).sum() / max(territory - 1, 1))
+        median = get_histogram_median(depths, histogram)
+
+        header = ['GENOME_TERRITORY', 'MEAN_COVERAGE', 'SD_COVERAGE', 'MEDIAN_COVERAGE']
+        row = [territory, mean, sd, median]
+
+        for cutoff in [1, 5, 10, 15, 20, 25, 30, 40, 50, 60, 70, 80, 90, 100]:
+            header.append('PCT_{}X'.format(cutoff))
+            row.append(histogram[cutoff:].sum() / territory)
+
+        hist_rows = [[depth, int(count)] for depth, count in enumerate(histogram)]
+
+        write_metrics_file(
+            output, 'picard.analysis.WgsMetrics', header, [row],
+            histogram=(['coverage', 'high_quality_coverage_count'], hist_rows)
+        )
+
+    def get_insert_orientations(self):
+        """
+        :returns pair orientations with enough inserts to report, none if
+        there are no properly paired reads
+        """
+        properly_paired = self.flagstat[0]['properly_paired'] + self.flagstat[1]['properly_paired']
+        if not properly_paired:
+            return []
+
+        total_inserts = sum(sum(counts.values()) for counts in self.insert_sizes.values())
+
+        return [
+            orientation for orientation in PAIR_ORIENTATIONS
+            if sum(self.insert_sizes[orientation].values()) > total_inserts * INSERT_MIN_PCT
+        ]
+
+    def write_insert_metrics(self, output, chart):
+        orientations = self.get_insert_orientations()
+
+        if not orientations:
+            with open(output, 'w') as writer:
+                writer.write('## FAILED: No properly paired reads\n')
+            with open(chart, 'w'):
+                pass
+            return
+
+        header = [
+            'MEDIAN_INSERT_SIZE', 'MEDIAN_ABSOLUTE_DEVIATION', 'MIN_INSERT_SIZE',
+            'MAX_INSERT_SIZE', 'MEAN_INSERT_SIZE', 'STANDARD_DEVIATION',
+            'READ_PAIRS', 'PAIR_ORIENTATION'
+        ]
+        rows = [
+            get_insert_size_stats(self.insert_sizes[orientation]) + [orientation]
+            for orientation in orientations
+        ]
+
+        max_insert = max(max(self.insert_sizes[orientation]) for orientation in orientations)
+        hist_header = ['insert_size'] + ['All_Reads.{}_count'.format(o.lower()) for o in orientations]
+        hist_rows = []
+        for insert_size in range(1, max_insert + 1):
+            counts = [self.insert_sizes[orientation][insert_size] for orientation in orientations]
+            if any(counts):
+                hist_rows.append([insert_size] + counts)
+
+        write_metrics_file(
+            output, 'picard.analysis.InsertSizeMetrics', header, rows,
+            histogram=(hist_header, hist_rows)
+        )
+
+        fig, ax = plt.subplots(figsize=(8, 6))
+        for idx, orientation in enumerate(orientations):
+            ax.plot(
+                [row[0] for row in hist_rows], [row[idx + 1] for row in hist_rows],
+                label=orientation
+            )
+        ax.set_xlabel('Insert Size')
+        ax.set_ylabel('Count')
+        ax.set_title('Insert Size Histogram')
+        ax.legend()
+        fig.savefig(chart, format='pdf')
+        plt.close(fig)
+
+    def write_gc_metrics(self, output, summary, chart):
+        windows = np.array(self.reference_stats['gc_windows'], dtype=np.int64)
+        reads = self.reads_by_gc
+
+        total_windows = windows.sum()
+        total_reads = reads.sum()
+
+        mean_reads = total_reads / total_windows if total_windows else 0
+
+        normalized = np.zeros(101)
+        error_bar = np.zeros(101)
+        if mean_reads:
+            has_windows = windows > 0
+            normalized[has_windows] = reads[has_windows] / windows[has_windows] / mean_reads
+            error_bar[has_windows] = np.sqrt(reads[has_windows]) / windows[has_windows] / mean_reads
+
+        header = [
+            'ACCUMULATION_LEVEL', 'READS_USED', 'GC', 'WINDOWS', 'READ_STARTS',
+            'NORMALIZED_COVERAGE', 'ERROR_BAR_WIDTH'
+        ]
+        rows = [
+            ['All Reads', 'ALL', gc, int(windows[gc]), int(reads[gc]), normalized[gc], error_bar[gc]]
+            for gc in range(101)
+        ]
+        write_metrics_file(output, 'picard.analysis.GcBiasDetailMetrics', header, rows)
+
+        at_dropout = 0.0
+        gc_dropout = 0.0
+        if total_windows and total_reads:
+            dropout = windows / total_windows - reads / total_reads
+            dropout = np.where(windows > 0, np.maximum(dropout, 0), 0) * 100
+            at_dropout = dropout[:51].sum()
+            gc_dropout = dropout[50:].sum()
+
+        header = [
+            'ACCUMULATION_LEVEL', 'READS_USED', 'WINDOW_SIZE', 'TOTAL_CLUSTERS',
+            'ALIGNED_READS', 'AT_DROPOUT', 'GC_DROPOUT'
+        ]
+        row = [
+            'All Reads', 'ALL', self.window_size, self.total_clusters,
+            self.aligned_reads, at_dropout, gc_dropout
+        ]
+        write_metrics_file(summary, 'picard.analysis.GcBiasSummaryMetrics', header, [row])
+
+        fig, ax = plt.subplots(figsize=(8, 6))
+        ax.plot(np.arange(101), normalized, label='Normalized Coverage')
+        ax.plot(np.arange(101), windows / windows.max() if windows.max() else windows,
+                label='Windows at GC%')
+        ax.set_xlabel('GC% of {} base windows'.format(self.window_size))
+        ax.set_ylabel('Normalized Coverage')
+        ax.set_title('GC Bias Plot')
+        ax.legend()
+        fig.savefig(chart, format='pdf')
+        plt.close(fig)
+
+
+    def get_metrics(self, cell_id):
+        """
+        the alignment metrics table row, same values CollectMetrics
+        extracts from the reports
+        """
+        dups = self.get_duplication_metrics()
+        passed = self.flagstat[0]
+
+        unpaired = dups['UNPAIRED_READS_EXAMINED']
+        read_pairs = dups['READ_PAIRS_EXAMINED']
+        unpaired_dups = dups['UNPAIRED_READ_DUPLICATES']
+        read_pair_dups = dups['READ_PAIR_DUPLICATES']
+        optical_dups = dups['READ_PAIR_OPTICAL_DUPLICATES']
+
+        try:
+            percent_duplicate_reads = (unpaired_dups + ((read_pair_dups + optical_dups) * 2)) / (
+                    unpaired + (read_pairs * 2))
+        except ZeroDivisionError:
+            percent_duplicate_reads = 0
+
+        territory = self.reference_stats['genome_territory']
+        histogram = self.get_wgs_histogram()
+
+        metrics = collections.OrderedDict([
+            ('cell_id', cell_id),
+            ('unpaired_mapped_reads', unpaired),
+            ('paired_mapped_reads', read_pairs),
+            ('unpaired_duplicate_reads', unpaired_dups),
+            ('paired_duplicate_reads', read_pair_dups),
+            ('unmapped_reads', dups['UNMAPPED_READS']),
+            ('percent_duplicate_reads', percent_duplicate_reads),
+            ('estimated_library_size', dups['ESTIMATED_LIBRARY_SIZE'] or 0),
+            ('total_reads', passed['total']),
+            ('total_mapped_reads', passed['mapped']),
+            ('total_duplicate_reads', passed['duplicates']),
+            ('total_properly_paired', passed['properly_paired']),
+            ('coverage_breadth', (territory - histogram[0]) / territory),
+            ('coverage_depth', (np.arange(len(histogram)) * histogram).sum() / territory),
+            ('median_insert_size', 0),
+            ('mean_insert_size', 0),
+            ('standard_deviation_insert_size', 0),
+        ])
+
+        orientations = self.get_insert_orientations()
+        if orientations:
+            median, _, _, _, mean, stdev, _ = get_insert_size_stats(self.insert_sizes[orientations[0]])
+            metrics['median_insert_size'] = median
+            metrics['mean_insert_size'] = mean
+            metrics['standard_deviation_insert_size'] = 0 if math.isnan(stdev) else stdev
+
+        return metrics
+
+    def write_metrics(self, output, cell_id):
+        metrics = pd.DataFrame([self.get_metrics(cell_id)])
+
+        csvutils.write_dataframe_to_csv_and_yaml(metrics, output, dtypes()['metrics'])
+
+
+def collect_bam_metrics(
+        input_bam, ref_genome, reference_stats, markdups_metrics,
+        flagstat_metrics, wgs_metrics, gc_metrics, gc_metrics_summary,
+        gc_metrics_pdf, insert_metrics, insert_metrics_pdf, coverage_metrics,
+        cell_id, picard_wgs_params, alignment_metrics=None
+):
+    """
+    all per cell bam metrics from a single pass over the bam
+    :param alignment_metrics: optional csv for the alignment metrics row
+    """
+    metrics = BamMetrics(
+        ref_genome, load_reference_stats(reference_stats),
+        min_bqual=picard_wgs_params['min_bqual'],
+        min_mqual=picard_wgs_params['min_mqual'],
+        count_unpaired=picard_wgs_params['count_unpaired'],
+    )
+
+    coverage = CoverageData(input_bam, cell_id)
+
+    with pysam.AlignmentFile(input_bam, 'rb') as bam:
+        metrics.set_library(bam.header)
+        genome_length = sum(bam.lengths)
+
+        for reads in get_batches(bam.fetch(until_eof=True)):
+            metrics.add_reads(reads)
+            coverage.add_reads(reads)
+
+    metrics.finish()
+
+    metrics.write_flagstat(flagstat_metrics)
+    metrics.write_duplication_metrics(markdups_metrics)
+    metrics.write_wgs_metrics(wgs_metrics)
+    metrics.write_insert_metrics(insert_metrics, insert_metrics_pdf)
+    metrics.write_gc_metrics(gc_metrics, gc_metrics_summary, gc_metrics_pdf)
+
+    if alignment_metrics:
+        metrics.write_metrics(alignment_metrics, cell_id)
+
+    metrics.close()
+
+    coverage.write(coverage_metrics, genome_length)
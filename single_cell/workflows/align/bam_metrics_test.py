@@ -0,0 +1,378 @@
+import collections
+import os
+import random
+
+import numpy as np
+import pysam
+import pytest
+from single_cell.utils import csvutils
+from single_cell.workflows.align import bam_metrics
+from single_cell.workflows.align.dtypes import dtypes
+from single_cell.workflows.align.scripts import CollectMetrics
+from single_cell.workflows.align.scripts import GenerateCNMatrix
+
+CHROMS = [('1', 20000), ('2', 15000), ('3', 3000)]
+
+
+def simulate_reference(fasta, seed=0):
+    rng = random.Random(seed)
+
+    sequences = {}
+    with open(fasta, 'wt') as writer:
+        for name, length in CHROMS:
+            gc_content = rng.uniform(0.3, 0.6)
+            bases = [
+                rng.choice('GC') if rng.random() < gc_content else rng.choice('AT')
+                for _ in range(length)
+            ]
+            # N gaps and soft masked bases
+            gap = rng.randint(0, length - 500)
+            bases[gap:gap + 300] = 'N' * 300
+            bases[100:200] = [base.lower() for base in bases[100:200]]
+
+            sequences[name] = ''.join(bases)
+            writer.write('>{}\n{}\n'.format(name, sequences[name]))
+
+    pysam.faidx(fasta)
+
+    return sequences
+
+
+def make_read(name, ref_id, start, cigar, flag, rng):
+    read = pysam.AlignedSegment()
+    read.query_name = name
+    read.query_sequence = ''.join(rng.choice('ACGTTGCAN' if rng.random() < 0.1 else 'ACGT') for _ in range(100))
+    read.reference_id = ref_id
+    read.reference_start = start
+    read.cigarstring = cigar
+    read.query_qualities = pysam.qualitystring_to_array(
+        ''.join(rng.choice('+5?I') for _ in range(100))
+    )
+    read.mapping_quality = rng.choice([0, 5, 30, 60, 60])
+    read.flag = flag
+    return read
+
+
+def simulate_bam(bamfile, n_pairs=400, seed=0):
+    rng = random.Random(seed)
+
+    header = {
+        'HD': {'VN': '1.6', 'SO': 'coordinate'},
+        'SQ': [{'SN': name, 'LN': length} for name, length in CHROMS],
+        'RG': [{'ID': 'rg1', 'LB': 'lib1', 'SM': 'cell'}],
+    }
+
+    reads = []
+    for i in range(n_pairs):
+        name = 'read{}'.format(i)
+        ref_id = rng.randint(0, len(CHROMS) - 1)
+        start = rng.randint(0, CHROMS[ref_id][1] - 600)
+        mate_start = start + rng.randint(0, 350)
+        cigars = [rng.choice(['100M', '40M10D60M', '50M5I45M', '20S80M']) for _ in range(2)]
+
+        if rng.random() < 0.1:
+            read = make_read(name, ref_id, start, cigars[0], 0, rng)
+            read.flag |= 16 if rng.random() < 0.5 else 0
+            read.flag |= 1024 if rng.random() < 0.2 else 0
+            reads.append(read)
+            continue
+
+        pair = [
+            make_read(name, ref_id, start, cigars[0], 1 | 64 | 32, rng),
+            make_read(name, ref_id, mate_start, cigars[1], 1 | 128 | 16, rng),
+        ]
+        if rng.random() < 0.1:
+            # RF pairs
+            pair[0].flag ^= 16 | 32
+            pair[1].flag ^= 16 | 32
+
+        pair[1].flag |= 2 if rng.random() < 0.9 else 0
+        pair[0].flag |= pair[1].flag & 2
+        if rng.random() < 0.2:
+            for read in pair:
+                read.flag |= 1024
+                if rng.random() < 0.3:
+                    read.set_tag('DT', 'SQ')
+
+        tlen = pair[1].reference_end - pair[0].reference_start
+        for read, mate, sign in [(pair[0], pair[1], 1), (pair[1], pair[0], -1)]:
+            read.next_reference_id = ref_id
+            read.next_reference_start = mate.reference_start
+            read.template_length = sign * tlen
+
+        if rng.random() < 0.05:
+            pair[1].flag |= 4
+            pair[1].cigarstring = None
+            pair[1].reference_start = pair[0].reference_start
+            pair[0].flag |= 8
+            for read in pair:
+                read.template_length = 0
+                read.flag &= ~2
+
+        reads.extend(pair)
+
+        if rng.random() < 0.05:
+            supplementary = make_read(name, ref_id, rng.randint(0, CHROMS[ref_id][1] - 200), '100M', 2048 | 1 | 64, rng)
+            reads.append(supplementary)
+
+    # fully unmapped pair at the end
+    for flag in [1 | 4 | 8 | 64, 1 | 4 | 8 | 128]:
+        read = pysam.AlignedSegment()
+        read.query_name = 'unmapped'
+        read.query_sequence = 'A' * 100
+        read.query_qualities = pysam.qualitystring_to_array('I' * 100)
+        read.flag = flag
+        read.reference_id = -1
+        read.reference_start = -1
+        read.next_reference_id = -1
+        read.next_reference_start = -1
+        reads.append(read)
+
+    reads.sort(key=lambda read: (read.reference_id < 0, read.reference_id, read.reference_start))
+
+    with pysam.AlignmentFile(bamfile, 'wb', header=header) as writer:
+        for read in reads:
+            writer.write(read)
+    pysam.index(bamfile)
+
+
+@pytest.fixture
+def inputs(tmpdir):
+    tmpdir = str(tmpdir)
+    fasta = os.path.join(tmpdir, 'ref.fa')
+    bamfile = os.path.join(tmpdir, 'cell.bam')
+
+    sequences = simulate_reference(fasta)
+    simulate_bam(bamfile)
+
+    reference_stats = os.path.join(tmpdir, 'reference_stats.yaml')
+    bam_metrics.get_reference_stats(fasta, reference_stats, chunksize=4000)
+
+    return tmpdir, fasta, bamfile, sequences, reference_stats
+
+
+def read_depth_histogram(bamfile, sequences, min_bqual, min_mqual, cap=500):
+    """
+    per position wgs depth with mates counted once
+    """
+    names = collections.defaultdict(set)
+
+    for read in pysam.AlignmentFile(bamfile, 'rb').fetch(until_eof=True):
+        if read.is_unmapped or read.is_secondary or read.is_qcfail or read.is_duplicate:
+            continue
+        if read.mapping_quality < min_mqual or not read.is_paired or read.mate_is_unmapped:
+            continue
+
+        for qpos, rpos in read.get_aligned_pairs(matches_only=True):
+            if read.query_qualities[qpos] < min_bqual or read.query_sequence[qpos] == 'N':
+                continue
+            if sequences[read.reference_name][rpos] in 'Nn':
+                continue
+            names[(read.reference_name, rpos)].add(read.query_name)
+
+    histogram = np.zeros(cap + 1, dtype=np.int64)
+    for depth in collections.Counter(min(len(v), cap) for v in names.values()).items():
+        histogram[depth[0]] += depth[1]
+
+    territory = sum(len(seq) - seq.upper().count('N') for seq in sequences.values())
+    histogram[0] = territory - histogram[1:].sum()
+
+    return histogram
+
+
+def window_gc(sequence):
+    sequence = sequence.upper()
+    gc = sequence.count('G') + sequence.count('C')
+    at = sequence.count('A') + sequence.count('T')
+    if len(sequence) - gc - at > bam_metrics.GC_MAX_N:
+        return -1
+    return gc * 100 // (gc + at)
+
+
+def collect(tmpdir, fasta, bamfile, reference_stats):
+    outputs = {
+        name: os.path.join(tmpdir, name) for name in [
+            'markdups.txt', 'flagstat.txt', 'wgs.txt', 'gc.txt', 'gc_summary.txt',
+            'gc.pdf', 'insert.txt', 'insert.pdf', 'coverage.yaml'
+        ]
+    }
+
+    bam_metrics.collect_bam_metrics(
+        bamfile, fasta, reference_stats,
+        outputs['markdups.txt'], outputs['flagstat.txt'], outputs['wgs.txt'],
+        outputs['gc.txt'], outputs['gc_summary.txt'], outputs['gc.pdf'],
+        outputs['insert.txt'], outputs['insert.pdf'], outputs['coverage.yaml'],
+        'cell', {'min_bqual': 20, 'min_mqual': 20, 'count_unpaired': False}
+    )
+
+    return outputs
+
+
+def test_reference_stats(inputs):
+    _, _, _, sequences, reference_stats = inputs
+
+    stats = bam_metrics.load_reference_stats(reference_stats)
+
+    windows = np.zeros(101, dtype=np.int64)
+    for seq in sequences.values():
+        for start in range(len(seq) - 100 + 1):
+            gc = window_gc(seq[start:start + 100])
+            if gc >= 0:
+                windows[gc] += 1
+
+    assert stats['gc_windows'] == windows.tolist()
+    assert stats['genome_territory'] == sum(len(seq) - seq.upper().count('N') for seq in sequences.values())
+
+
+def test_depth_histogram(inputs):
+    _, fasta, bamfile, sequences, reference_stats = inputs
+
+    metrics = bam_metrics.BamMetrics(fasta, bam_metrics.load_reference_stats(reference_stats))
+
+    # small batches so depth is flushed while mates are still pending
+    with pysam.AlignmentFile(bamfile, 'rb') as bam:
+        for reads in bam_metrics.get_batches(bam.fetch(until_eof=True), batch_size=7):
+            metrics.add_reads(reads)
+    metrics.finish()
+
+    expected = read_depth_histogram(bamfile, sequences, 20, 20)
+
+    histogram = metrics.depth_histogram.copy()
+    histogram[0] = metrics.reference_stats['genome_territory'] - histogram[1:].sum()
+
+    assert np.array_equal(histogram, expected)
+
+
+def test_reads_by_gc(inputs):
+    _, fasta, bamfile, sequences, reference_stats = inputs
+
+    metrics = bam_metrics.BamMetrics(fasta, bam_metrics.load_reference_stats(reference_stats))
+    with pysam.AlignmentFile(bamfile, 'rb') as bam:
+        for reads in bam_metrics.get_batches(bam.fetch(until_eof=True), batch_size=13):
+            metrics.add_reads(reads)
+
+    expected = np.zeros(101, dtype=np.int64)
+    for read in pysam.AlignmentFile(bamfile, 'rb').fetch(until_eof=True):
+        if read.is_unmapped or read.is_secondary or read.is_supplementary or read.is_qcfail:
+            continue
+        start = read.reference_end - 100 if read.is_reverse else read.reference_start
+        seq = sequences[read.reference_name][start:start + 100]
+        if start < 0 or len(seq) < 100:
+            continue
+        gc = window_gc(seq)
+        if gc >= 0:
+            expected[gc] += 1
+
+    assert np.array_equal(metrics.reads_by_gc, expected)
+
+
+def test_collect_metrics_parses_reports(inputs):
+    tmpdir, fasta, bamfile, sequences, reference_stats = inputs
+
+    outputs = collect(tmpdir, fasta, bamfile, reference_stats)
+
+    output = os.path.join(tmpdir, 'metrics.csv.gz')
+    CollectMetrics(
+        outputs['wgs.txt'], outputs['insert.txt'], outputs['flagstat.txt'],
+        outputs['markdups.txt'], output, 'cell', dtypes()['metrics']
+    ).main()
+
+    metrics = csvutils.read_csv_and_yaml(output).iloc[0]
+
+    reads = list(pysam.AlignmentFile(bamfile, 'rb').fetch(until_eof=True))
+
+    assert metrics['total_reads'] == len(reads)
+    assert metrics['total_mapped_reads'] == sum(not read.is_unmapped for read in reads)
+    assert metrics['total_duplicate_reads'] == sum(read.is_duplicate for read in reads)
+    assert metrics['total_properly_paired'] == sum(
+        read.is_proper_pair and not read.is_unmapped and not read.is_secondary
+        and not read.is_supplementary for read in reads
+    )
+
+    primary = [read for read in reads if not read.is_secondary and not read.is_supplementary]
+    assert metrics['unmapped_reads'] == sum(read.is_unmapped for read in primary)
+    assert metrics['unpaired_mapped_reads'] == sum(
+        not read.is_unmapped and (not read.is_paired or read.mate_is_unmapped) for read in primary
+    )
+
+    histogram = read_depth_histogram(bamfile, sequences, 20, 20)
+    territory = histogram.sum()
+    assert metrics['coverage_breadth'] == pytest.approx((territory - histogram[0]) / territory)
+    assert metrics['coverage_depth'] == pytest.approx(
+        (np.arange(len(histogram)) * histogram).sum() / territory, abs=1e-6
+    )
+
+    inserts = [
+        abs(read.template_length) for read in reads
+        if read.is_read2 and not read.is_unmapped and not read.mate_is_unmapped
+        and not read.is_duplicate and not read.is_secondary and not read.is_supplementary
+        and read.template_length != 0 and read.is_reverse != read.mate_is_reverse
+    ]
+    assert metrics['median_insert_size'] > 0
+    assert min(inserts) <= metrics['mean_insert_size'] <= max(inserts)
+
+    gc_output = os.path.join(tmpdir, 'gc.csv.gz')
+    GenerateCNMatrix(
+        outputs['gc.txt'], gc_output, ',', 'NORMALIZED_COVERAGE', 'cell',
+        'gcbias', dtypes()['gc']
+    ).main()
+    gc_data = csvutils.read_csv_and_yaml(gc_output)
+    assert gc_data.shape == (1, 102)
+
+    for filename in outputs.values():
+        assert os.path.exists(filename)
+
+
+def test_insert_size_stats():
+    counts = collections.Counter({100: 3, 200: 10, 210: 10, 220: 6, 5000: 1})
+
+    median, mad, min_size, max_size, mean, stdev, count = bam_metrics.get_insert_size_stats(counts)
+
+    assert median == 210
+    assert mad == 10
+    assert (min_size, max_size, count) == (100, 5000, 30)
+
+    # the 5000 insert is trimmed from the mean and stdev
+    values = np.repeat([100, 200, 210, 220], [3, 10, 10, 6])
+    assert mean == pytest.approx(values.mean())
+    assert stdev == pytest.approx(values.std(ddof=1))
+
+
+def test_estimate_library_size():
+    assert bam_metrics.estimate_library_size(1000, 1000) is None
+    assert bam_metrics.estimate_library_size(1000, 0) is None
+
+    size = bam_metrics.estimate_library_size(1000, 900)
+    # expected unique pairs from sampling 1000 pairs out of the library
+    assert 900 == pytest.approx(size * (1 - np.exp(-1000 / size)), rel=1e-3)
+
+
+def test_metrics_row_matches_reports(inputs):
+    tmpdir, fasta, bamfile, _, reference_stats = inputs
+
+    outputs = collect(tmpdir, fasta, bamfile, reference_stats)
+
+    reports = os.path.join(tmpdir, 'reports.csv.gz')
+    CollectMetrics(
+        outputs['wgs.txt'], outputs['insert.txt'], outputs['flagstat.txt'],
+        outputs['markdups.txt'], reports, 'cell', dtypes()['metrics']
+    ).main()
+    reports = csvutils.read_csv_and_yaml(reports)
+
+    native = os.path.join(tmpdir, 'native.csv.gz')
+    bam_metrics.collect_bam_metrics(
+        bamfile, fasta, reference_stats,
+        outputs['markdups.txt'], outputs['flagstat.txt'], outputs['wgs.txt'],
+        outputs['gc.txt'], outputs['gc_summary.txt'], outputs['gc.pdf'],
+        outputs['insert.txt'], outputs['insert.pdf'], outputs['coverage.yaml'],
+        'cell', {'min_bqual': 20, 'min_mqual': 20, 'count_unpaired': False},
+        alignment_metrics=native
+    )
+    native = csvutils.read_csv_and_yaml(native)
+
+    assert list(native.columns) == list(reports.columns)
+    for column in reports.columns:
+        if reports[column].dtype.kind == 'f':
+            assert native[column].iloc[0] == pytest.approx(reports[column].iloc[0], abs=1e-6)
+        else:
+            assert native[column].iloc[0] == reports[column].iloc[0]
@@ -1,11 +1,25 @@
-from collections import defaultdict
+import array
+import heapq
 
+import numpy as np
 import pysam
 import yaml
 from single_cell.utils import csvutils
 from single_cell.workflows.align.dtypes import dtypes
 
 
+def get_batches(reads, batch_size=10000):
+    batch = []
+    for read in reads:
+        batch.append(read)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
 class CoverageMetrics(object):
     def __init__(
             self,
@@ -25,6 +39,7 @@ class CoverageMetrics(object):
         self.min_mapping_qual = min_mapping_qual
         self.min_base_qual = min_base_qual
         self._bam_reader = None
+        self.reset()
 
     def __enter__(self):
         self._bam_reader = self._get_bam_reader()
@@ -41,28 +56,67 @@ class CoverageMetrics(object):
         lengths = [val['LN'] for val in self._bam_reader.header['SQ']]
         return sum(lengths)
 
-    def _get_read_intervals(self, read):
+    def _get_reads_intervals(self, reads):
+        """
+        intervals of a batch of reads. with min_base_qual the qualities of all
+        reads are concatenated and the high quality runs found in one pass
+        :returns list of intervals per read
+        """
         if self.min_base_qual == 0:
-            return [(read.reference_start, read.reference_end)]
+            return [[(read.reference_start, read.reference_end)] for read in reads]
 
-        regions = []
-        start = None
+        if not reads:
+            return []
 
-        read_quals = read.query_alignment_qualities
-        if read.is_reverse:
-            read_quals = read_quals[::-1]
-        for i, qual in zip(range(read.reference_start, read.reference_end), read_quals):
-            if start is None and qual >= self.min_base_qual:
-                start = i
-            else:
-                if start is not None and qual < self.min_base_qual:
-                    regions.append((start, i))
-                    start = None
-        if start is not None:
-            regions.append((start, i))
+        read_quals = []
+        read_starts = []
+        read_lengths = []
+        for read in reads:
+            quals = read.query_alignment_qualities
+            if quals is None:
+                quals = array.array('B')
+
+            if read.is_reverse:
+                quals = quals[::-1]
+
+            # bases are paired with reference positions from the read start
+            length = min(read.reference_end - read.reference_start, len(quals))
+
+            read_quals.append(quals[:length].tobytes())
+            read_starts.append(read.reference_start)
+            read_lengths.append(length)
+
+        # reads are separated by a zero quality base, so every change
+        # in the flags is a run start followed by a run end
+        quals = np.frombuffer(b'\0' + b'\0'.join(read_quals) + b'\0', dtype=np.uint8)
+        high_qual = quals >= self.min_base_qual
+
+        edges = np.flatnonzero(high_qual[1:] != high_qual[:-1])
+        starts = edges[0::2]
+        ends = edges[1::2]
+
+        read_lengths = np.array(read_lengths)
+        offsets = np.cumsum(read_lengths + 1) - read_lengths - 1
+        read_idx = np.searchsorted(offsets, starts, side='right') - 1
+
+        starts = starts - offsets[read_idx]
+        ends = ends - offsets[read_idx]
 
-        #assert len(regions) > 0
-        return regions
+        # a run that reaches the end of the read stops at the last base
+        ends[ends == read_lengths[read_idx]] -= 1
+
+        read_starts = np.array(read_starts)[read_idx]
+        starts += read_starts
+        ends += read_starts
+
+        intervals = [[] for _ in reads]
+        for idx, start, end in zip(read_idx.tolist(), starts.tolist(), ends.tolist()):
+            intervals[idx].append((start, end))
+
+        return intervals
+
+    def _get_read_intervals(self, read):
+        return self._get_reads_intervals([read])[0]
 
     def _filter_reads(self, read):
         if not read.is_paired and self.filter_unpaired:
@@ -86,62 +140,105 @@ class CoverageMetrics(object):
 
         return False
 
+    def reset(self):
+        self.total_length = 0
+        self._chrom = None
+        self._position = None
+        # read name -> (max end, disjoint sorted intervals) for reads that
+        # can still overlap later reads on the chromosome
+        self._active = {}
+        self._ends = []
+
+    def _evict(self, position):
+        """
+        drop read names whose intervals all end before position, reads are
+        sorted so later intervals cannot overlap them
+        """
+        while self._ends and self._ends[0][0] < position:
+            end, query_name = heapq.heappop(self._ends)
+
+            # skip stale heap entries for names that were extended
+            if query_name in self._active and self._active[query_name][0] == end:
+                del self._active[query_name]
+
     @staticmethod
-    def _merge_overlapping_intervals(coords):
-        coords.sort(key=lambda x: x[0])
-
-        if len(coords) < 2:
-            return coords
-        elif len(coords) == 2:
-            if coords[1][0] <= coords[0][1]:
-                return [[coords[0][0], max(coords[0][1], coords[1][1])]]
+    def _add_interval(intervals, start, end):
+        """
+        union of the interval with the disjoint intervals of a read name
+        :returns number of new bases, updated intervals
+        """
+        new_length = end - start
+
+        merged = []
+        for istart, iend in intervals:
+            if iend < start or istart > end:
+                merged.append((istart, iend))
             else:
-                return coords
-        else:
-            i = 0
-            while i < len(coords) - 1:
-                if i < len(coords) - 1:
-                    if coords[i + 1][0] <= coords[i][1]:
-                        start = coords[i][0]
-                        end = max(coords[i][1], coords[i + 1][1])
-                        del coords[i + 1]
-                        coords[i] = [start, end]
-                    else:
-                        i += 1
-                else:
-                    i += 1
-            return coords
-
-    def generate_data(self):
-        read_dict = defaultdict(lambda: defaultdict(list))
-        for read in self._bam_reader.fetch():
-            if self._filter_reads(read) is True:
-                continue
-
-            regions = self._get_read_intervals(read)
-            if len(regions) < 1:
-                continue
-            read_dict[read.query_name][read.reference_name].extend(regions)
-        return read_dict
-
-    def get_coverage(self, read_dict):
-        total_length = 0
-        for rname, chromdata in read_dict.items():
-            for chrom, regions in chromdata.items():
-                regions = self._merge_overlapping_intervals(regions)
-                chrom_length = sum([v[1] - v[0] for v in regions])
-
-                total_length += chrom_length
-
-        return float(total_length) / self.genome_length
+                new_length -= max(min(end, iend) - max(start, istart), 0)
+                start = min(start, istart)
+                end = max(end, iend)
+
+        merged.append((start, end))
+        merged.sort()
+
+        return new_length, merged
+
+    def _add_regions(self, read, regions):
+        """
+        add the bases covered by the read that arent already covered by
+        reads with the same name, reads must be in coordinate order
+        """
+        if read.reference_name != self._chrom:
+            self._chrom = read.reference_name
+            self._position = None
+            self._active = {}
+            self._ends = []
+
+        if self._position is not None and read.reference_start < self._position:
+            raise ValueError('{} is not coordinate sorted'.format(self.bamfile))
+
+        self._position = read.reference_start
+        self._evict(read.reference_start)
+
+        if len(regions) < 1:
+            return
+
+        max_end, intervals = self._active.get(read.query_name, (None, []))
+
+        for start, end in regions:
+            new_length, intervals = self._add_interval(intervals, start, end)
+            self.total_length += new_length
+
+        end = intervals[-1][1]
+        if end != max_end:
+            heapq.heappush(self._ends, (end, read.query_name))
+        self._active[read.query_name] = (end, intervals)
+
+    def add_reads(self, reads):
+        reads = [read for read in reads if self._filter_reads(read) is not True]
+
+        for read, regions in zip(reads, self._get_reads_intervals(reads)):
+            self._add_regions(read, regions)
+
+    def add_read(self, read):
+        self.add_reads([read])
+
+    def get_coverage(self, genome_length=None):
+        if genome_length is None:
+            genome_length = self.genome_length
+
+        return float(self.total_length) / genome_length
 
     def main(self):
         if self._bam_reader is None:
             self._bam_reader = self._get_bam_reader()
 
-        read_data = self.generate_data()
-        coverage = self.get_coverage(read_data)
-        return coverage
+        self.reset()
+
+        for reads in get_batches(self._bam_reader.fetch()):
+            self.add_reads(reads)
+
+        return self.get_coverage()
 
 
 def expected_and_aligned_coverage(bamfile):
@@ -158,35 +255,66 @@ def expected_and_aligned_coverage(bamfile):
     return expected_length / genome_length, aligned_length / genome_length
 
 
+class CoverageData(object):
+    """
+    expected, aligned and all overlap metrics for reads fed in batches
+    """
+
+    def __init__(self, bamfile, cell_id, mapping_qual=10, base_qual=10):
+        self.cell_id = cell_id
+        self.expected_length = 0
+        self.aligned_length = 0
+
+        self.profiles = [
+            ('overlap_with_dups', CoverageMetrics(bamfile)),
+            ('overlap_without_dups', CoverageMetrics(bamfile, filter_duplicates=True)),
+            ('overlap_with_all_filters', CoverageMetrics(
+                bamfile, filter_duplicates=True, filter_secondary=True,
+                filter_supplementary=True, filter_unpaired=True
+            )),
+            ('overlap_with_all_filters_and_qual', CoverageMetrics(
+                bamfile, filter_duplicates=True, filter_secondary=True,
+                filter_supplementary=True, filter_unpaired=True,
+                min_base_qual=base_qual, min_mapping_qual=mapping_qual
+            )),
+        ]
+
+    def add_reads(self, reads):
+        for read in reads:
+            self.expected_length += read.query_length
+            self.aligned_length += 0 if read.reference_length is None else read.reference_length
+
+        for _, cov in self.profiles:
+            cov.add_reads(reads)
+
+    def write(self, output, genome_length):
+        outdata = {'cell_id': self.cell_id}
+
+        outdata['expected'] = self.expected_length / genome_length
+        outdata['aligned'] = self.aligned_length / genome_length
+
+        for name, cov in self.profiles:
+            outdata[name] = cov.get_coverage(genome_length)
+
+        with open(output, 'wt') as writer:
+            yaml.dump(outdata, writer)
+
+
 def get_coverage_data(bamfile, output, cell_id, mapping_qual=10, base_qual=10):
-    outdata = {'cell_id': cell_id}
+    """
+    expected, aligned and all overlap metrics in a single pass over the bam
+    """
+    coverage = CoverageData(
+        bamfile, cell_id, mapping_qual=mapping_qual, base_qual=base_qual
+    )
 
-    expected_cov, aligned_cov = expected_and_aligned_coverage(bamfile)
+    with pysam.AlignmentFile(bamfile, 'rb') as bam:
+        genome_length = sum(bam.lengths)
 
-    outdata['expected'] = expected_cov
-    outdata['aligned'] = aligned_cov
+        for reads in get_batches(bam.fetch(until_eof=True)):
+            coverage.add_reads(reads)
 
-    with CoverageMetrics(bamfile) as cov:
-        outdata['overlap_with_dups'] = cov.main()
-
-    with CoverageMetrics(bamfile, filter_duplicates=True) as cov:
-        outdata['overlap_without_dups'] = cov.main()
-
-    with CoverageMetrics(
-            bamfile, filter_duplicates=True, filter_secondary=True,
-            filter_supplementary=True, filter_unpaired=True
-    ) as cov:
-        outdata['overlap_with_all_filters'] = cov.main()
-
-    with CoverageMetrics(
-            bamfile, filter_duplicates=True, filter_secondary=True,
-            filter_supplementary=True, filter_unpaired=True,
-            min_base_qual=base_qual, min_mapping_qual=mapping_qual
-    ) as cov:
-        outdata['overlap_with_all_filters_and_qual'] = cov.main()
-
-    with open(output, 'wt') as writer:
-        yaml.dump(outdata, writer)
+    coverage.write(output, genome_length)
 
 
 def annotate_coverage_metrics(metrics, coverage_yaml, output):
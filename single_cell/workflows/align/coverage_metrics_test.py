@@ -0,0 +1,173 @@
+import os
+import random
+from collections import defaultdict
+
+import pysam
+import yaml
+from single_cell.workflows.align.coverage_metrics import CoverageMetrics
+from single_cell.workflows.align.coverage_metrics import get_coverage_data
+
+CHROMS = [('1', 20000), ('2', 15000)]
+
+
+def simulate_bam(bamfile, n_pairs=300, seed=0):
+    rng = random.Random(seed)
+
+    header = {
+        'HD': {'VN': '1.6', 'SO': 'coordinate'},
+        'SQ': [{'SN': name, 'LN': length} for name, length in CHROMS],
+    }
+
+    reads = []
+    for i in range(n_pairs):
+        ref_id = rng.randint(0, len(CHROMS) - 1)
+        start = rng.randint(0, CHROMS[ref_id][1] - 500)
+
+        # mates overlap often so the per read name union matters
+        mate_starts = [start, start + rng.randint(0, 150)]
+        for mate, mate_start in enumerate(mate_starts):
+            read = pysam.AlignedSegment()
+            read.query_name = 'read{}'.format(i)
+            read.query_sequence = 'A' * 100
+            read.reference_id = ref_id
+            read.reference_start = mate_start
+            read.cigarstring = rng.choice(['100M', '40M10D60M', '50M5I45M', '20S80M'])
+            read.query_qualities = pysam.qualitystring_to_array(
+                ''.join(rng.choice('+5?I') for _ in range(100))
+            )
+            read.mapping_quality = rng.choice([0, 5, 30, 60])
+
+            flag = 1 | (64 if mate == 0 else 128)
+            if rng.random() < 0.2:
+                flag |= 1024
+            if rng.random() < 0.05:
+                flag |= 256
+            if rng.random() < 0.05:
+                flag |= 2048
+            if rng.random() < 0.1:
+                flag |= 16
+            if rng.random() < 0.05:
+                flag &= ~1
+            read.flag = flag
+
+            reads.append(read)
+
+    reads.sort(key=lambda read: (read.reference_id, read.reference_start))
+
+    with pysam.AlignmentFile(bamfile, 'wb', header=header) as writer:
+        for read in reads:
+            writer.write(read)
+
+    pysam.index(bamfile)
+
+
+def read_dict_coverage(bamfile, **kwargs):
+    """
+    per read name interval union from before the single pass sweep
+    """
+    with CoverageMetrics(bamfile, **kwargs) as cov:
+        read_dict = defaultdict(lambda: defaultdict(list))
+        for read in cov._bam_reader.fetch():
+            if cov._filter_reads(read) is True:
+                continue
+
+            regions = cov._get_read_intervals(read)
+            if len(regions) < 1:
+                continue
+            read_dict[read.query_name][read.reference_name].extend(regions)
+
+        total_length = 0
+        for chromdata in read_dict.values():
+            for regions in chromdata.values():
+                covered = set()
+                for start, end in regions:
+                    covered.update(range(start, end))
+                total_length += len(covered)
+
+        return float(total_length) / cov.genome_length
+
+
+def test_coverage_matches_read_dict(tmpdir):
+    bamfile = os.path.join(str(tmpdir), 'test.bam')
+    simulate_bam(bamfile)
+
+    output = os.path.join(str(tmpdir), 'coverage.yaml')
+    get_coverage_data(bamfile, output, 'cell1', mapping_qual=10, base_qual=20)
+
+    with open(output) as reader:
+        data = yaml.safe_load(reader)
+
+    all_filters = dict(
+        filter_duplicates=True, filter_secondary=True,
+        filter_supplementary=True, filter_unpaired=True
+    )
+
+    expected = {
+        'overlap_with_dups': read_dict_coverage(bamfile),
+        'overlap_without_dups': read_dict_coverage(bamfile, filter_duplicates=True),
+        'overlap_with_all_filters': read_dict_coverage(bamfile, **all_filters),
+        'overlap_with_all_filters_and_qual': read_dict_coverage(
+            bamfile, min_base_qual=20, min_mapping_qual=10, **all_filters
+        ),
+    }
+
+    assert data['cell_id'] == 'cell1'
+    for metric, value in expected.items():
+        assert abs(data[metric] - value) < 1e-12, metric
+
+    assert data['overlap_with_dups'] > data['overlap_with_all_filters_and_qual'] > 0
+
+    genome_length = sum(length for _, length in CHROMS)
+    assert abs(data['expected'] - 600 * 100 / float(genome_length)) < 1e-12
+
+
+def test_coverage_main(tmpdir):
+    bamfile = os.path.join(str(tmpdir), 'test.bam')
+    simulate_bam(bamfile)
+
+    with CoverageMetrics(bamfile, filter_duplicates=True) as cov:
+        assert abs(cov.main() - read_dict_coverage(bamfile, filter_duplicates=True)) < 1e-12
+
+
+def loop_read_intervals(read, min_base_qual):
+    """
+    base by base interval extraction from before the numpy version
+    """
+    regions = []
+    start = None
+
+    read_quals = read.query_alignment_qualities
+    if read.is_reverse:
+        read_quals = read_quals[::-1]
+    for i, qual in zip(range(read.reference_start, read.reference_end), read_quals):
+        if start is None and qual >= min_base_qual:
+            start = i
+        else:
+            if start is not None and qual < min_base_qual:
+                regions.append((start, i))
+                start = None
+    if start is not None:
+        regions.append((start, i))
+
+    return regions
+
+
+def test_read_intervals_match_loop(tmpdir):
+    bamfile = os.path.join(str(tmpdir), 'test.bam')
+    simulate_bam(bamfile, n_pairs=1000)
+
+    for min_base_qual in [1, 10, 20, 30, 41]:
+        with CoverageMetrics(bamfile, min_base_qual=min_base_qual) as cov:
+            for read in cov._bam_reader.fetch():
+                expected = loop_read_intervals(read, min_base_qual)
+                assert cov._get_read_intervals(read) == expected
+
+
+def test_batch_read_intervals_match_loop(tmpdir):
+    bamfile = os.path.join(str(tmpdir), 'test.bam')
+    simulate_bam(bamfile, n_pairs=1000)
+
+    with CoverageMetrics(bamfile, min_base_qual=20) as cov:
+        reads = list(cov._bam_reader.fetch())
+        expected = [loop_read_intervals(read, 20) for read in reads]
+        assert cov._get_reads_intervals(reads) == expected
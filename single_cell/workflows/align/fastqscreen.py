@@ -6,7 +6,6 @@ import pandas as pd
 import pypeliner
 import single_cell.workflows.align.fastqscreen_utils as utils
 from single_cell.utils import csvutils
-from single_cell.utils import fastqutils
 from single_cell.utils import helpers
 from single_cell.workflows.align.dtypes import fastqscreen_dtypes
 
@@ -74,14 +73,8 @@ def run_fastq_screen_paired_end(fastq_r1, fastq_r2, tempdir, params):
         fastq_r1, fastq_r2,
     )
 
-    if utils.regroup_needed(params):
-        fixed_fastq_r1 = os.path.join(tempdir, '{}.tagged.fixed{}'.format(r1_basename, r1_ext))
-        fixed_fastq_r2 = os.path.join(tempdir, '{}.tagged.fixed{}'.format(r2_basename, r2_ext))
-        utils.regroup_genomes(tagged_fastq_r1, fixed_fastq_r1)
-        utils.regroup_genomes(tagged_fastq_r2, fixed_fastq_r2)
-        return fixed_fastq_r1, fixed_fastq_r2
-    else:
-        return tagged_fastq_r1, tagged_fastq_r2
+    # genomes with multiple indexes are regrouped while filtering
+    return tagged_fastq_r1, tagged_fastq_r2
 
 
 def write_detailed_counts(counts, outfile, cell_id, fastqscreen_params):
@@ -170,13 +163,10 @@ def organism_filter(
         fastq_r1, fastq_r2, tempdir, params,
     )
 
-    reader = fastqutils.PairedTaggedFastqReader(tagged_fastq_r1, tagged_fastq_r2)
-    counts = reader.gather_counts()
-
-    write_detailed_counts(counts, detailed_metrics, cell_id, params)
-    write_summary_counts(counts, summary_metrics, cell_id, params)
-
-    utils.filter_tag_reads(
+    counts = utils.filter_and_count_tag_reads(
         tagged_fastq_r1, tagged_fastq_r2, filtered_fastq_r1,
         filtered_fastq_r2, params
     )
+
+    write_detailed_counts(counts, detailed_metrics, cell_id, params)
+    write_summary_counts(counts, summary_metrics, cell_id, params)
@@ -112,3 +112,28 @@ def filter_tag_reads(
 
             for line in read_2:
                 writer_r2.write(line)
+
+
+def filter_and_count_tag_reads(
+        input_r1, input_r2, output_r1, output_r2, params
+):
+    """
+    regroups, counts and filters the tagged reads in a single pass
+    :returns tag counts per read end
+    """
+    genomes = [v['name'] for v in params['genomes']]
+
+    if not params['filter_tags']:
+        filter_tags = set()
+    else:
+        filter_tags = set(params['filter_tags'])
+
+    reader = fastqutils.PairedTaggedFastqReader(input_r1, input_r2)
+
+    with helpers.getFileHandle(output_r1, 'wt') as writer_r1, helpers.getFileHandle(output_r2, 'wt') as writer_r2:
+        counts = reader.gather_counts_and_filter(
+            genomes, filter_tags, writer_r1, writer_r2,
+            regroup=regroup_needed(params)
+        )
+
+    return counts
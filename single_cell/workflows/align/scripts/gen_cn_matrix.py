@@ -6,6 +6,7 @@ Created on Sep 8, 2015
 import logging
 import numpy as np
 import pandas as pd
+from single_cell.utils import cnmatrixutils
 from single_cell.utils import csvutils
 
 class GenerateCNMatrix(object):
@@ -51,6 +52,10 @@ class GenerateCNMatrix(object):
         
         """
         column_name = self.column_name
+
+        if cnmatrixutils.is_cn_matrix(self.input):
+            return self.read_hmmcopy_matrix(sample_id)
+
         data = pd.read_csv(self.input)
         if column_name in data.columns:
             df = data[['chr', 'start', 'end', 'width', column_name]]
@@ -63,6 +68,24 @@ class GenerateCNMatrix(object):
         
         return df
 
+    def read_hmmcopy_matrix(self, sample_id):
+        """
+        reads a single cell from the hmmcopy cell by bin matrix store
+        """
+        store = cnmatrixutils.CnMatrixInput(self.input)
+
+        if self.column_name in store.columns:
+            data = store.read_column(self.column_name, cells=[sample_id])
+            values = data.values[0]
+        else:
+            values = float('NaN')
+
+        df = store.bins.to_frame(index=False)
+        df['width'] = df['end'] - df['start'] + 1
+        df[sample_id] = values
+
+        return df
+
     def read_gcbias_file(self, sample_id):
         """
         parses the gcbias data
@@ -8,6 +8,20 @@ import pypeliner.managed as mgd
 import pypeliner
 
 
+def get_cell_batches(cell_ids, cells_per_job):
+    """
+    split cells into groups of cells_per_job
+    :return list of (batch_id, cell_id) tuples
+    """
+    cell_ids = sorted(cell_ids)
+
+    batches = []
+    for i, cell_id in enumerate(cell_ids):
+        batches.append(('batch{}'.format(i // cells_per_job), cell_id))
+
+    return batches
+
+
 def create_hmmcopy_workflow(
         bam_file, reads, segs, metrics, params, igv_seg_filename,
         segs_pdf, bias_pdf, plot_heatmap_ec_output,
@@ -21,51 +35,116 @@ def create_hmmcopy_workflow(
 
     workflow = pypeliner.workflow.Workflow(ctx=ctx)
 
-    workflow.setobj(
-        obj=mgd.OutputChunks('cell_id'),
-        value=cell_ids,
-    )
+    cells_per_job = hmmparams['cells_per_job']
+
+    # per cell files can be stored in the columnar format to skip csv
+    # parsing in the merge and plotting tasks
+    temp_ext = {
+        'csv': '.csv.gz', 'columnar': '.columnar'
+    }[hmmparams['intermediate_format']]
+
+    if cells_per_job > 1:
+        # per cell files are nested under batches of cells_per_job cells
+        batches = get_cell_batches(cell_ids, cells_per_job)
+        cell_axes = ('batch_id', 'cell_id')
+
+        bam_file = {(batch, cell): bam_file[cell] for batch, cell in batches}
+        cell_sample_info = {(batch, cell): sample_info[cell] for batch, cell in batches}
+
+        workflow.setobj(
+            obj=mgd.OutputChunks(*cell_axes),
+            value=batches,
+        )
+    else:
+        cell_axes = ('cell_id',)
+        cell_sample_info = sample_info
+
+        workflow.setobj(
+            obj=mgd.OutputChunks('cell_id'),
+            value=cell_ids,
+        )
 
     workflow.setobj(
-        obj=mgd.TempOutputObj('sampleinfo', 'cell_id', axes_origin=[]),
-        value=sample_info)
+        obj=mgd.TempOutputObj('sampleinfo', *cell_axes, axes_origin=[]),
+        value=cell_sample_info)
 
-    workflow.transform(
-        name='run_hmmcopy',
-        ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1},
-        func="single_cell.workflows.hmmcopy.tasks.run_hmmcopy",
-        axes=('cell_id',),
-        args=(
-            mgd.InputFile('bam_markdups', 'cell_id', fnames=bam_file, extensions=['.bai']),
-            mgd.TempOutputFile('reads.csv.gz', 'cell_id', extensions=['.yaml']),
-            mgd.TempOutputFile('segs.csv.gz', 'cell_id', extensions=['.yaml']),
-            mgd.TempOutputFile('params.csv.gz', 'cell_id', extensions=['.yaml']),
-            mgd.TempOutputFile('hmm_metrics.csv.gz', 'cell_id', extensions=['.yaml']),
-            mgd.TempOutputFile('hmm_data.tar.gz', 'cell_id'),
-            mgd.InputInstance('cell_id'),
-            hmmparams,
-            mgd.TempSpace('hmmcopy_temp', 'cell_id'),
-        ),
-    )
+    # only the modal correction reads the gc and mappability cache
+    hmmcopy_kwargs = {}
+    if hmmparams['smoothing_function'] in ['modal', 'fast_modal']:
+        reference_cache = 'reference_cache_{}.bin'.format(hmmparams['bin_size'])
+
+        workflow.transform(
+            name='create_reference_cache',
+            ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1},
+            func="single_cell.workflows.hmmcopy.tasks.create_reference_cache",
+            args=(
+                hmmparams,
+                mgd.TempOutputFile(reference_cache, extensions=['.yaml']),
+            ),
+        )
+
+        hmmcopy_kwargs['reference_cache'] = mgd.TempInputFile(
+            reference_cache, extensions=['.yaml']
+        )
+
+    if cells_per_job > 1:
+        workflow.transform(
+            name='run_hmmcopy',
+            ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1},
+            func="single_cell.workflows.hmmcopy.tasks.run_hmmcopy_batch",
+            axes=('batch_id',),
+            args=(
+                mgd.InputFile('bam_markdups', *cell_axes, fnames=bam_file, extensions=['.bai'], axes_origin=[]),
+                mgd.TempOutputFile('reads' + temp_ext, *cell_axes, extensions=['.yaml'], axes_origin=[]),
+                mgd.TempOutputFile('segs' + temp_ext, *cell_axes, extensions=['.yaml'], axes_origin=[]),
+                mgd.TempOutputFile('params' + temp_ext, *cell_axes, extensions=['.yaml'], axes_origin=[]),
+                mgd.TempOutputFile('hmm_metrics' + temp_ext, *cell_axes, extensions=['.yaml'], axes_origin=[]),
+                mgd.TempOutputFile('hmm_data.tar.gz', *cell_axes, axes_origin=[]),
+                hmmparams,
+                mgd.TempSpace('hmmcopy_temp', 'batch_id'),
+            ),
+            kwargs=hmmcopy_kwargs,
+        )
+    else:
+        workflow.transform(
+            name='run_hmmcopy',
+            ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1},
+            func="single_cell.workflows.hmmcopy.tasks.run_hmmcopy",
+            axes=('cell_id',),
+            args=(
+                mgd.InputFile('bam_markdups', 'cell_id', fnames=bam_file, extensions=['.bai']),
+                mgd.TempOutputFile('reads' + temp_ext, 'cell_id', extensions=['.yaml']),
+                mgd.TempOutputFile('segs' + temp_ext, 'cell_id', extensions=['.yaml']),
+                mgd.TempOutputFile('params' + temp_ext, 'cell_id', extensions=['.yaml']),
+                mgd.TempOutputFile('hmm_metrics' + temp_ext, 'cell_id', extensions=['.yaml']),
+                mgd.TempOutputFile('hmm_data.tar.gz', 'cell_id'),
+                mgd.InputInstance('cell_id'),
+                hmmparams,
+                mgd.TempSpace('hmmcopy_temp', 'cell_id'),
+            ),
+            kwargs=hmmcopy_kwargs,
+        )
 
     workflow.transform(
         name='merge_reads',
         ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1},
-        func="single_cell.workflows.hmmcopy.tasks.concatenate_csv",
+        func="single_cell.workflows.hmmcopy.tasks.merge_reads",
         args=(
-            mgd.TempInputFile('reads.csv.gz', 'cell_id', axes_origin=[], extensions=['.yaml']),
+            mgd.TempInputFile('reads' + temp_ext, *cell_axes, axes_origin=[], extensions=['.yaml']),
             mgd.TempOutputFile('reads_merged.csv.gz', extensions=['.yaml']),
+            mgd.TempOutputFile('reads_matrix.npz'),
         ),
     )
 
     workflow.transform(
         name='add_mappability_bool',
-        ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1},
+        ctx={'mem': hmmparams['memory']['med'], 'ncpus': hmmparams['max_cores']},
         func="single_cell.workflows.hmmcopy.tasks.get_mappability_col",
         args=(
             mgd.TempInputFile('reads_merged.csv.gz', extensions=['.yaml']),
             mgd.OutputFile(reads, extensions=['.yaml']),
         ),
+        kwargs={'threads': hmmparams['max_cores']},
     )
 
     workflow.transform(
@@ -73,7 +152,7 @@ def create_hmmcopy_workflow(
         ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1},
         func="single_cell.workflows.hmmcopy.tasks.concatenate_csv",
         args=(
-            mgd.TempInputFile('segs.csv.gz', 'cell_id', axes_origin=[], extensions=['.yaml']),
+            mgd.TempInputFile('segs' + temp_ext, *cell_axes, axes_origin=[], extensions=['.yaml']),
             mgd.OutputFile(segs, extensions=['.yaml']),
         ),
     )
@@ -83,7 +162,7 @@ def create_hmmcopy_workflow(
         ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1},
         func="single_cell.workflows.hmmcopy.tasks.concatenate_csv",
         args=(
-            mgd.TempInputFile('hmm_metrics.csv.gz', 'cell_id', axes_origin=[], extensions=['.yaml']),
+            mgd.TempInputFile('hmm_metrics' + temp_ext, *cell_axes, axes_origin=[], extensions=['.yaml']),
             mgd.TempOutputFile("hmm_metrics.csv.gz", extensions=['.yaml']),
         ),
     )
@@ -93,7 +172,7 @@ def create_hmmcopy_workflow(
         ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1},
         func="single_cell.workflows.hmmcopy.tasks.concatenate_csv",
         args=(
-            mgd.TempInputFile('params.csv.gz', 'cell_id', axes_origin=[], extensions=['.yaml']),
+            mgd.TempInputFile('params' + temp_ext, *cell_axes, axes_origin=[], extensions=['.yaml']),
             mgd.OutputFile(params, extensions=['.yaml']),
         ),
     )
@@ -104,7 +183,7 @@ def create_hmmcopy_workflow(
         func="single_cell.workflows.hmmcopy.tasks.get_max_cn",
         ret=mgd.TempOutputObj('max_cn'),
         args=(
-            mgd.InputFile(reads, extensions=['.yaml']),
+            mgd.TempInputFile('reads_matrix.npz'),
         )
     )
 
@@ -112,20 +191,20 @@ def create_hmmcopy_workflow(
         name='hmmcopy_plots',
         ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1},
         func="single_cell.workflows.hmmcopy.tasks.plot_hmmcopy",
-        axes=('cell_id',),
+        axes=cell_axes,
         args=(
-            mgd.TempInputFile('reads.csv.gz', 'cell_id', axes_origin=[], extensions=['.yaml']),
-            mgd.TempInputFile('segs.csv.gz', 'cell_id', axes_origin=[], extensions=['.yaml']),
-            mgd.TempInputFile('params.csv.gz', 'cell_id', axes_origin=[], extensions=['.yaml']),
-            mgd.TempInputFile('hmm_metrics.csv.gz', 'cell_id', axes_origin=[], extensions=['.yaml']),
+            mgd.TempInputFile('reads' + temp_ext, *cell_axes, axes_origin=[], extensions=['.yaml']),
+            mgd.TempInputFile('segs' + temp_ext, *cell_axes, axes_origin=[], extensions=['.yaml']),
+            mgd.TempInputFile('params' + temp_ext, *cell_axes, axes_origin=[], extensions=['.yaml']),
+            mgd.TempInputFile('hmm_metrics' + temp_ext, *cell_axes, axes_origin=[], extensions=['.yaml']),
             hmmparams['ref_genome'],
-            mgd.TempOutputFile('segments.png', 'cell_id', axes_origin=[]),
-            mgd.TempOutputFile('bias.png', 'cell_id', axes_origin=[]),
+            mgd.TempOutputFile('segments.png', *cell_axes, axes_origin=[]),
+            mgd.TempOutputFile('bias.png', *cell_axes, axes_origin=[]),
             mgd.InputInstance('cell_id'),
         ),
         kwargs={
             'num_states': hmmparams['num_states'],
-            'sample_info': mgd.TempInputObj('sampleinfo', 'cell_id'),
+            'sample_info': mgd.TempInputObj('sampleinfo', *cell_axes),
             'max_cn': mgd.TempInputObj("max_cn")
         }
     )
@@ -135,7 +214,7 @@ def create_hmmcopy_workflow(
         ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1},
         func="single_cell.workflows.hmmcopy.tasks.add_clustering_order",
         args=(
-            mgd.InputFile(reads, extensions=['.yaml']),
+            mgd.TempInputFile('reads_matrix.npz'),
             mgd.TempInputFile("hmm_metrics.csv.gz", extensions=['.yaml']),
             mgd.OutputFile(metrics, extensions=['.yaml']),
         ),
@@ -151,8 +230,8 @@ def create_hmmcopy_workflow(
         func="single_cell.workflows.hmmcopy.tasks.merge_pdf",
         args=(
             [
-                mgd.TempInputFile('segments.png', 'cell_id'),
-                mgd.TempInputFile('bias.png', 'cell_id'),
+                mgd.TempInputFile('segments.png', *cell_axes),
+                mgd.TempInputFile('bias.png', *cell_axes),
             ],
             [
                 mgd.OutputFile(segs_pdf),
@@ -206,7 +285,7 @@ def create_hmmcopy_workflow(
         ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1},
         func="single_cell.workflows.hmmcopy.tasks.plot_pcolor",
         args=(
-            mgd.InputFile(reads, extensions=['.yaml']),
+            mgd.TempInputFile('reads_matrix.npz'),
             mgd.InputFile(metrics, extensions=['.yaml']),
             mgd.OutputFile(plot_heatmap_ec_output),
         ),
@@ -227,7 +306,7 @@ def create_hmmcopy_workflow(
         ctx={'mem': hmmparams['memory']['med'], 'ncpus': 1},
         func="single_cell.workflows.hmmcopy.tasks.create_hmmcopy_data_tar",
         args=(
-            mgd.TempInputFile('hmm_data.tar.gz', 'cell_id', axes_origin=[]),
+            mgd.TempInputFile('hmm_data.tar.gz', *cell_axes, axes_origin=[]),
             mgd.OutputFile(hmmcopy_data_tar),
             mgd.TempSpace("merge_tarballs")
         ),
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from single_cell.workflows.hmmcopy.scripts import CorrectReadCount
+
+
+def simulate_regression_data(seed, num_bins=3000):
+    rng = np.random.RandomState(seed)
+
+    gc = rng.uniform(0.3, 0.6, num_bins)
+
+    copy_number = rng.choice([1, 1, 1.5, 0.5], num_bins)
+    expected = 200 * (1 + 2 * (gc - 0.45) - 8 * (gc - 0.45) ** 2) * copy_number
+
+    df = pd.DataFrame({'gc': gc, 'reads': rng.poisson(expected)})
+
+    df = df[df['reads'] > 0]
+    df = df.sort_values(by='gc')
+
+    return df
+
+
+def run_modal_regression(df, smoothing_function):
+    corr = CorrectReadCount(
+        'gc.wig', 'map.wig', 'reads.wig', 'output.csv',
+        smoothing_function=smoothing_function
+    )
+
+    return corr.modal_quantile_regression(pd.DataFrame.copy(df))
+
+
+def test_fast_modal_matches_modal():
+    for seed in range(3):
+        df = simulate_regression_data(seed)
+
+        modal = run_modal_regression(df, 'modal')
+        fast_modal = run_modal_regression(df, 'fast_modal')
+
+        assert modal['modal_quantile'].tolist() == fast_modal['modal_quantile'].tolist()
+
+        cols = [str(x) for x in range(10, 91)] + ['modal_curve', 'modal_corrected']
+        assert np.allclose(modal[cols].values, fast_modal[cols].values, rtol=1e-3)
+
+
+def test_fast_modal_too_few_bins():
+    df = simulate_regression_data(0, num_bins=8)
+
+    fast_modal = run_modal_regression(df, 'fast_modal')
+
+    assert 'modal_quantile' not in fast_modal
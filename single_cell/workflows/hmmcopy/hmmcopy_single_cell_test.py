@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+
+from single_cell.workflows.hmmcopy.scripts import HMMcopySingleCell
+from single_cell.workflows.hmmcopy.scripts import hmmcopy_single_cell
+
+HMMPARAMS = {
+    'multipliers': [1, 2, 3, 4, 5, 6],
+    'e': 0.999999,
+    'eta': 50000,
+    'g': 3,
+    'lambda': 20,
+    'nu': 2.1,
+    's': 1,
+    'strength': 1000,
+    'kappa': '100,100,700,100,25,25,25,25,25,25,25,25',
+    'm': '0,1,2,3,4,5,6,7,8,9,10,11',
+    'mu': '0,1,2,3,4,5,6,7,8,9,10,11',
+}
+
+
+def simulate_corrected_reads(seed):
+    rng = np.random.RandomState(seed)
+
+    data = []
+    for chrom in ['1', '2', '3', '10', 'X']:
+        num_bins = rng.randint(100, 300)
+
+        copy_number = np.full(num_bins, 2.0)
+        start = rng.randint(0, num_bins - 50)
+        copy_number[start:start + 40] = rng.choice([1, 3, 4])
+
+        data.append(pd.DataFrame({
+            'chr': chrom,
+            'start': np.arange(num_bins) * 500000 + 1,
+            'end': (np.arange(num_bins) + 1) * 500000,
+            'copy_number': copy_number,
+        }))
+
+    df = pd.concat(data, ignore_index=True)
+
+    num_bins = len(df)
+    df['reads'] = rng.poisson(100, num_bins)
+    df['gc'] = 0.4
+    df['map'] = 1.0
+    df['cor_gc'] = df['copy_number'] / 2 * rng.normal(1, 0.05, num_bins)
+    df['copy'] = df['cor_gc']
+    df['valid'] = True
+    df['ideal'] = rng.uniform(size=num_bins) > 0.05
+    df['modal_curve'] = 1.0
+    df['modal_quantile'] = 0.5
+    df['cor_map'] = float('NaN')
+
+    return df.sample(frac=1, random_state=seed)
+
+
+def naive_forward_backward(pi, A, py):
+    num_bins, num_states = py.shape
+
+    alpha = np.zeros((num_bins, num_states))
+    scale = np.zeros(num_bins)
+    alpha[0] = pi * py[0]
+    scale[0] = alpha[0].sum()
+    alpha[0] /= scale[0]
+    for t in range(1, num_bins):
+        alpha[t] = np.dot(alpha[t - 1], A) * py[t]
+        scale[t] = alpha[t].sum()
+        alpha[t] /= scale[t]
+
+    beta = np.ones((num_bins, num_states))
+    for t in range(num_bins - 2, -1, -1):
+        beta[t] = np.dot(py[t + 1] * beta[t + 1], A.T) / scale[t + 1]
+
+    return alpha * beta, np.log(scale).sum()
+
+
+def test_forward_backward_matches_per_chromosome():
+    df = simulate_corrected_reads(0)
+    df = df.sort_values(['chr', 'start'])
+
+    params = hmmcopy_single_cell.get_parameters(HMMPARAMS)
+    num_states = len(params['mu'])
+
+    copy = df['copy'].values * 2
+    copy[~df['ideal'].values] = np.nan
+
+    blocks = hmmcopy_single_cell.ChromosomeBlocks(df['chr'].values)
+
+    py = hmmcopy_single_cell.tdist_pdf(
+        copy, params['mu'], params['lambda'], params['nu']
+    )
+    A = np.full((num_states, num_states), 0.01 / (num_states - 1))
+    np.fill_diagonal(A, 0.99)
+    pi = params['kappa'] / params['kappa'].sum()
+
+    rho, loglik, _ = hmmcopy_single_cell.forward_backward(pi, A, py, blocks)
+
+    expected_loglik = 0
+    for start, length in zip(blocks.starts, blocks.lengths):
+        chrom_rho, chrom_loglik = naive_forward_backward(
+            pi, A, py[:, start:start + length].T
+        )
+        assert np.allclose(rho[:, start:start + length], chrom_rho.T)
+        expected_loglik += chrom_loglik
+
+    assert np.isclose(loglik, expected_loglik)
+
+
+def test_hmmcopy_single_cell():
+    df = simulate_corrected_reads(1)
+
+    outputs = HMMcopySingleCell(df, 'cell1', HMMPARAMS).main()
+
+    assert sorted(outputs.keys()) == [0, 1, 2, 3, 4, 5, 6]
+
+    best = outputs[0]
+    assert best['metrics']['multiplier'].iloc[0] == 2
+
+    reads = best['reads'].merge(df[['chr', 'start', 'copy_number']])
+    assert (reads['state'] == reads['copy_number']).mean() > 0.99
+
+    segs = best['segs']
+    assert (segs['state'] != 2).sum() == 5
+
+
+def test_hmmcopy_single_cell_no_data():
+    df = simulate_corrected_reads(2)
+    df['cor_gc'] = float('NaN')
+
+    outputs = HMMcopySingleCell(df, 'cell1', HMMPARAMS).main()
+
+    best = outputs[0]
+    assert best['segs'].empty
+    assert best['params'].empty
+    assert best['reads']['state'].isnull().all()
+    assert best['metrics']['multiplier'].iloc[0] == 6
@@ -0,0 +1,183 @@
+import os
+import random
+
+import numpy as np
+import pysam
+import pytest
+from single_cell.workflows.hmmcopy.scripts.read_counter import ExcludedRegions
+from single_cell.workflows.hmmcopy.scripts.read_counter import ReadCounter
+
+WINDOW_SIZE = 1000
+
+# chromosome 1 ends with a partial bin, chromosome 2 on a bin boundary
+CHROMS = [('1', 10500), ('2', 10000)]
+
+EXCLUDED = [('1', 2500, 3200), ('1', 3000, 3500), ('1', 3500, 3600), ('2', 9990, 10000)]
+
+
+def simulate_bam(bamfile, seed=0):
+    rng = random.Random(seed)
+
+    header = {
+        'HD': {'VN': '1.6', 'SO': 'coordinate'},
+        'SQ': [{'SN': name, 'LN': length} for name, length in CHROMS],
+    }
+
+    reads = []
+    for ref_id, (_, length) in enumerate(CHROMS):
+        # reads on and around the bin edges and the ends of the chromosome
+        positions = [0, 1, length - 1]
+        for edge in range(WINDOW_SIZE, length, WINDOW_SIZE):
+            positions += [edge - 1, edge, edge + 1]
+        positions += [rng.randint(0, length - 1) for _ in range(2000)]
+
+        for pos in positions:
+            reads.append((ref_id, pos))
+
+    reads.sort()
+
+    with pysam.AlignmentFile(bamfile, 'wb', header=header) as writer:
+        for i, (ref_id, pos) in enumerate(reads):
+            read = pysam.AlignedSegment()
+            read.query_name = 'read{}'.format(i)
+            read.query_sequence = 'A' * 50
+            read.query_qualities = pysam.qualitystring_to_array('I' * 50)
+            read.reference_id = ref_id
+            read.reference_start = pos
+            read.cigarstring = '50M'
+            read.flag = 1024 if rng.random() < 0.1 else 0
+            read.mapping_quality = rng.choice([0, 10, 20, 60, 60, 60])
+            read.set_tag('FS', 'grch37_{},mm10_0,salmon_0'.format(rng.choice([0, 1, 1, 2])))
+            writer.write(read)
+
+    pysam.index(bamfile)
+
+
+def get_chrom_excluded(excluded, chrom, chrom_length):
+    """
+    per position excluded array the read counter used before the interval
+    lookup
+    """
+    chrom_excluded = np.zeros(chrom_length + 1, dtype=np.uint8)
+
+    for ex_chrom, start, end in excluded:
+        if ex_chrom != chrom:
+            continue
+        start = min(start, chrom_length)
+        end = min(end, chrom_length)
+        chrom_excluded[start:end] = 1
+
+    return chrom_excluded
+
+
+def is_filtered(read, mapq, reference, chrom_excluded):
+    if chrom_excluded is not None and chrom_excluded[read.reference_start]:
+        return True
+
+    if read.is_duplicate:
+        return True
+
+    if read.mapping_quality < mapq:
+        return True
+
+    fastqscreen_tags = read.get_tag('FS')
+    if fastqscreen_tags and reference:
+        fastqscreen_tags = dict(val.split('_') for val in fastqscreen_tags.split(','))
+        if int(fastqscreen_tags[reference]) == 0:
+            return True
+
+    return False
+
+
+def count_reads_per_read(bamfile, chrom, reflen, mapq, reference, chrom_excluded):
+    """
+    the per read loop the read counter used before get_counts
+    """
+    bins = []
+
+    with pysam.AlignmentFile(bamfile, 'rb') as bam:
+        count = 0
+        start = 0
+        end = start + WINDOW_SIZE
+        for read in bam.fetch(chrom, 0, reflen):
+            while read.pos > end:
+                bins.append((start, end, count))
+                count = 0
+                start += WINDOW_SIZE
+                end = min(start + WINDOW_SIZE, reflen)
+
+            if not is_filtered(read, mapq, reference, chrom_excluded):
+                count += 1
+
+        while True:
+            bins.append((start, end, count))
+            count = 0
+            start += WINDOW_SIZE
+            end = start + WINDOW_SIZE
+            if start > reflen:
+                break
+            if end > reflen:
+                bins.append((start, reflen, count))
+                break
+
+    return bins
+
+
+def write_excluded(excluded_file, excluded):
+    with open(excluded_file, 'w') as writer:
+        writer.write('chrom\tstart\tend\n')
+        for row in excluded:
+            writer.write('\t'.join(map(str, row)) + '\n')
+
+
+@pytest.mark.parametrize('excluded', [
+    # overlapping, adjacent and nested intervals
+    [('1', 100, 200), ('1', 150, 300), ('1', 300, 400), ('1', 350, 360)],
+    # unsorted, empty and past the end of the chromosome
+    [('1', 900, 1100), ('1', 0, 10), ('1', 500, 500), ('1', 600, 550)],
+    # other chromosomes only
+    [('2', 0, 1000), ('X', 10, 20)],
+])
+def test_is_excluded_matches_per_position_check(tmpdir, excluded):
+    excluded_file = os.path.join(str(tmpdir), 'excluded.tsv')
+    write_excluded(excluded_file, excluded)
+
+    chrom_length = 1000
+    positions = np.arange(chrom_length)
+
+    expected = get_chrom_excluded(excluded, '1', chrom_length)[:chrom_length].astype(bool)
+
+    regions = ExcludedRegions(excluded_file)
+
+    assert (regions.is_excluded('1', positions) == expected).all()
+    # intervals are cached, a second lookup gives the same result
+    assert (regions.is_excluded('1', positions) == expected).all()
+
+
+@pytest.mark.parametrize('excluded', [False, True])
+@pytest.mark.parametrize('reference', [None, 'grch37'])
+def test_get_counts_matches_per_read_loop(tmpdir, excluded, reference):
+    bamfile = os.path.join(str(tmpdir), 'cell.bam')
+    simulate_bam(bamfile)
+
+    excluded_file = None
+    if excluded:
+        excluded_file = os.path.join(str(tmpdir), 'excluded.tsv')
+        write_excluded(excluded_file, EXCLUDED)
+
+    output = os.path.join(str(tmpdir), 'cell.wig')
+
+    counter = ReadCounter(
+        bamfile, output, WINDOW_SIZE, [chrom for chrom, _ in CHROMS], 20, 'cell',
+        excluded=excluded_file, reference=reference
+    )
+
+    for chrom, length in CHROMS:
+        chrom_excluded = get_chrom_excluded(EXCLUDED, chrom, length) if excluded else None
+
+        expected = count_reads_per_read(bamfile, chrom, length, 20, reference, chrom_excluded)
+
+        with pysam.AlignmentFile(bamfile, 'rb') as bam:
+            starts, ends, counts = counter.get_counts(bam.fetch(chrom, 0, length), chrom)
+
+        assert list(zip(starts, ends, counts)) == expected
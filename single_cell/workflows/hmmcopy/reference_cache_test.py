@@ -0,0 +1,116 @@
+import os
+
+import numpy as np
+import pytest
+from single_cell.workflows.hmmcopy.scripts import CorrectReadCount
+from single_cell.workflows.hmmcopy.scripts.reference_cache import ReferenceCacheError
+from single_cell.workflows.hmmcopy.scripts.reference_cache import check_bins_match
+from single_cell.workflows.hmmcopy.scripts.reference_cache import load_reference_cache
+from single_cell.workflows.hmmcopy.scripts.reference_cache import read_wig_arrays
+from single_cell.workflows.hmmcopy.scripts.reference_cache import write_reference_cache
+
+BIN_SIZE = 1000
+
+CHROMS = [('1', 25), ('2', 10), ('X', 7)]
+
+
+def write_wig(filename, chroms, values, track_type='wiggle_0'):
+    with open(filename, 'w') as writer:
+        writer.write('track type={}\n'.format(track_type))
+        for chrom, num_bins in chroms:
+            writer.write(
+                'fixedStep chrom={} start=1 step={} span={}\n'.format(
+                    chrom, BIN_SIZE, BIN_SIZE)
+            )
+            for _ in range(num_bins):
+                writer.write('{}\n'.format(next(values)))
+
+
+def simulate_wigs(tmpdir, seed=0, map_chroms=CHROMS):
+    rng = np.random.RandomState(seed)
+
+    num_bins = sum(v for _, v in CHROMS)
+
+    gc_wig = os.path.join(tmpdir, 'gc.wig')
+    map_wig = os.path.join(tmpdir, 'map.wig')
+    reads_wig = os.path.join(tmpdir, 'reads.wig')
+
+    gc = np.round(rng.uniform(0.3, 0.6, num_bins), 6)
+    gc[3] = -1
+    write_wig(gc_wig, CHROMS, iter(gc))
+    write_wig(map_wig, map_chroms, iter(np.round(rng.uniform(0, 1, num_bins), 6)))
+    write_wig(reads_wig, CHROMS, iter(rng.randint(0, 100, num_bins)))
+
+    return gc_wig, map_wig, reads_wig
+
+
+def test_reference_cache_round_trip(tmpdir):
+    tmpdir = str(tmpdir)
+    gc_wig, map_wig, reads_wig = simulate_wigs(tmpdir)
+
+    cache = os.path.join(tmpdir, 'reference_cache.bin')
+    write_reference_cache(gc_wig, map_wig, cache, BIN_SIZE)
+
+    reference = load_reference_cache(cache, bin_size=BIN_SIZE)
+
+    gc = read_wig_arrays(gc_wig)
+    mapp = read_wig_arrays(map_wig)
+
+    assert reference['chr'].astype(str).tolist() == gc['chr'].tolist()
+    for colname in ['start', 'end', 'width']:
+        assert np.array_equal(reference[colname], gc[colname])
+    assert np.array_equal(reference['gc'], gc['value'])
+    assert np.array_equal(reference['map'], mapp['value'])
+
+    # the cached frame is the same as the one built from the wig files
+    corr = CorrectReadCount(gc_wig, map_wig, reads_wig, 'output.csv')
+
+    expected = corr.create_dataframe(
+        corr.read_wig(reads_wig, counts=True), corr.read_wig(map_wig),
+        corr.read_wig(gc_wig)
+    )
+
+    data = corr.create_dataframe_from_cache(
+        read_wig_arrays(reads_wig, counts=True), reference
+    )
+
+    assert data.columns.tolist() == expected.columns.tolist()
+    assert data['chr'].tolist() == expected['chr'].tolist()
+    for colname in ['start', 'end', 'width', 'reads']:
+        assert data[colname].tolist() == expected[colname].astype(int).tolist()
+    for colname in ['gc', 'map']:
+        assert np.array_equal(data[colname].values, expected[colname].values)
+
+
+def test_reference_cache_bin_size(tmpdir):
+    tmpdir = str(tmpdir)
+    gc_wig, map_wig, _ = simulate_wigs(tmpdir)
+
+    cache = os.path.join(tmpdir, 'reference_cache.bin')
+
+    with pytest.raises(ReferenceCacheError):
+        write_reference_cache(gc_wig, map_wig, cache, BIN_SIZE * 2)
+
+    write_reference_cache(gc_wig, map_wig, cache, BIN_SIZE)
+
+    with pytest.raises(ReferenceCacheError):
+        load_reference_cache(cache, bin_size=BIN_SIZE * 2)
+
+
+def test_reference_cache_bin_mismatch(tmpdir):
+    tmpdir = str(tmpdir)
+
+    # mappability wig with a different chromosome order
+    gc_wig, map_wig, reads_wig = simulate_wigs(
+        tmpdir, map_chroms=[CHROMS[1], CHROMS[0], CHROMS[2]]
+    )
+
+    with pytest.raises(AssertionError):
+        write_reference_cache(gc_wig, map_wig, os.path.join(tmpdir, 'cache.bin'), BIN_SIZE)
+
+    gc = read_wig_arrays(gc_wig)
+
+    with pytest.raises(AssertionError):
+        check_bins_match(gc, read_wig_arrays(map_wig), 'bins differ')
+
+    check_bins_match(gc, read_wig_arrays(reads_wig, counts=True), 'bins differ')
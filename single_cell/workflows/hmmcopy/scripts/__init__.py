@@ -5,7 +5,10 @@ Created on Jul 24, 2017
 '''
 
 
+from .read_counter import ExcludedRegions
 from .read_counter import ReadCounter
 from .convert_csv_to_seg import ConvertCSVToSEG
 from .read_counter import ReadCounter
 from .correct_read_count import CorrectReadCount
+from .hmmcopy_single_cell import HMMcopySingleCell
+from .reference_cache import write_reference_cache
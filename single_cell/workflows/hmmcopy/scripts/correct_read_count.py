@@ -12,6 +12,13 @@ import statsmodels.formula.api as smf
 from scipy.stats.mstats import mquantiles
 from statsmodels.nonparametric.smoothers_lowess import lowess
 
+from single_cell.workflows.hmmcopy.scripts.reference_cache import check_bins_match
+from single_cell.workflows.hmmcopy.scripts.reference_cache import load_reference_cache
+from single_cell.workflows.hmmcopy.scripts.reference_cache import read_wig_arrays
+
+# gc and mappability wig data, parsed once per process
+REFERENCE_WIGS = {}
+
 
 class CorrectReadCount(object):
     """
@@ -22,14 +29,18 @@ class CorrectReadCount(object):
 
     def __init__(self, gc, mapp, wig, output, mappability=0.9,
                  smoothing_function='lowess',
-                 polynomial_degree=2):
+                 polynomial_degree=2, reference_cache=None):
         self.mappability = mappability
 
+        self.smoothing_function = smoothing_function
+
         self.gc = gc
         self.mapp = mapp
         self.wig = wig
         self.output = output
 
+        self.reference_cache = reference_cache
+
     def read_wig(self, infile, counts=False):
         """read wiggle files
 
@@ -62,6 +73,17 @@ class CorrectReadCount(object):
 
         return data
 
+    def read_reference_wig(self, infile):
+        """read gc or mappability wiggle files. the parsed data is reused by
+        all cells corrected in the same process
+
+        :param infile: input wiggle file
+        """
+        if infile not in REFERENCE_WIGS:
+            REFERENCE_WIGS[infile] = self.read_wig(infile)
+
+        return REFERENCE_WIGS[infile]
+
     def valid(self, df):
         """adds valid column (calls with atleast one reads and non negative gc)
 
@@ -131,6 +153,110 @@ class CorrectReadCount(object):
 
         return data
 
+    def create_dataframe_from_cache(self, reads, reference):
+        """merge read counts with the gc and mappability columns of
+        a reference cache into pandas dataframe
+
+        :param reads: dict of arrays from read_wig_arrays
+        :param reference: dict of arrays from load_reference_cache
+        """
+        err_str = 'please ensure that reads, mappability and ' \
+                  'gc wig files have the same sort order'
+
+        num_bins = min(len(reads['value']), len(reference['gc']))
+
+        reads = {k: v[:num_bins] for k, v in reads.items()}
+        reference = {k: np.asarray(v[:num_bins]) for k, v in reference.items()}
+        reference['chr'] = reference['chr'].astype(str)
+
+        check_bins_match(reads, reference, err_str)
+
+        data = pd.DataFrame({
+            'chr': reads['chr'],
+            'start': reads['start'],
+            'end': reads['end'],
+            'width': reads['width'],
+            'gc': reference['gc'],
+            'map': reference['map'],
+            'reads': reads['value'],
+        }, columns=['chr', 'start', 'end', 'width', 'gc', 'map', 'reads'])
+
+        return data
+
+    def batched_quantile_regression(self, gc, reads, quantiles,
+                                    max_iter=1000, p_tol=1e-6):
+        """fit 2nd order polynomial quantile regressions for all quantiles
+        at once. follows the iteratively reweighted least squares solver
+        of statsmodels QuantReg, but builds the design matrix once and
+        updates every unconverged quantile in the same numpy operations.
+
+        :param gc: numpy array of gc values
+        :param reads: numpy array of read counts
+        :param quantiles: numpy array of quantiles
+        :returns numpy array of params (intercept, gc, gc**2) per quantile
+        """
+        exog = np.column_stack([np.ones(len(gc)), gc, gc ** 2.0])
+        endog = np.asarray(reads, dtype=np.float64)
+
+        # with a polynomial design, the weighted X'X and X'y only need the
+        # weighted sums of gc**0..gc**4 and gc**0..gc**2 * reads
+        moments = np.column_stack(
+            [gc ** power for power in range(5)] + [exog * endog[:, np.newaxis]]
+        )
+        xtx_index = np.add.outer(np.arange(3), np.arange(3))
+
+        num_quantiles = len(quantiles)
+        quantiles = np.asarray(quantiles, dtype=np.float64)[:, np.newaxis]
+
+        beta = np.ones((num_quantiles, exog.shape[1]))
+
+        # arrays for the quantiles that have not converged yet,
+        # the first iteration is ordinary least squares for all of them
+        active = np.arange(num_quantiles)
+        active_beta = beta
+        weights = np.ones((num_quantiles, len(endog)))
+        history = []
+
+        n_iter = 0
+        while n_iter < max_iter and len(active):
+            n_iter += 1
+
+            weighted_moments = np.dot(weights, moments)
+            xtx = weighted_moments[:, xtx_index]
+            xty = weighted_moments[:, 5:]
+            new_beta = np.einsum('qij,qj->qi', np.linalg.pinv(xtx), xty)
+
+            resid = endog - np.dot(new_beta, exog.T)
+
+            # check function weights, residuals are kept at least 1e-6 away from 0
+            q = quantiles[active]
+            weights = np.abs(resid)
+            np.maximum(weights, 0.000001, out=weights)
+            weights *= np.where(resid < 0, q, 1 - q)
+            np.reciprocal(weights, out=weights)
+
+            diff = np.max(np.abs(new_beta - active_beta), axis=1)
+            active_beta = new_beta
+            beta[active] = new_beta
+
+            converged = diff <= p_tol
+
+            history.append(new_beta)
+            if n_iter >= 300 and n_iter % 100 == 0:
+                # stop quantiles that cycle between solutions
+                for previous in history[-9:-1]:
+                    converged |= np.all(new_beta == previous, axis=1)
+            history = history[-9:]
+
+            if converged.any():
+                keep = ~converged
+                active = active[keep]
+                active_beta = active_beta[keep]
+                weights = weights[keep]
+                history = [previous[keep] for previous in history]
+
+        return beta
+
     def modal_quantile_regression(self, df_regression, lowess_frac=0.2):
         '''
         Compute quantile regression curves and select the modal quantile.
@@ -145,15 +271,29 @@ class CorrectReadCount(object):
         if len(df_regression) < 10:
             return df_regression
 
-        poly2_quantile_model = smf.quantreg('reads ~ gc + I(gc ** 2.0)', data=df_regression)
-        poly2_quantile_fit = [poly2_quantile_model.fit(q=q) for q in quantiles]
-        poly2_quantile_predict = [poly2_quantile_fit[i].predict(df_regression) for i in range(len(quantiles))]
+        if self.smoothing_function == 'fast_modal':
+            gc = df_regression['gc'].values
+            params = self.batched_quantile_regression(
+                gc, df_regression['reads'].values, quantiles
+            )
+            poly2_quantile_fit = [
+                pd.Series(param, index=['Intercept', 'gc', 'I(gc ** 2.0)'])
+                for param in params
+            ]
+            poly2_quantile_predict = [
+                param[0] + param[1] * gc + param[2] * gc ** 2.0 for param in params
+            ]
+        else:
+            poly2_quantile_model = smf.quantreg('reads ~ gc + I(gc ** 2.0)', data=df_regression)
+            poly2_quantile_fit = [poly2_quantile_model.fit(q=q) for q in quantiles]
+            poly2_quantile_predict = [fit.predict(df_regression) for fit in poly2_quantile_fit]
+            poly2_quantile_fit = [fit.params for fit in poly2_quantile_fit]
 
         poly2_quantile_params = pd.DataFrame()
 
         for i in range(len(quantiles)):
             df_regression[quantile_names[i]] = poly2_quantile_predict[i]
-            poly2_quantile_params[quantile_names[i]] = poly2_quantile_fit[i].params
+            poly2_quantile_params[quantile_names[i]] = poly2_quantile_fit[i]
 
         # integration and mode selection
 
@@ -199,11 +339,17 @@ class CorrectReadCount(object):
         df.to_csv(self.output, index=False, sep=',', na_rep="NA")
 
     def main(self):
-        gc = self.read_wig(self.gc)
-        mapp = self.read_wig(self.mapp)
-        reads = self.read_wig(self.wig, counts=True)
+        if self.reference_cache:
+            reference = load_reference_cache(self.reference_cache)
+            reads = read_wig_arrays(self.wig, counts=True)
+
+            df = self.create_dataframe_from_cache(reads, reference)
+        else:
+            gc = self.read_reference_wig(self.gc)
+            mapp = self.read_reference_wig(self.mapp)
+            reads = self.read_wig(self.wig, counts=True)
 
-        df = self.create_dataframe(reads, mapp, gc)
+            df = self.create_dataframe(reads, mapp, gc)
 
         df = self.valid(df)
         df = self.ideal(df)
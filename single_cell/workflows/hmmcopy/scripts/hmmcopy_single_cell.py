@@ -0,0 +1,685 @@
+'''
+Created on Oct 18, 2026
+
+numpy port of HMMsegment from the HMMcopy bioconductor package and of the
+per cell multiplier search in hmmcopy_single_cell.R
+'''
+from __future__ import division
+
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.special import gammaln
+
+READS_COLUMNS = [
+    'start', 'end', 'chr', 'reads', 'gc', 'map', 'cor_gc', 'copy', 'valid',
+    'ideal', 'modal_curve', 'modal_quantile', 'cor_map', 'multiplier',
+    'state', 'cell_id'
+]
+
+ERROR_READS_COLUMNS = [
+    'chr', 'start', 'end', 'reads', 'gc', 'map', 'cor_gc', 'copy', 'valid',
+    'ideal', 'modal_curve', 'modal_quantile', 'cor_map', 'multiplier',
+    'state', 'cell_id'
+]
+
+SEGS_COLUMNS = [
+    'chr', 'start', 'end', 'state', 'median', 'multiplier', 'cell_id'
+]
+
+PARAMS_COLUMNS = ['state', 'iteration', 'value', 'parameter', 'cell_id']
+
+METRICS_COLUMNS = [
+    'multiplier', 'MSRSI_non_integerness', 'MBRSI_dispersion_non_integerness',
+    'MBRSM_dispersion', 'autocorrelation_hmmcopy', 'cv_hmmcopy',
+    'empty_bins_hmmcopy', 'mad_hmmcopy', 'mean_hmmcopy_reads_per_bin',
+    'median_hmmcopy_reads_per_bin', 'std_hmmcopy_reads_per_bin',
+    'total_mapped_reads_hmmcopy', 'total_halfiness', 'scaled_halfiness',
+    'mean_state_mads', 'mean_state_vars', 'mad_neutral_state', 'breakpoints',
+    'mean_copy', 'state_mode', 'log_likelihood', 'true_multiplier', 'cell_id'
+]
+
+
+def get_parameters(hmmparams):
+    """build the per state hmm parameters from the hmmcopy config
+
+    :param hmmparams: hmmcopy section of the pipeline config
+    :returns dict of parameter name to numpy array of length num_states
+    """
+
+    def to_array(value):
+        return np.array(str(value).split(','), dtype=np.float64)
+
+    mu = to_array(hmmparams['mu'])
+    num_states = len(mu)
+
+    params = {
+        'strength': float(hmmparams['strength']),
+        'e': float(hmmparams['e']),
+        'mu': mu,
+        'kappa': to_array(hmmparams['kappa']),
+        'm': to_array(hmmparams['m']),
+    }
+
+    # scalars are recycled across states, as in the R data.frame
+    for name, key in [('lambda', 'lambda'), ('nu', 'nu'), ('eta', 'eta'),
+                      ('gamma', 'g'), ('S', 's')]:
+        params[name] = np.broadcast_to(
+            to_array(hmmparams[key]), (num_states,)
+        ).copy()
+
+    return params
+
+
+def tdist_pdf(copy, mu, lambdas, nu):
+    """student t emission densities, missing data has density 1
+
+    :param copy: numpy array of copy values
+    :param mu: state means
+    :param lambdas: state precisions
+    :param nu: state degrees of freedom
+    :returns numpy array of shape (num_states, num_bins)
+    """
+    mu = mu[:, None]
+    lambdas = lambdas[:, None]
+    nu = nu[:, None]
+
+    logp = gammaln(nu / 2 + 0.5) - gammaln(nu / 2)
+    logp = logp + 0.5 * np.log(lambdas / (np.pi * nu))
+    logp = logp - (0.5 * nu + 0.5) * np.log1p(lambdas * (copy - mu) ** 2 / nu)
+
+    py = np.exp(logp)
+    py[np.isnan(py)] = 1
+
+    return py
+
+
+def dirichlet_logpdf(x, alpha):
+    return (gammaln(alpha.sum()) - gammaln(alpha).sum() +
+            ((alpha - 1) * np.log(x)).sum())
+
+
+class ChromosomeBlocks(object):
+    """
+    lays out bins sorted by chromosome as a (max length, num chromosomes)
+    matrix so that the hmm recursions run over all chromosomes at once
+    """
+
+    def __init__(self, chroms):
+        num_bins = len(chroms)
+
+        breaks = np.flatnonzero(chroms[1:] != chroms[:-1]) + 1
+        self.starts = np.concatenate([[0], breaks]).astype(np.int64)
+        self.lengths = np.diff(np.concatenate([self.starts, [num_bins]]))
+
+        maxlen = self.lengths.max()
+        offsets = np.arange(maxlen)[:, None]
+
+        # positions past the end of a chromosome are padding
+        self.mask = offsets < self.lengths[None, :]
+        self.index = np.where(self.mask, self.starts[None, :] + offsets, 0)
+
+    def pad(self, values, fill):
+        """
+        :param values: array of shape (num_bins, ...)
+        :param fill: value for padding positions
+        :returns array of shape (max length, num chromosomes, ...)
+        """
+        padded = values[self.index]
+        padded[~self.mask] = fill
+        return padded
+
+
+def forward_backward(pi, A, py, blocks):
+    """scaled forward backward over all chromosomes
+
+    :param pi: initial state distribution
+    :param A: transition matrix
+    :param py: emission densities, shape (num_states, num_bins)
+    :param blocks: ChromosomeBlocks for the bins
+    :returns posterior state probabilities (num_states, num_bins),
+    log likelihood and expected transition counts
+    """
+    obs = blocks.pad(py.T, 1)
+    maxlen, numchroms, num_states = obs.shape
+
+    alpha = np.empty_like(obs)
+    scale = np.empty((maxlen, numchroms))
+
+    alpha[0] = pi * obs[0]
+    scale[0] = alpha[0].sum(axis=1)
+    alpha[0] /= scale[0][:, None]
+    for t in range(1, maxlen):
+        alpha[t] = np.dot(alpha[t - 1], A) * obs[t]
+        scale[t] = alpha[t].sum(axis=1)
+        alpha[t] /= scale[t][:, None]
+
+    beta = np.ones_like(obs)
+    for t in range(maxlen - 2, -1, -1):
+        prev = np.dot(obs[t + 1] * beta[t + 1], A.T) / scale[t + 1][:, None]
+        beta[t] = np.where(blocks.mask[t + 1][:, None], prev, 1)
+
+    loglik = np.log(scale[blocks.mask]).sum()
+
+    rho = alpha * beta
+    rho /= rho.sum(axis=2, keepdims=True)
+
+    weights = obs[1:] * beta[1:] / scale[1:, :, None]
+    weights[~blocks.mask[1:]] = 0
+    xi = np.einsum('tci,tcj->ij', alpha[:-1], weights) * A
+
+    posterior = np.empty((num_states, len(py.T)))
+    posterior[:, blocks.index[blocks.mask]] = rho[blocks.mask].T
+
+    return posterior, loglik, xi
+
+
+def viterbi(logpi, logA, logpy, blocks):
+    """most likely state path over all chromosomes
+
+    :param logpi: log initial state distribution
+    :param logA: log transition matrix
+    :param logpy: log emission densities, shape (num_states, num_bins)
+    :param blocks: ChromosomeBlocks for the bins
+    :returns numpy array of 0 based states per bin
+    """
+    obs = blocks.pad(logpy.T, 0)
+    maxlen, numchroms, num_states = obs.shape
+
+    backpointer = np.zeros((maxlen, numchroms, num_states), dtype=np.int64)
+
+    delta = logpi + obs[0]
+    for t in range(1, maxlen):
+        scores = delta[:, :, None] + logA[None, :, :]
+        backpointer[t] = scores.argmax(axis=1)
+        delta = np.where(
+            blocks.mask[t][:, None], scores.max(axis=1) + obs[t], delta
+        )
+
+    chroms = np.arange(numchroms)
+    path = np.zeros((maxlen, numchroms), dtype=np.int64)
+
+    state = delta.argmax(axis=1)
+    path[maxlen - 1] = state
+    for t in range(maxlen - 2, -1, -1):
+        # chromosomes shorter than t + 1 bins keep their final state
+        state = np.where(
+            blocks.mask[t + 1], backpointer[t + 1, chroms, state], state
+        )
+        path[t] = state
+
+    states = np.empty(len(logpy.T), dtype=np.int64)
+    states[blocks.index[blocks.mask]] = path[blocks.mask]
+
+    return states
+
+
+def estimate_params(copy, rho, mu, lambdas, params, chrom_starts):
+    """map estimates of the state means, precisions and initial distribution
+
+    :param copy: numpy array of copy values
+    :param rho: posterior state probabilities (num_states, num_bins)
+    :param mu: current state means
+    :param lambdas: current state precisions
+    :param params: dict from get_parameters
+    :param chrom_starts: index of the first bin of each chromosome
+    :returns new mu, lambda and pi
+    """
+    valid = ~np.isnan(copy)
+    data = copy[valid]
+    rho_valid = rho[:, valid]
+
+    nu = params['nu'][:, None]
+    eta = params['eta']
+    m = params['m']
+    kappa = params['kappa']
+    num_states = len(kappa)
+
+    resid = data[None, :] - mu[:, None]
+    u = (1 + nu) / (nu + lambdas[:, None] * resid ** 2)
+    ru = rho_valid * u
+
+    mu_new = (np.dot(ru, data) + eta * m) / (ru.sum(axis=1) + eta)
+
+    resid = data[None, :] - mu_new[:, None]
+    lambda_new = (rho_valid.sum(axis=1) + params['gamma'] + 1) / (
+        (ru * resid ** 2).sum(axis=1) +
+        eta * (mu_new - m) ** 2 + params['S']
+    )
+
+    # every chromosome is an independent chain started from pi
+    initial = rho[:, chrom_starts].sum(axis=1)
+    pi_new = (initial + kappa - 1) / (
+        initial.sum() + kappa.sum() - num_states
+    )
+
+    return mu_new, lambda_new, pi_new
+
+
+def log_prior(A, dir_prior, mu, lambdas, pi, params):
+    priora = sum(
+        dirichlet_logpdf(A[k], dir_prior[k]) for k in range(len(A))
+    )
+
+    precision = params['eta'] * lambdas
+    priormu = (0.5 * np.log(precision / (2 * np.pi)) -
+               0.5 * precision * (mu - params['m']) ** 2).sum()
+
+    shape = params['gamma']
+    rate = params['S']
+    priorlambda = (shape * np.log(rate) - gammaln(shape) +
+                   (shape - 1) * np.log(lambdas) - rate * lambdas).sum()
+
+    priorpi = dirichlet_logpdf(pi, params['kappa'])
+
+    return priora + priormu + priorlambda + priorpi
+
+
+def hmm_segment(copy, chroms, params, maxiter=50):
+    """segment copy values with an hmm with student t emissions, parameters
+    are fit with EM under normal-gamma priors on the emissions and dirichlet
+    priors on the transitions and initial state
+
+    :param copy: numpy array of copy values, sorted by chromosome and start
+    :param chroms: numpy array of chromosome names
+    :param params: dict from get_parameters
+    :param maxiter: maximum number of EM iterations
+    :returns dict with 0 based states per bin, per iteration mus, lambdas,
+    pi and loglik, and the chromosome blocks
+    """
+    num_states = len(params['mu'])
+
+    blocks = ChromosomeBlocks(chroms)
+
+    e = params['e']
+    A = np.full((num_states, num_states), (1 - e) / (num_states - 1))
+    np.fill_diagonal(A, e)
+    dir_prior = A * params['strength']
+
+    mus = np.zeros((num_states, maxiter))
+    lambdas = np.zeros((num_states, maxiter))
+    pi = np.zeros((num_states, maxiter))
+    loglik = np.zeros(maxiter)
+
+    mus[:, 0] = params['mu']
+    lambdas[:, 0] = params['lambda']
+    pi[:, 0] = params['kappa'] / params['kappa'].sum()
+    loglik[0] = -np.inf
+
+    i = 0
+    converged = False
+    while not converged and i < maxiter - 1:
+        i += 1
+
+        py = tdist_pdf(copy, mus[:, i - 1], lambdas[:, i - 1], params['nu'])
+        rho, loglik[i], xi = forward_backward(pi[:, i - 1], A, py, blocks)
+
+        A = xi + dir_prior
+        A /= A.sum(axis=1, keepdims=True)
+
+        mus[:, i], lambdas[:, i], pi[:, i] = estimate_params(
+            copy, rho, mus[:, i - 1], lambdas[:, i - 1], params, blocks.starts
+        )
+
+        loglik[i] += log_prior(
+            A, dir_prior, mus[:, i], lambdas[:, i], pi[:, i], params
+        )
+
+        if abs(loglik[i] - loglik[i - 1]) < 1e-1 or loglik[i] < loglik[i - 1]:
+            converged = True
+
+    if loglik[i] < loglik[i - 1]:
+        i -= 1
+
+    py = tdist_pdf(copy, mus[:, i], lambdas[:, i], params['nu'])
+    with np.errstate(divide='ignore'):
+        state = viterbi(np.log(pi[:, i]), np.log(A), np.log(py), blocks)
+
+    return {
+        'state': state,
+        'mus': mus[:, :i + 1],
+        'lambdas': lambdas[:, :i + 1],
+        'pi': pi[:, :i + 1],
+        'loglik': loglik[:i + 1],
+        'blocks': blocks,
+    }
+
+
+def get_segments(chroms, starts, ends, copy, state, blocks):
+    """collapse runs of the same state within a chromosome into segments
+
+    :returns segment dataframe and the segment index of every bin
+    """
+    change = np.ones(len(state), dtype=bool)
+    change[1:] = state[1:] != state[:-1]
+    change[blocks.starts] = True
+
+    segment_id = np.cumsum(change) - 1
+    segment_starts = np.flatnonzero(change)
+    segment_ends = np.concatenate([segment_starts[1:], [len(state)]]) - 1
+
+    medians = pd.Series(copy).groupby(segment_id).median().values
+
+    segs = pd.DataFrame({
+        'chr': chroms[segment_starts],
+        'start': starts[segment_starts],
+        'end': ends[segment_ends],
+        'state': state[segment_starts].astype(np.float64),
+        'median': medians,
+    })
+
+    return segs, segment_id
+
+
+def mad(values):
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return np.nan
+    return np.median(np.abs(values - np.median(values)))
+
+
+def nanmedian(values):
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return np.nan
+    return np.median(values)
+
+
+def nanmean(values):
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return np.nan
+    return values.mean()
+
+
+def nanstd(values):
+    values = values[~np.isnan(values)]
+    if len(values) < 2:
+        return np.nan
+    return values.std(ddof=1)
+
+
+def nanvar(values):
+    values = values[~np.isnan(values)]
+    if len(values) < 2:
+        return np.nan
+    return values.var(ddof=1)
+
+
+def autocorrelation(values):
+    """lag 1 autocorrelation, matches acf with na.action=na.pass in R"""
+    values = values - nanmean(values)
+
+    def lagged_cov(lag):
+        x = values[lag:] * values[:len(values) - lag]
+        x = x[~np.isnan(x)]
+        if not len(x):
+            return np.nan
+        return x.sum() / (len(x) + lag)
+
+    acf = lagged_cov(1) / lagged_cov(0)
+
+    return min(max(acf, -1.0), 1.0)
+
+
+def stack_params(data, paramname):
+    """long format table of a (num_states, num_iterations) parameter matrix"""
+    num_states, num_iter = data.shape
+
+    return pd.DataFrame({
+        'state': np.tile(np.arange(num_states, dtype=np.float64), num_iter),
+        'iteration': np.repeat(np.arange(num_iter, dtype=np.float64), num_states),
+        'value': data.T.ravel(),
+        'parameter': paramname,
+    })
+
+
+def format_parameter_table(segmented, params):
+    loglik = stack_params(segmented['loglik'][None, :], 'loglik')
+    loglik['state'] = np.nan
+
+    nus = stack_params(params['nu'][:, None], 'nus')
+    nus['iteration'] = np.nan
+
+    return pd.concat([
+        stack_params(segmented['mus'], 'mus'),
+        stack_params(segmented['lambdas'], 'lambdas'),
+        stack_params(segmented['pi'], 'pi'),
+        loglik, nus
+    ], ignore_index=True)
+
+
+class HMMcopySingleCell(object):
+    """
+    in process replacement for hmmcopy_single_cell.R, segments a cell at each
+    multiplier and picks the best fit by scaled halfiness
+    """
+
+    def __init__(self, corrected_reads, cell_id, hmmparams, maxiter=200):
+        """
+        :param corrected_reads: corrected reads csv or dataframe
+        :param cell_id: cell id
+        :param hmmparams: hmmcopy section of the pipeline config
+        :param maxiter: maximum number of EM iterations
+        """
+        self.corrected_reads = corrected_reads
+        self.cell_id = cell_id
+        self.multipliers = hmmparams['multipliers']
+        self.params = get_parameters(hmmparams)
+        self.maxiter = maxiter
+
+    def read_corrected_reads(self):
+        df = self.corrected_reads
+        if not isinstance(df, pd.DataFrame):
+            df = pd.read_csv(df, dtype={'chr': str})
+
+        df = df[READS_COLUMNS[:-3]].copy()
+        df['chr'] = df['chr'].astype(str)
+        for colname in ['cor_gc', 'copy', 'modal_curve', 'modal_quantile', 'cor_map']:
+            df[colname] = pd.to_numeric(df[colname], errors='coerce')
+
+        df = df.sort_values(['chr', 'start'], kind='mergesort')
+        df = df.reset_index(drop=True)
+
+        return df
+
+    def segment(self, df, copy):
+        return hmm_segment(
+            copy, df['chr'].values, self.params, maxiter=self.maxiter
+        )
+
+    def get_true_multiplier(self, multiplier, copy, state, ideal):
+        meds = pd.DataFrame({'copy': copy[ideal], 'state': state[ideal]})
+        meds = meds.groupby('state')['copy'].agg(['median', 'size'])
+
+        meds = meds[meds['size'] > 200]
+        fix = meds.index.values / meds['median'].values
+
+        return multiplier * nanmean(fix)
+
+    def get_metrics(self, df, segs, segment_id, segmented, multiplier,
+                    true_multiplier):
+        ideal = df['ideal'].values
+
+        state = df['state'].values
+        copy = df['copy'].values
+        cor_gc = df['cor_gc'].values[ideal]
+        reads = df['reads'].values[ideal].astype(np.float64)
+
+        median = segs['median'].values[segment_id]
+        halfiness = -np.log2(
+            np.abs(np.minimum(np.abs(median - state), 0.499) - 0.5)
+        ) - 1
+
+        ideal_state = state[ideal]
+        ideal_copy = copy[ideal]
+
+        state_mads = {}
+        state_vars = []
+        for value in np.unique(ideal_state):
+            in_state = ideal_state == value
+            state_mads[value] = mad(cor_gc[in_state])
+            state_vars.append(nanvar(ideal_copy[in_state]))
+
+        counts = pd.Series(ideal_state).value_counts()
+        state_mode = counts[counts == counts.max()].index.max()
+
+        metrics = {
+            'multiplier': multiplier,
+            'MSRSI_non_integerness': nanmedian(
+                np.abs(segs['median'].values - segs['state'].values)
+            ),
+            'MBRSI_dispersion_non_integerness': nanmedian(
+                np.abs(ideal_copy - ideal_state)
+            ),
+            'MBRSM_dispersion': nanmedian(np.abs(ideal_copy - median[ideal])),
+            'autocorrelation_hmmcopy': autocorrelation(cor_gc),
+            'cv_hmmcopy': nanstd(cor_gc) / nanmean(cor_gc),
+            'empty_bins_hmmcopy': int((reads == 0).sum()),
+            'mad_hmmcopy': mad(cor_gc),
+            'mean_hmmcopy_reads_per_bin': nanmean(reads),
+            'median_hmmcopy_reads_per_bin': nanmedian(reads),
+            'std_hmmcopy_reads_per_bin': nanstd(reads),
+            'total_mapped_reads_hmmcopy': int(np.nansum(reads)),
+            'total_halfiness': np.nansum(halfiness[ideal]),
+            'scaled_halfiness': np.nansum(halfiness[ideal] / (ideal_state + 1)),
+            'mean_state_mads': nanmean(np.array(list(state_mads.values()))),
+            'mean_state_vars': nanmean(np.array(state_vars)),
+            'mad_neutral_state': state_mads.get(2, np.nan),
+            'breakpoints': len(segs) - segs['chr'].nunique(),
+            'mean_copy': nanmean(ideal_copy),
+            'state_mode': int(state_mode),
+            'log_likelihood': segmented['loglik'][-1],
+            'true_multiplier': true_multiplier,
+            'cell_id': self.cell_id,
+        }
+
+        # haploid poison
+        if (ideal_state == 1).mean() > 0.7:
+            metrics['scaled_halfiness'] = np.inf
+
+        return pd.DataFrame([metrics], columns=METRICS_COLUMNS)
+
+    def run_multiplier(self, df, multiplier):
+        df = df.copy()
+        df['multiplier'] = multiplier
+
+        ideal = df['ideal'].values.astype(bool)
+        cor_gc = df['cor_gc'].values
+
+        # rough
+        copy = cor_gc * multiplier
+        copy[~ideal] = np.nan
+        segmented = self.segment(df, copy)
+
+        # tweak
+        true_multiplier = self.get_true_multiplier(
+            multiplier, copy, segmented['state'], ideal
+        )
+        copy = cor_gc * true_multiplier
+        segmented = self.segment(df, copy)
+
+        df['copy'] = copy
+        df['state'] = segmented['state'].astype(np.float64)
+        df['cell_id'] = self.cell_id
+
+        segs, segment_id = get_segments(
+            df['chr'].values, df['start'].values, df['end'].values, copy,
+            segmented['state'], segmented['blocks']
+        )
+        segs['multiplier'] = multiplier
+        segs['cell_id'] = self.cell_id
+
+        metrics = self.get_metrics(
+            df, segs, segment_id, segmented, multiplier, true_multiplier
+        )
+
+        params = format_parameter_table(segmented, self.params)
+        params['cell_id'] = self.cell_id
+
+        return {
+            'reads': df[READS_COLUMNS],
+            'segs': segs[SEGS_COLUMNS],
+            'params': params[PARAMS_COLUMNS],
+            'metrics': metrics,
+        }
+
+    def error_output(self, df, multiplier):
+        """outputs for cells without enough data to segment"""
+        df = df.copy()
+        df['cell_id'] = self.cell_id
+        df['cor_gc'] = np.nan
+        df['cor_map'] = np.nan
+        df['ideal'] = False
+        df['valid'] = False
+        df['state'] = np.nan
+        df['copy'] = np.nan
+        df['multiplier'] = multiplier
+
+        metrics = pd.DataFrame([{
+            'multiplier': multiplier, 'cell_id': self.cell_id,
+            'empty_bins_hmmcopy': 0, 'total_mapped_reads_hmmcopy': 0,
+            'breakpoints': 0, 'state_mode': 0,
+        }], columns=METRICS_COLUMNS)
+
+        return {
+            'reads': df[ERROR_READS_COLUMNS],
+            'segs': pd.DataFrame(columns=SEGS_COLUMNS),
+            'params': pd.DataFrame(columns=PARAMS_COLUMNS),
+            'metrics': metrics,
+        }
+
+    def main(self):
+        """
+        :returns dict of multiplier to dict of reads, segs, params and
+        metrics dataframes, the best multiplier is also stored under 0
+        """
+        df = self.read_corrected_reads()
+
+        if not len(df):
+            raise Exception("INVALID INPUT")
+
+        check_copy = df['copy'].where(df['ideal'].astype(bool))
+
+        if df['cor_gc'].isnull().all() or check_copy.isnull().all():
+            outputs = {
+                multiplier: self.error_output(df, multiplier)
+                for multiplier in self.multipliers
+            }
+            outputs[0] = self.error_output(df, self.multipliers[-1])
+            return outputs
+
+        outputs = {
+            multiplier: self.run_multiplier(df, multiplier)
+            for multiplier in self.multipliers
+        }
+
+        penalties = np.array([
+            outputs[multiplier]['metrics']['scaled_halfiness'].iloc[0]
+            for multiplier in self.multipliers
+        ])
+        best = 0
+        if not np.isnan(penalties).all():
+            best = int(np.nanargmin(penalties))
+
+        outputs[0] = outputs[self.multipliers[best]]
+
+        return outputs
+
+    def write(self, outputs, outdir):
+        """write the outputs in the same layout as hmmcopy_single_cell.R
+
+        :param outputs: dict from main
+        :param outdir: output directory
+        """
+        for multiplier, data in outputs.items():
+            multiplier_outdir = os.path.join(outdir, str(multiplier))
+            if not os.path.exists(multiplier_outdir):
+                os.makedirs(multiplier_outdir)
+
+            for name, df in data.items():
+                df.to_csv(
+                    os.path.join(multiplier_outdir, '{}.csv'.format(name)),
+                    index=False, na_rep='NA'
+                )
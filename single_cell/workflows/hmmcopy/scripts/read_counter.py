@@ -12,6 +12,64 @@ import pandas as pd
 import pysam
 
 
+class ExcludedRegions(object):
+    """
+    regions to skip, stored as sorted non overlapping intervals per
+    chromosome. intervals are built on first use and reused, so a single
+    instance can be shared by all ReadCounter objects in a batch.
+    """
+
+    def __init__(self, excluded):
+        self.regions = pd.read_csv(excluded, sep="\t", )
+        self.regions.columns = ["chrom", "start", "end"]
+        # lists with only numbered chromosomes are otherwise read as ints
+        self.regions["chrom"] = self.regions["chrom"].astype(str)
+
+        self.intervals = {}
+
+    def get_intervals(self, chrom):
+        """merges the excluded regions in a chromosome
+        :param chrom: chromosome name
+        :returns tuple of numpy arrays (starts, ends)
+        """
+        if chrom in self.intervals:
+            return self.intervals[chrom]
+
+        regions = self.regions.loc[self.regions['chrom'] == chrom, ['start', 'end']]
+        regions = regions[regions['end'] > regions['start']]
+        regions = regions.sort_values('start')
+
+        starts = regions['start'].values.astype(np.int64)
+        ends = regions['end'].values.astype(np.int64)
+
+        if len(starts):
+            new_interval = np.ones(len(starts), dtype=bool)
+            new_interval[1:] = starts[1:] > np.maximum.accumulate(ends)[:-1]
+            new_interval = np.flatnonzero(new_interval)
+
+            starts = starts[new_interval]
+            ends = np.maximum.reduceat(ends, new_interval)
+
+        self.intervals[chrom] = (starts, ends)
+
+        return starts, ends
+
+    def is_excluded(self, chrom, positions):
+        """checks positions against the excluded regions
+        :param chrom: chromosome name
+        :param positions: numpy array of 0 based positions
+        :returns boolean numpy array, true if position is excluded
+        """
+        starts, ends = self.get_intervals(chrom)
+
+        if not len(starts):
+            return np.zeros(len(positions), dtype=bool)
+
+        idx = np.searchsorted(starts, positions, side='right') - 1
+
+        return (idx >= 0) & (positions < ends[np.maximum(idx, 0)])
+
+
 class ReadCounter(object):
     """
     calculate reads per bin from the input bam file
@@ -41,29 +99,16 @@ class ReadCounter(object):
 
         self.seg = seg
 
-        if excluded is not None:
-            self.excluded = pd.read_csv(excluded, sep="\t", )
-            self.excluded.columns = ["chrom", "start", "end"]
+        if excluded is None or isinstance(excluded, ExcludedRegions):
+            self.excluded = excluded
         else:
-            self.excluded = None
+            self.excluded = ExcludedRegions(excluded)
 
         self.reference = reference
 
     def __get_bam_header(self):
         return self.bam.header
 
-    def __get_chrom_excluded(self, chrom, chrom_length):
-        # chrom_excluded = np.zeros(chrom_length, dtype=np.uint8)
-        # add some padding in case the list is 1 based and chr length is 0 based
-        chrom_excluded = np.zeros(chrom_length + 1, dtype=np.uint8)
-
-        for start, end in self.excluded.loc[self.excluded['chrom'] == chrom, ['start', 'end']].values:
-            start = min(start, chrom_length)
-            end = min(end, chrom_length)
-            chrom_excluded[start:end] = 1
-
-        return chrom_excluded
-
     def __enter__(self):
         return self
 
@@ -104,40 +149,6 @@ class ReadCounter(object):
         """
         return self.bam.fetch(chrom, start, end)
 
-    def filter(self, pileupobj, chrom_excluded=None):
-        """remove low mapping quality reads and duplicates
-        :param pileupobj: pysam read object
-        :returns boolean: false if the read passes filters.
-        :rtype boolean
-        """
-
-        pos = pileupobj.reference_start
-        if chrom_excluded is not None and chrom_excluded[pos]:
-            return True
-
-        if pileupobj.is_duplicate:
-            return True
-
-        if pileupobj.mapping_quality < self.mapq_threshold:
-            return True
-
-        try:
-            fastqscreen_tags = pileupobj.get_tag('FS')
-        except KeyError:
-            logging.getLogger("read_counter").warn(
-                "couldn't get FS tag from bam"
-            )
-            fastqscreen_tags = None
-        if fastqscreen_tags and self.reference:
-            fastqscreen_tags = fastqscreen_tags.split(',')
-            fastqscreen_tags = [val.split('_') for val in fastqscreen_tags]
-            fastqscreen_tags = {val[0]: val[1] for val in fastqscreen_tags}
-
-            if int(fastqscreen_tags[self.reference]) == 0:
-                return True
-
-        return False
-
     def write_header(self, chrom, outfile):
         """writes headers, single header if seg format,
         one header per chromosome otherwise.
@@ -151,21 +162,122 @@ class ReadCounter(object):
                      % (chrom, self.window_size, self.window_size)
             outfile.write(outstr)
 
-    def write(self, chrom, start, stop, count, outfile):
-        """writes bin and counts to the output file.
+    def get_bins(self, chrom):
+        """returns the start and end positions of all bins in a chromosome.
+        the first bin is never truncated and the last bin is clipped to
+        the chromosome length.
+        :param chrom: str: chromosome name
+        :returns tuple of numpy arrays (bin starts, bin ends)
+        """
+        reflen = self.chr_lengths[chrom]
+
+        starts = np.arange(0, reflen // self.window_size + 1, dtype=np.int64)
+        starts *= self.window_size
+
+        ends = np.minimum(starts + self.window_size, reflen)
+        ends[0] = self.window_size
+
+        return starts, ends
+
+    def get_read_arrays(self, data):
+        """pulls the fields required for filtering out of all reads
+        :param data: pysam iterator over reads
+        :returns tuple of numpy arrays (positions, flags, mapping qualities)
+         and a list of FS tag values (None if the tag is missing)
+        """
+        positions = []
+        flags = []
+        mapqs = []
+        fs_tags = []
+
+        for read in data:
+            positions.append(read.reference_start)
+            flags.append(read.flag)
+            mapqs.append(read.mapping_quality)
+            try:
+                fs_tags.append(read.get_tag('FS'))
+            except KeyError:
+                fs_tags.append(None)
+
+        positions = np.array(positions, dtype=np.int64)
+        flags = np.array(flags, dtype=np.int64)
+        mapqs = np.array(mapqs, dtype=np.int64)
+
+        return positions, flags, mapqs, fs_tags
+
+    def get_fastqscreen_filter(self, fs_tags):
+        """flags reads with a zero count for the reference organism in
+        the FS tag. each distinct tag value is only parsed once.
+        :param fs_tags: list of FS tag values, None if missing
+        :returns boolean numpy array, true if the read must be removed
+        """
+        missing = sum(1 for tag in fs_tags if tag is None)
+        if missing:
+            logging.getLogger("read_counter").warn(
+                "couldn't get FS tag from bam for {} reads".format(missing)
+            )
+
+        if not self.reference:
+            return np.zeros(len(fs_tags), dtype=bool)
+
+        tag_filtered = {None: False, '': False}
+        for tag in set(fs_tags):
+            if not tag:
+                continue
+            parsed = [val.split('_') for val in tag.split(',')]
+            parsed = {val[0]: val[1] for val in parsed}
+            tag_filtered[tag] = int(parsed[self.reference]) == 0
+
+        return np.fromiter(
+            (tag_filtered[tag] for tag in fs_tags), dtype=bool,
+            count=len(fs_tags)
+        )
+
+    def get_counts(self, data, chrom):
+        """bins reads by starting position after removing reads that fail
+        the filters. a read starting at the end position of a bin is counted
+        in that bin.
+        :param data: pysam iterator over reads
+        :param chrom: str: chromosome name
+        :returns tuple of numpy arrays (bin starts, bin ends, counts)
+        """
+        starts, ends = self.get_bins(chrom)
+
+        positions, flags, mapqs, fs_tags = self.get_read_arrays(data)
+
+        removed = (flags & 0x400) > 0
+        removed |= mapqs < self.mapq_threshold
+        if self.excluded is not None:
+            removed |= self.excluded.is_excluded(chrom, positions)
+        removed |= self.get_fastqscreen_filter(fs_tags)
+
+        bins = np.maximum(positions[~removed] - 1, 0) // self.window_size
+
+        counts = np.bincount(bins, minlength=len(starts))
+
+        return starts, ends, counts
+
+    def write_counts(self, chrom, starts, ends, counts, outfile):
+        """writes all bins and counts for a chromosome to the output file.
         supports seg and wig formats
         :param chrom: chromosome name
-        :param start: bin start
-        :param stop: bin stop
-        :param count: no of reads in the bin
+        :param starts: numpy array of bin starts
+        :param ends: numpy array of bin ends
+        :param counts: numpy array of read counts per bin
         :param outfile: output file object.
         """
+        if not len(counts):
+            return
+
         if self.seg:
-            outstr = '\t'.join(
-                map(str, ['reads', chrom, start, stop, count])) + '\n'
-            outfile.write(outstr)
+            lines = [
+                'reads\t{}\t{}\t{}\t{}'.format(chrom, start, end, count)
+                for start, end, count in zip(starts, ends, counts)
+            ]
         else:
-            outfile.write(str(count) + '\n')
+            lines = counts.astype(str).tolist()
+
+        outfile.write('\n'.join(lines) + '\n')
 
     def get_data(self, data, chrom, outfile):
         """iterates over reads, calculates counts and writes to output
@@ -173,36 +285,9 @@ class ReadCounter(object):
         :param chrom: str: chromosome name
         :param outfile: output file object
         """
-        reflen = self.chr_lengths[chrom]
+        starts, ends, counts = self.get_counts(data, chrom)
 
-        chrom_excluded = None
-        if self.excluded is not None:
-            chrom_excluded = self.__get_chrom_excluded(chrom, reflen)
-
-        count = 0
-        start = 0
-        end = start + self.window_size
-        for pileupobj in data:
-            while pileupobj.pos > end:
-                self.write(chrom, start, end, count, outfile)
-                count = 0
-                start += self.window_size
-                end = min(start + self.window_size, reflen)
-
-            if not self.filter(pileupobj, chrom_excluded):
-                count += 1
-
-        # catch up with end of chromosome
-        while True:
-            self.write(chrom, start, end, count, outfile)
-            count = 0
-            start += self.window_size
-            end = start + self.window_size
-            if start > reflen:
-                break
-            if end > reflen:
-                self.write(chrom, start, reflen, count, outfile)
-                break
+        self.write_counts(chrom, starts, ends, counts, outfile)
 
     def main(self):
         """for each chromosome, iterate over all reads. use starting position
@@ -0,0 +1,160 @@
+'''
+Created on Oct 18, 2026
+'''
+from __future__ import division
+
+import numpy as np
+import yaml
+
+
+class ReferenceCacheError(Exception):
+    pass
+
+
+def read_wig_arrays(infile, counts=False):
+    """read fixedStep wiggle file into numpy arrays
+
+    :param infile: input wiggle file
+    :param counts: set to true if infile wiggle has integer values
+    :returns dict with chr, start, end, width and value arrays
+    """
+    blocks = []
+
+    with open(infile) as wig:
+        for line in wig:
+            line = line.strip()
+
+            if line.startswith("track type"):
+                continue
+
+            if line.startswith('fixedStep'):
+                line = line.split()
+
+                chrom = line[1].split('=')[1]
+                winsize = int(line[3].split('=')[1])
+                start = int(line[2].split('=')[1])
+
+                values = []
+                blocks.append((chrom, start, winsize, values))
+            else:
+                values.append(line)
+
+    data = {'chr': [], 'start': [], 'end': [], 'width': [], 'value': []}
+
+    for chrom, start, winsize, values in blocks:
+        bin_start = 0 if start < winsize else start / winsize
+
+        bins = np.arange(len(values), dtype=np.int64) + int(bin_start)
+
+        data['chr'].append(np.full(len(values), chrom, dtype=object))
+        data['start'].append((bins * winsize) + 1)
+        data['end'].append((bins + 1) * winsize)
+        data['width'].append(np.full(len(values), winsize, dtype=np.int64))
+        data['value'].append(
+            np.array(values, dtype=np.int64 if counts else np.float64)
+        )
+
+    for colname, coldata in data.items():
+        if coldata:
+            data[colname] = np.concatenate(coldata)
+        else:
+            dtype = object if colname == 'chr' else np.int64
+            data[colname] = np.array([], dtype=dtype)
+
+    return data
+
+
+def check_bins_match(data, reference, error_str):
+    """confirm that two sets of wig arrays have the same bins
+
+    :param data: dict of wig arrays
+    :param reference: dict of wig arrays
+    :param error_str: message for the assertion error
+    """
+    for colname in ['chr', 'start', 'end', 'width']:
+        assert np.array_equal(data[colname], reference[colname]), error_str
+
+
+def write_reference_cache(gc_wig, map_wig, output, bin_size):
+    """convert gc and mappability wigs into a columnar binary file with a
+    yaml sidecar describing the column layout
+
+    :param gc_wig: gc wig file
+    :param map_wig: mappability wig file
+    :param output: output binary file, layout goes to output + '.yaml'
+    :param bin_size: bin size of the wig files
+    """
+    err_str = 'please ensure that mappability and ' \
+              'gc wig files have the same sort order'
+
+    gc = read_wig_arrays(gc_wig)
+    mapp = read_wig_arrays(map_wig)
+
+    # bins beyond the shorter of the two files are dropped
+    num_bins = min(len(gc['value']), len(mapp['value']))
+    gc = {k: v[:num_bins] for k, v in gc.items()}
+    mapp = {k: v[:num_bins] for k, v in mapp.items()}
+
+    check_bins_match(gc, mapp, err_str)
+
+    if num_bins and not (gc['width'] == bin_size).all():
+        raise ReferenceCacheError(
+            'bin size in {} does not match {}'.format(gc_wig, bin_size)
+        )
+
+    columns = [
+        ('chr', gc['chr'].astype(str).astype(np.bytes_)),
+        ('start', gc['start']),
+        ('end', gc['end']),
+        ('width', gc['width']),
+        ('gc', gc['value']),
+        ('map', mapp['value']),
+    ]
+
+    metadata = {'bin_size': bin_size, 'num_bins': num_bins, 'columns': []}
+
+    with open(output, 'wb') as writer:
+        for colname, coldata in columns:
+            # keep all columns 8 byte aligned
+            writer.write(b'\0' * (-writer.tell() % 8))
+
+            metadata['columns'].append(
+                {'name': colname, 'dtype': coldata.dtype.str, 'offset': writer.tell()}
+            )
+
+            coldata.tofile(writer)
+
+    with open(output + '.yaml', 'wt') as writer:
+        yaml.safe_dump(metadata, writer, default_flow_style=False)
+
+
+def load_reference_cache(cachefile, bin_size=None):
+    """memory map the columns of a reference cache file read only
+
+    :param cachefile: binary file from write_reference_cache
+    :param bin_size: expected bin size, checked against the cache if set
+    :returns dict of column name to numpy array
+    """
+    with open(cachefile + '.yaml') as reader:
+        metadata = yaml.safe_load(reader)
+
+    if bin_size is not None and metadata['bin_size'] != bin_size:
+        raise ReferenceCacheError(
+            'cache {} has bin size {}, expected {}'.format(
+                cachefile, metadata['bin_size'], bin_size)
+        )
+
+    num_bins = metadata['num_bins']
+
+    data = {}
+    for column in metadata['columns']:
+        if not num_bins:
+            data[column['name']] = np.array([], dtype=column['dtype'])
+            continue
+
+        data[column['name']] = np.memmap(
+            cachefile, mode='r', dtype=column['dtype'],
+            offset=column['offset'], shape=(num_bins,)
+        )
+
+    return data
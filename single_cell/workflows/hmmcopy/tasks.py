@@ -11,6 +11,7 @@ import pandas as pd
 import pypeliner
 import scipy.cluster.hierarchy as hc
 import scipy.spatial as sp
+from single_cell.utils import cnmatrixutils
 from single_cell.utils import csvutils
 from single_cell.utils import helpers
 from single_cell.utils.singlecell_copynumber_plot_utils import GenHmmPlots
@@ -21,8 +22,11 @@ from single_cell.workflows.hmmcopy.dtypes import dtypes
 
 from .scripts import ConvertCSVToSEG
 from .scripts import CorrectReadCount
+from .scripts import ExcludedRegions
+from .scripts import HMMcopySingleCell
 from .scripts import ReadCounter
 from .scripts import classify
+from .scripts import write_reference_cache
 
 scripts_directory = os.path.join(
     os.path.realpath(
@@ -32,20 +36,35 @@ run_hmmcopy_rscript = os.path.join(scripts_directory, 'hmmcopy_single_cell.R')
 
 
 def get_max_cn(reads):
-    df = csvutils.read_csv_and_yaml(reads)
+    if cnmatrixutils.is_cn_matrix(reads):
+        copy = cnmatrixutils.read_cn_matrix(reads, 'copy').values
+        return np.nanpercentile(copy, 99)
+
+    df = csvutils.read_csv_and_yaml(reads, columns=['copy'])
     max_cn = np.nanpercentile(df['copy'], 99)
     return max_cn
 
 
+def create_reference_cache(hmmparams, reference_cache):
+    write_reference_cache(
+        hmmparams['gc_wig_file'], hmmparams['map_wig_file'],
+        reference_cache, hmmparams['bin_size']
+    )
+
+
 def run_correction_hmmcopy(
-        bam_file, correct_reads_out, readcount_wig, hmmparams, cell_id
+        bam_file, correct_reads_out, readcount_wig, hmmparams, cell_id,
+        excluded=None, reference_cache=None
 ):
     run_readcount_rscript = os.path.join(
         scripts_directory,
         'correct_read_count.R')
 
+    if excluded is None:
+        excluded = hmmparams['exclude_list']
+
     rc = ReadCounter(bam_file, readcount_wig, hmmparams['bin_size'], hmmparams['chromosomes'],
-                     hmmparams['min_mqual'], cell_id, excluded=hmmparams['exclude_list'])
+                     hmmparams['min_mqual'], cell_id, excluded=excluded)
     rc.main()
 
     if hmmparams["smoothing_function"] == 'loess':
@@ -56,21 +75,29 @@ def run_correction_hmmcopy(
                correct_reads_out
                ]
         pypeliner.commandline.execute(*cmd)
-    elif hmmparams["smoothing_function"] == 'modal':
+    elif hmmparams["smoothing_function"] in ['modal', 'fast_modal']:
         CorrectReadCount(hmmparams["gc_wig_file"],
                          hmmparams['map_wig_file'],
                          readcount_wig,
                          correct_reads_out,
-                         mappability=hmmparams['map_cutoff']).main()
+                         mappability=hmmparams['map_cutoff'],
+                         smoothing_function=hmmparams["smoothing_function"],
+                         reference_cache=reference_cache).main()
     else:
         raise Exception(
-            "smoothing function %s not supported. pipeline supports loess and modal" %
+            "smoothing function %s not supported. pipeline supports loess, modal and fast_modal" %
             hmmparams["smoothing_function"])
 
     return correct_reads_out
 
 
 def run_hmmcopy_script(corrected_reads, tempdir, cell_id, hmmparams):
+    # lists of cells are segmented in a single R session
+    if isinstance(cell_id, list):
+        corrected_reads = ','.join(corrected_reads)
+        tempdir = ','.join(tempdir)
+        cell_id = ','.join(cell_id)
+
     cmd = [run_hmmcopy_rscript]
 
     # run hmmcopy
@@ -95,6 +122,32 @@ def run_hmmcopy_script(corrected_reads, tempdir, cell_id, hmmparams):
     pypeliner.commandline.execute(*cmd)
 
 
+def run_hmmcopy_python(corrected_reads, tempdir, cell_id, hmmparams):
+    """
+    segment in process, per multiplier outputs are written to tempdir
+    for the tar and the auto ploidy frames are returned
+    """
+    hmmcopy = HMMcopySingleCell(corrected_reads, cell_id, hmmparams)
+
+    outputs = hmmcopy.main()
+    hmmcopy.write(outputs, tempdir)
+
+    return outputs[0]
+
+
+def run_hmmcopy_engine(corrected_reads, tempdir, cell_id, hmmparams):
+    engine = hmmparams['hmmcopy_engine']
+
+    if engine == 'python':
+        return run_hmmcopy_python(corrected_reads, tempdir, cell_id, hmmparams)
+    elif engine == 'rscript':
+        run_hmmcopy_script(corrected_reads, tempdir, cell_id, hmmparams)
+    else:
+        raise Exception(
+            "hmmcopy engine %s not supported. pipeline supports rscript and python" %
+            engine)
+
+
 def gzip_file(inputfile, gzipped_csv):
     import gzip
     with open(inputfile) as inputdata, gzip.open(gzipped_csv, 'w') as gzipped_out:
@@ -112,6 +165,7 @@ def run_hmmcopy(
         cell_id,
         hmmparams,
         tempdir,
+        reference_cache=None,
 ):
     # generate wig file for hmmcopy
     helpers.makedirs(tempdir)
@@ -123,54 +177,198 @@ def run_hmmcopy(
         corrected_reads,
         readcount_wig,
         hmmparams,
-        cell_id
+        cell_id,
+        reference_cache=reference_cache
     )
 
     hmmcopy_tempdir = os.path.join(tempdir, '{}_hmmcopy'.format(cell_id))
     helpers.makedirs(hmmcopy_tempdir)
 
-    run_hmmcopy_script(
+    outputs = run_hmmcopy_engine(
         corrected_reads,
         hmmcopy_tempdir,
         cell_id,
         hmmparams
     )
 
+    write_hmmcopy_outputs(
+        hmmcopy_tempdir,
+        corrected_reads_filename,
+        segments_filename,
+        parameters_filename,
+        metrics_filename,
+        hmmcopy_tar,
+        outputs=outputs
+    )
+
+
+def write_hmmcopy_outputs(
+        hmmcopy_tempdir,
+        corrected_reads_filename,
+        segments_filename,
+        parameters_filename,
+        metrics_filename,
+        hmmcopy_tar,
+        outputs=None
+):
+    """
+    outputs are the dataframes from the python engine, the csv files
+    written by the R script are used otherwise. per cell files are written
+    without headers so that merging them is a plain copy of the gzip data
+    """
+    if outputs:
+        for output_type, filename in [
+            ('reads', corrected_reads_filename),
+            ('params', parameters_filename),
+            ('segs', segments_filename),
+            ('metrics', metrics_filename),
+        ]:
+            csvutils.write_dataframe_to_csv_and_yaml(
+                outputs[output_type], filename, dtypes()[output_type],
+                write_header=False
+            )
+
+        helpers.make_tarfile(hmmcopy_tar, hmmcopy_tempdir)
+        return
+
     hmmcopy_outdir = os.path.join(hmmcopy_tempdir, str(0))
 
     csvutils.rewrite_csv_file(
         os.path.join(hmmcopy_outdir, "reads.csv"), corrected_reads_filename,
-        dtypes=dtypes()['reads']
+        dtypes=dtypes()['reads'],
+        write_header=False
     )
 
     csvutils.rewrite_csv_file(
         os.path.join(hmmcopy_outdir, "params.csv"), parameters_filename,
-        dtypes=dtypes()['params']
+        dtypes=dtypes()['params'],
+        write_header=False
     )
 
     csvutils.rewrite_csv_file(
         os.path.join(hmmcopy_outdir, "segs.csv"), segments_filename,
-        dtypes=dtypes()['segs']
+        dtypes=dtypes()['segs'],
+        write_header=False
     )
 
     csvutils.rewrite_csv_file(
         os.path.join(hmmcopy_outdir, "metrics.csv"), metrics_filename,
-        dtypes=dtypes()['metrics']
+        dtypes=dtypes()['metrics'],
+        write_header=False
     )
 
     helpers.make_tarfile(hmmcopy_tar, hmmcopy_tempdir)
 
 
-def concatenate_csv(inputs, output):
+def run_hmmcopy_batch(
+        bam_files,
+        corrected_reads_filenames,
+        segments_filenames,
+        parameters_filenames,
+        metrics_filenames,
+        hmmcopy_tars,
+        hmmparams,
+        tempdir,
+        reference_cache=None,
+):
+    """
+    run hmmcopy on a group of cells in one job. the exclusion list and
+    the gc and mappability data are loaded once and hmmcopy runs in a single
+    R session for all cells in the batch, or in process with the python engine.
+    """
+    helpers.makedirs(tempdir)
+
+    excluded = None
+    if hmmparams['exclude_list']:
+        excluded = ExcludedRegions(hmmparams['exclude_list'])
+
+    cell_ids = sorted(bam_files.keys())
+
+    corrected_reads = []
+    hmmcopy_tempdirs = []
+    for cell_id in cell_ids:
+        cell_tempdir = os.path.join(tempdir, cell_id)
+        helpers.makedirs(cell_tempdir)
+
+        cell_corrected_reads = os.path.join(cell_tempdir, 'corrected_reads.csv')
+
+        run_correction_hmmcopy(
+            bam_files[cell_id],
+            cell_corrected_reads,
+            os.path.join(cell_tempdir, 'readcounter.wig'),
+            hmmparams,
+            cell_id,
+            excluded=excluded,
+            reference_cache=reference_cache
+        )
+
+        hmmcopy_tempdir = os.path.join(cell_tempdir, '{}_hmmcopy'.format(cell_id))
+        helpers.makedirs(hmmcopy_tempdir)
+
+        corrected_reads.append(cell_corrected_reads)
+        hmmcopy_tempdirs.append(hmmcopy_tempdir)
+
+    if hmmparams['hmmcopy_engine'] == 'python':
+        outputs = [
+            run_hmmcopy_python(reads, hmmcopy_tempdir, cell_id, hmmparams)
+            for reads, hmmcopy_tempdir, cell_id
+            in zip(corrected_reads, hmmcopy_tempdirs, cell_ids)
+        ]
+    else:
+        run_hmmcopy_engine(
+            corrected_reads,
+            hmmcopy_tempdirs,
+            cell_ids,
+            hmmparams
+        )
+        outputs = [None] * len(cell_ids)
+
+    for cell_id, hmmcopy_tempdir, cell_outputs in zip(cell_ids, hmmcopy_tempdirs, outputs):
+        write_hmmcopy_outputs(
+            hmmcopy_tempdir,
+            corrected_reads_filenames[cell_id],
+            segments_filenames[cell_id],
+            parameters_filenames[cell_id],
+            metrics_filenames[cell_id],
+            hmmcopy_tars[cell_id],
+            outputs=cell_outputs
+        )
+
+
+def key_by_cell_id(data):
+    """
+    per cell files from batched runs are keyed by (batch_id, cell_id)
+    """
+    return {
+        key[-1] if isinstance(key, tuple) else key: value
+        for key, value in data.items()
+    }
+
+
+def concatenate_csv(inputs, output, callback=None):
     csvutils.concatenate_csv(
         inputs,
         output,
-        write_header=True
+        write_header=True,
+        callback=callback
     )
 
 
-def get_hierarchical_clustering_order(
-        reads_filename, chromosomes=None):
+def merge_reads(inputs, output, matrix_output):
+    """
+    concatenate the per cell reads and store them as cell by bin matrices
+    in the same pass over the per cell files
+    """
+    with cnmatrixutils.CnMatrixOutput(matrix_output) as matrix:
+        concatenate_csv(inputs, output, callback=matrix.add_df)
+
+
+def read_state_table(reads_filename):
+    if cnmatrixutils.is_cn_matrix(reads_filename):
+        table = cnmatrixutils.read_cn_matrix(reads_filename, 'state')
+        # same as summing the pivoted csv chunks, missing states become 0
+        return table.fillna(0).sort_index()
+
     data = []
     chunksize = 10 ** 5
     for chunk in csvutils.read_csv_and_yaml(
@@ -188,6 +386,13 @@ def get_hierarchical_clustering_order(
     table = pd.concat(data)
     table = table.groupby(table.index).sum()
 
+    return table
+
+
+def get_hierarchical_clustering_order(
+        reads_filename, chromosomes=None):
+    table = read_state_table(reads_filename)
+
     bins = pd.DataFrame(
         table.columns.values.tolist(),
         columns=[
@@ -217,7 +422,7 @@ def get_hierarchical_clustering_order(
     return order
 
 
-def get_mappability_col(reads, annotated_reads):
+def get_mappability_col(reads, annotated_reads, threads=1):
     reads = csvutils.read_csv_and_yaml(reads, chunksize=100)
 
     alldata = []
@@ -228,7 +433,8 @@ def get_mappability_col(reads, annotated_reads):
     alldata = pd.concat(alldata)
 
     csvutils.write_dataframe_to_csv_and_yaml(
-        alldata, annotated_reads, dtypes()['reads'], write_header=True
+        alldata, annotated_reads, dtypes()['reads'], write_header=True,
+        threads=threads
     )
 
 
@@ -288,6 +494,7 @@ def merge_pdf(in_filenames, outfilenames, metrics, cell_filters, tempdir, labels
     )
 
     for infiles, outfiles, label in zip(in_filenames, outfilenames, labels):
+        infiles = key_by_cell_id(infiles)
 
         extension = os.path.splitext(infiles[good_cells[0]])[-1]
 
@@ -330,12 +537,9 @@ def plot_hmmcopy(reads, segments, params, metrics, ref_genome, segs_out,
 
 
 def get_good_cells(metrics, cell_filters):
-    metrics_data = csvutils.read_csv_and_yaml(metrics)
-
-    if not cell_filters:
-        return metrics_data.cell_id.tolist()
-
-    metrics_data = helpers.filter_metrics(metrics_data, cell_filters)
+    metrics_data = csvutils.read_csv_and_yaml(
+        metrics, columns=['cell_id'], filters=cell_filters
+    )
 
     return metrics_data.cell_id.tolist()
 
@@ -427,6 +631,8 @@ def add_quality(hmmcopy_metrics, alignment_metrics, multipliers, output, trainin
 def create_hmmcopy_data_tar(infiles, tar_output, tempdir):
     helpers.makedirs(tempdir)
 
+    infiles = key_by_cell_id(infiles)
+
     for key, infile in infiles.items():
         helpers.extract_tar(infile, os.path.join(tempdir, key))
 
@@ -0,0 +1,149 @@
+import os
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from single_cell.utils import csvutils
+from single_cell.workflows.hmmcopy import get_cell_batches
+from single_cell.workflows.hmmcopy import tasks
+from single_cell.workflows.hmmcopy.dtypes import dtypes
+
+
+def simulate_reads(num_bins=2000, seed=0):
+    rng = np.random.RandomState(seed)
+
+    starts = np.arange(num_bins) * 500000 + 1
+
+    df = pd.DataFrame({
+        'chr': '1',
+        'start': starts,
+        'end': starts + 499999,
+        'width': 500000,
+        'reads': rng.randint(0, 200, num_bins),
+        'gc': rng.uniform(0.3, 0.6, num_bins),
+        'cor_gc': rng.uniform(0, 2, num_bins),
+        'cor_map': rng.uniform(0, 2, num_bins),
+        'copy': rng.uniform(0, 4, num_bins),
+        'map': rng.uniform(0.5, 1, num_bins),
+        'state': rng.randint(0, 6, num_bins).astype(float),
+        'cell_id': 'cell1',
+        'sample_id': 'sample',
+        'library_id': 'library',
+        'valid': True,
+        'ideal': rng.uniform(0, 1, num_bins) > 0.2,
+        'modal_curve': rng.uniform(0, 1, num_bins),
+        'modal_quantile': rng.uniform(0, 1, num_bins),
+        'multiplier': 1,
+    })
+
+    return df
+
+
+def test_get_mappability_col_threads(tmpdir):
+    reads = os.path.join(str(tmpdir), 'reads.csv.gz')
+    annotated = os.path.join(str(tmpdir), 'annotated.csv.gz')
+
+    df = simulate_reads()
+    reads_dtypes = {k: v for k, v in dtypes()['reads'].items() if k != 'is_low_mappability'}
+    csvutils.write_dataframe_to_csv_and_yaml(df, reads, reads_dtypes)
+
+    tasks.get_mappability_col(reads, annotated, threads=2)
+
+    # the annotated reads are recompressed as bgzf blocks
+    with open(annotated, 'rb') as reader:
+        block = reader.read(18)
+    assert block[:4] == b'\x1f\x8b\x08\x04'
+    assert block[12:14] == b'BC'
+
+    data = csvutils.read_csv_and_yaml(annotated)
+
+    assert len(data) == len(df)
+    assert (data['is_low_mappability'] == (df['map'] <= 0.9)).all()
+
+
+def test_get_cell_batches():
+    cell_ids = ['cell{}'.format(i) for i in range(7)]
+
+    batches = get_cell_batches(reversed(cell_ids), 3)
+
+    assert batches == [
+        ('batch0', 'cell0'), ('batch0', 'cell1'), ('batch0', 'cell2'),
+        ('batch1', 'cell3'), ('batch1', 'cell4'), ('batch1', 'cell5'),
+        # last batch holds the remainder
+        ('batch2', 'cell6'),
+    ]
+
+
+def test_get_cell_batches_single_batch():
+    assert get_cell_batches(['b', 'a'], 5) == [('batch0', 'a'), ('batch0', 'b')]
+
+
+def test_key_by_cell_id():
+    data = {('batch0', 'cell0'): 'a.csv', ('batch1', 'cell1'): 'b.csv'}
+
+    assert tasks.key_by_cell_id(data) == {'cell0': 'a.csv', 'cell1': 'b.csv'}
+
+    # unbatched inputs are already keyed by cell
+    assert tasks.key_by_cell_id({'cell0': 'a.csv'}) == {'cell0': 'a.csv'}
+
+
+def test_run_hmmcopy_batch(tmpdir):
+    excluded_file = os.path.join(str(tmpdir), 'excluded.tsv')
+    with open(excluded_file, 'w') as writer:
+        writer.write('chrom\tstart\tend\n1\t0\t100\n')
+
+    cell_ids = ['cell1', 'cell0']
+    hmmparams = {'exclude_list': excluded_file, 'hmmcopy_engine': 'rscript'}
+
+    outputs = {
+        name: {cell_id: '{}_{}'.format(cell_id, name) for cell_id in cell_ids}
+        for name in ['reads', 'segs', 'params', 'metrics', 'tar']
+    }
+
+    with mock.patch.object(tasks, 'run_correction_hmmcopy') as correction, \
+            mock.patch.object(tasks, 'run_hmmcopy_engine') as engine, \
+            mock.patch.object(tasks, 'write_hmmcopy_outputs') as write_outputs:
+        tasks.run_hmmcopy_batch(
+            {cell_id: cell_id + '.bam' for cell_id in cell_ids},
+            outputs['reads'], outputs['segs'], outputs['params'],
+            outputs['metrics'], outputs['tar'], hmmparams,
+            os.path.join(str(tmpdir), 'temp'),
+        )
+
+    # one correction per cell sharing the exclusion list
+    assert [c[0][0] for c in correction.call_args_list] == ['cell0.bam', 'cell1.bam']
+    excluded = {id(c[1]['excluded']) for c in correction.call_args_list}
+    assert len(excluded) == 1
+
+    # hmmcopy runs once for the whole batch
+    assert engine.call_count == 1
+    assert engine.call_args[0][2] == ['cell0', 'cell1']
+
+    assert [c[0][1] for c in write_outputs.call_args_list] == ['cell0_reads', 'cell1_reads']
+    assert [c[0][5] for c in write_outputs.call_args_list] == ['cell0_tar', 'cell1_tar']
+
+
+def test_merge_reads(tmpdir):
+    reads_dtypes = {k: v for k, v in dtypes()['reads'].items() if k != 'is_low_mappability'}
+
+    inputs = {}
+    frames = {}
+    for i in range(3):
+        cell_id = 'cell{}'.format(i)
+        frames[cell_id] = simulate_reads(num_bins=100, seed=i).assign(cell_id=cell_id)
+        inputs[cell_id] = os.path.join(str(tmpdir), cell_id + '.csv.gz')
+        csvutils.write_dataframe_to_csv_and_yaml(
+            frames[cell_id], inputs[cell_id], reads_dtypes, write_header=False
+        )
+
+    output = os.path.join(str(tmpdir), 'reads.csv.gz')
+    matrix_output = os.path.join(str(tmpdir), 'reads.npz')
+
+    tasks.merge_reads(inputs, output, matrix_output)
+
+    assert len(csvutils.read_csv_and_yaml(output)) == 300
+
+    state = tasks.read_state_table(matrix_output)
+
+    for cell_id, df in frames.items():
+        assert (state.loc[cell_id].values == df['state'].values).all()
@@ -33,7 +33,23 @@ def create_merge_bams_workflow(
 
     one_split_job = config["one_split_job"]
 
-    if one_split_job:
+    if config['native_merge']:
+        workflow.transform(
+            name='merge_bams',
+            ctx={'mem': config['memory']['med'], 'ncpus': config['max_cores']},
+            func="single_cell.utils.pysamutils.merge_bams_by_region",
+            args=(
+                mgd.InputFile('bam', 'cell_id', fnames=input_bams, extensions=['.bai']),
+                mgd.OutputFile('merged.bam', "region", fnames=merged_bams, axes_origin=[], extensions=['.bai']),
+                regions,
+                mgd.TempSpace("merge_bams_tempdir")
+            ),
+            kwargs={
+                "ncores": config["max_cores"],
+                "max_open_files": config["max_open_files"],
+            }
+        )
+    elif one_split_job:
         workflow.transform(
             name='merge_bams',
             ctx={'mem': config['memory']['med'], 'ncpus': config['max_cores']},
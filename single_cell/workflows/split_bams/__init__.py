@@ -41,6 +41,24 @@ def create_split_workflow(
                 mgd.TempSpace("bam_split_by_reads"),
                 regions,
             ),
+            kwargs={"ncores": config["max_cores"]}
+        )
+
+    elif config['native_split']:
+        workflow.transform(
+            name='split_normal_bam',
+            ctx={'mem': config['memory']['low'], 'ncpus': config['max_cores']},
+            func="single_cell.utils.pysamutils.split_bam_by_region",
+            args=(
+                mgd.InputFile(normal_bam, extensions=['.bai']),
+                mgd.OutputFile(
+                    "normal.split.bam", "region",
+                    fnames=normal_split_bam, axes_origin=[],
+                    extensions=['.bai'],
+                ),
+                regions,
+            ),
+            kwargs={"ncores": config["max_cores"]}
         )
 
     elif one_split_job:
@@ -3,14 +3,17 @@ Created on Nov 21, 2017
 
 @author: dgrewal
 '''
-import gzip
+from __future__ import division
+
+import math
 import os
+import subprocess
 
+import pypeliner
+import pysam
 from single_cell.utils import bamutils
 from single_cell.utils import helpers
 
-import pypeliner
-
 
 def split_bam_file_one_job(bam, outbam, regions, tempdir, ncores=None):
     commands = []
@@ -36,107 +39,80 @@ def split_bam_file(bam, outbam, interval):
     bamutils.bam_index(outbam, outbai)
 
 
-def split_bam_file_by_reads(bam, outbams, tempspace, intervals):
-    # sort bam by reads and convert to sam
-
+def split_reads_by_name(reads, outputs, chunk_size, header, threads=1):
+    """
+    write reads grouped by name into bams of about chunk_size reads, a
+    read name group is never split across bams. outputs without reads
+    get the header only.
+
+    :param reads: iterator of reads with each name group adjacent
+    :param outputs: list of output bams
+    :param chunk_size: target number of reads per bam
+    :param header: header for the outputs
+    :param threads: compression threads
+    """
+    file_number = 0
+    num_reads = 0
+    last_name = None
+
+    writer = pysam.AlignmentFile(outputs[0], 'wb', header=header, threads=threads)
+
+    for read in reads:
+        if num_reads >= (file_number + 1) * chunk_size and \
+                read.query_name != last_name and file_number < len(outputs) - 1:
+            writer.close()
+            file_number += 1
+            writer = pysam.AlignmentFile(
+                outputs[file_number], 'wb', header=header, threads=threads
+            )
+
+        writer.write(read)
+        num_reads += 1
+        last_name = read.query_name
+
+    writer.close()
+
+    for output in outputs[file_number + 1:]:
+        with pysam.AlignmentFile(output, 'wb', header=header):
+            pass
+
+
+def split_bam_file_by_reads(bam, outbams, tempspace, intervals, ncores=1):
+    """
+    split the bam into one bam per interval with the reads of a read name
+    in the same bam. samtools collate output is streamed straight into the
+    compressed chunks, the chunk size comes from the read counts in the index
+    """
     helpers.makedirs(tempspace)
 
-    headerfile = os.path.join(tempspace, "bam_header.sam")
+    outputs = [outbams[interval] for interval in intervals]
+
+    with pysam.AlignmentFile(bam, 'rb') as reader:
+        header = reader.header.to_dict()
+        num_reads = reader.mapped + reader.unmapped
 
-    cmd = ['samtools', 'view', '-H', bam, '-o', headerfile]
-    pypeliner.commandline.execute(*cmd)
+    chunk_size = max(int(math.ceil(num_reads / len(outputs))), 1)
 
     collate_prefix = os.path.join(
         tempspace, os.path.basename(bam) + "_collate_temp"
     )
-    collated_bam = os.path.join(tempspace, "bam_file_collated_sam_format.sam")
-
-    cmd = [
-        'samtools', 'collate', '-u', '-O', bam, collate_prefix, '|',
-        'samtools', 'view', '-', '-o', collated_bam
-    ]
-
-    pypeliner.commandline.execute(*cmd)
-
-    tempoutputs = [
-        os.path.join(tempspace, os.path.basename(outbams[interval]) + ".split.temp")
-        for interval in intervals
-    ]
-
-    split(collated_bam, tempoutputs, headerfile=headerfile)
-
-    for inputsam, interval in zip(tempoutputs, intervals):
-        outputbam = outbams[interval]
-
-        cmd = ['samtools', 'view', '-Sb', inputsam, '-o', outputbam]
-
-        pypeliner.commandline.execute(*cmd)
-
-
-def get_file_handle(filename, mode="r"):
-    if os.path.splitext(filename)[-1] == ".gz":
-        return gzip.open(filename, mode + "b")
-    else:
-        return open(filename, mode)
-
-
-def get_file_linecount(infile):
-    def blocks(files, size=65536):
-        while True:
-            b = files.read(size)
-            if not b:
-                break
-            yield b
-
-    with get_file_handle(infile, mode="r") as inputdata:
-        numlines = sum(bl.count("\n") for bl in blocks(inputdata))
-
-    return numlines
-
-
-def split(infile, outfiles, headerfile=None):
-    if headerfile:
-        with open(headerfile) as headerdata:
-            header = headerdata.readlines()
-
-    with get_file_handle(infile, mode="r") as inputdata:
-
-        lines_per_file = get_file_linecount(infile) / len(outfiles)
-
-        file_number = 0
-        line_number = 0
-
-        outputfilehandle = get_file_handle(outfiles[file_number], mode='w')
-        if headerfile:
-            outputfilehandle.writelines(header)
-
-        while True:
-            line = inputdata.readline()
-            line_number += 1
-            if not line:
-                break
-
-            outputfilehandle.write(line)
-
-            if line_number > ((file_number + 1) * lines_per_file):
-                # if next line has the same readname as last line in file
-                # then write to the same file else write to next
-                line2 = inputdata.readline()
-                line_number += 1
-                readname2 = line2.split()[0]
-                readname = line.split()[0]
-
-                if readname2 == readname:
-                    outputfilehandle.write(line2)
-
-                outputfilehandle.close()
-                outputfilehandle = open(outfiles[file_number], 'w')
-                if headerfile:
-                    outputfilehandle.writelines(header)
-
-                if not readname2 == readname:
-                    outputfilehandle.write(line2)
-
-                file_number += 1
 
-        outputfilehandle.close()
+    cmd = ['samtools', 'collate', '-u', '-O', bam, collate_prefix]
+    collate = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+
+    completed = False
+    try:
+        with pysam.AlignmentFile(collate.stdout, 'rb') as reader:
+            split_reads_by_name(reader, outputs, chunk_size, header, threads=ncores)
+        completed = True
+    finally:
+        # dont leave collate running or blocked on a full pipe
+        collate.stdout.close()
+        if not completed:
+            collate.terminate()
+        collate.wait()
+
+    if collate.returncode != 0:
+        raise pypeliner.commandline.CommandLineException(
+            cmd, cmd[0], collate.returncode
+        )
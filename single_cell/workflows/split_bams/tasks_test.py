@@ -0,0 +1,131 @@
+import os
+import random
+import shutil
+import subprocess
+from unittest import mock
+
+import pypeliner
+import pysam
+import pytest
+from single_cell.workflows.split_bams.tasks import split_bam_file_by_reads
+from single_cell.workflows.split_bams.tasks import split_reads_by_name
+
+HEADER = {
+    'HD': {'VN': '1.6', 'SO': 'unsorted'},
+    'SQ': [{'SN': '1', 'LN': 100000}],
+}
+
+
+def simulate_collated_reads(n_names, seed=0):
+    rng = random.Random(seed)
+    header = pysam.AlignmentHeader.from_dict(HEADER)
+
+    reads = []
+    for i in range(n_names):
+        # pairs with the odd supplementary or unpaired read
+        for mate in range(rng.choice([1, 2, 2, 2, 3])):
+            read = pysam.AlignedSegment(header)
+            read.query_name = 'read{}'.format(i)
+            read.query_sequence = 'ACGT' * 10
+            read.query_qualities = pysam.qualitystring_to_array('I' * 40)
+            read.reference_id = 0
+            read.reference_start = rng.randint(0, 99000)
+            read.cigarstring = '40M'
+            read.flag = 1 | (64 if mate == 0 else 128) | (2048 if mate == 2 else 0)
+            reads.append(read)
+
+    return reads
+
+
+def read_names(bamfile):
+    with pysam.AlignmentFile(bamfile, 'rb', check_sq=False) as reader:
+        assert reader.header.to_dict()['SQ'] == HEADER['SQ']
+        return [read.query_name for read in reader.fetch(until_eof=True)]
+
+
+def test_split_reads_by_name(tmpdir):
+    reads = simulate_collated_reads(500)
+    outputs = [os.path.join(str(tmpdir), '{}.bam'.format(i)) for i in range(4)]
+
+    chunk_size = -(-len(reads) // len(outputs))
+    split_reads_by_name(iter(reads), outputs, chunk_size, HEADER, threads=2)
+
+    names = [read_names(output) for output in outputs]
+
+    # all reads in order, no name group split across outputs
+    assert sum(names, []) == [read.query_name for read in reads]
+    for idx in range(len(outputs) - 1):
+        assert not set(names[idx]) & set(names[idx + 1])
+
+    for chunk in names[:-1]:
+        assert chunk_size <= len(chunk) < chunk_size + 3
+
+
+def test_split_reads_by_name_few_reads(tmpdir):
+    reads = simulate_collated_reads(2)
+    outputs = [os.path.join(str(tmpdir), '{}.bam'.format(i)) for i in range(5)]
+
+    split_reads_by_name(iter(reads), outputs, 1, HEADER)
+
+    names = [read_names(output) for output in outputs]
+
+    assert sum(names, []) == [read.query_name for read in reads]
+    assert names[2:] == [[], [], []]
+
+
+def write_sorted_bam(bamfile, reads):
+    header = dict(HEADER, HD={'VN': '1.6', 'SO': 'coordinate'})
+
+    with pysam.AlignmentFile(bamfile, 'wb', header=header) as writer:
+        for read in sorted(reads, key=lambda read: read.reference_start):
+            writer.write(read)
+
+    pysam.index(bamfile)
+
+
+@pytest.mark.skipif(shutil.which('samtools') is None, reason='requires samtools')
+def test_split_bam_file_by_reads(tmpdir):
+    tmpdir = str(tmpdir)
+
+    reads = simulate_collated_reads(500)
+    bam = os.path.join(tmpdir, 'input.bam')
+    write_sorted_bam(bam, reads)
+
+    intervals = ['0', '1', '2']
+    outbams = {
+        interval: os.path.join(tmpdir, '{}.bam'.format(interval))
+        for interval in intervals
+    }
+
+    split_bam_file_by_reads(bam, outbams, os.path.join(tmpdir, 'temp'), intervals)
+
+    names = [read_names(outbams[interval]) for interval in intervals]
+
+    assert sorted(sum(names, [])) == sorted(read.query_name for read in reads)
+    for idx in range(len(names)):
+        for other in names[idx + 1:]:
+            assert not set(names[idx]) & set(other)
+    assert all(names)
+
+
+
+def test_split_bam_file_by_reads_collate_error(tmpdir):
+    tmpdir = str(tmpdir)
+
+    bam = os.path.join(tmpdir, 'input.bam')
+    write_sorted_bam(bam, simulate_collated_reads(10))
+
+    outbams = {'0': os.path.join(tmpdir, '0.bam')}
+
+    popen = subprocess.Popen
+
+    def failing_collate(cmd, **kwargs):
+        # streams the input like collate, then fails
+        return popen(['sh', '-c', 'cat "$0"; exit 3', bam], **kwargs)
+
+    with mock.patch.object(subprocess, 'Popen', failing_collate):
+        with pytest.raises(pypeliner.commandline.CommandLineException) as excinfo:
+            split_bam_file_by_reads(bam, outbams, os.path.join(tmpdir, 'temp'), ['0'])
+
+    assert excinfo.value.returncode == 3
+    assert excinfo.value.command == 'samtools'
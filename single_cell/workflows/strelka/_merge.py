@@ -3,37 +3,93 @@ Created on Nov 20, 2015
 
 @author: Andrew Roth
 '''
+import csv
+import heapq
+import itertools
+import os
+import shutil
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
-import csv
 import pysam
 
-from components_utils import flatten_input
+from .components_utils import flatten_input
 
 chrom_map = {'X': 23, 'Y': 24, 'M': 25, 'MT': 25}
 
+VCF_COLUMNS = ['CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO']
+
 
-def merge_vcfs(in_files, out_file):
+def merge_vcfs(in_files, out_file, ncores=1, tempdir=None):
+    """
+    merge the sites of the vcf files, one worker per chromosome when
+    ncores > 1
+
+    :param in_files: tabix indexed vcf files
+    :param out_file: merged sites only vcf
+    :param ncores: number of chromosomes to merge in parallel
+    :param tempdir: directory for the per chromosome part files
+    """
     in_files = flatten_input(in_files)
 
+    reader = MultiVcfReader(in_files)
+    chroms = reader.chroms
+    reader.close()
+
     with open(out_file, 'w') as out_fh:
         write_header(out_fh)
 
-        writer = csv.DictWriter(out_fh, ['CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO'], delimiter='\t')
+        if ncores > 1 and len(chroms) > 1:
+            tempdir = tempdir if tempdir else out_file + '_parts'
+            if not os.path.exists(tempdir):
+                os.makedirs(tempdir)
+
+            part_files = [os.path.join(tempdir, '{}.vcf'.format(i)) for i in range(len(chroms))]
+
+            with ProcessPoolExecutor(max_workers=ncores) as executor:
+                jobs = [
+                    executor.submit(merge_chrom_vcfs, in_files, chrom, part_file)
+                    for chrom, part_file in zip(chroms, part_files)
+                ]
+                for job in jobs:
+                    job.result()
+
+            for part_file in part_files:
+                with open(part_file) as part_fh:
+                    shutil.copyfileobj(part_fh, out_fh)
+                os.remove(part_file)
+        else:
+            write_records(out_fh, in_files, chroms)
+
+
+def merge_chrom_vcfs(in_files, chrom, out_file):
+    """
+    merge the sites of a chromosome into a headerless part file
+    """
+    with open(out_file, 'w') as out_fh:
+        write_records(out_fh, in_files, [chrom])
 
-        reader = MultiVcfReader(in_files)
 
-        for row in reader:
-            writer.writerow({'CHROM': row.chrom,
-                             'POS': row.coord,
-                             'ID': '.',
-                             'REF': row.ref,
-                             'ALT': row.alt,
-                             'QUAL': '.',
-                             'FILTER': '.',
-                             'INFO': '.'})
+def write_records(out_fh, in_files, chroms):
+    writer = csv.writer(out_fh, delimiter='\t')
 
-        reader.close()
+    reader = MultiVcfReader(in_files)
+
+    for chrom in chroms:
+        for row in reader.fetch(chrom):
+            writer.writerow([row.chrom, row.coord, '.', row.ref, row.alt, '.', '.', '.'])
+
+    reader.close()
+
+
+def parse_lines(lines):
+    """
+    position, ref and alt of raw vcf lines, the remaining columns are not
+    parsed
+    """
+    for line in lines:
+        fields = line.split('\t', 5)
+        yield int(fields[1]), fields[3], fields[4]
 
 
 def get_chrom_order(chrom):
@@ -51,18 +107,17 @@ def get_chrom_order(chrom):
         if chrom in chrom_map:
             chrom = chrom_map[chrom]
 
-        else:
-            chrom = chrom
+    # numbered chromosomes before the named contigs
+    if isinstance(chrom, int):
+        return 0, chrom, ''
 
-    return chrom
+    return 1, 0, chrom
 
 
 def write_header(fh):
     fh.write('##fileformat=VCFv4.1\n')
 
-    header = ['CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO']
-
-    header = '\t'.join(header)
+    header = '\t'.join(VCF_COLUMNS)
 
     fh.write('#{0}\n'.format(header))
 
@@ -75,36 +130,30 @@ class MultiVcfReader(object):
         self._readers = []
 
         for file_name in vcf_files:
-            self._readers.append(pysam.Tabixfile(file_name, parser=pysam.asVCF()))
+            self._readers.append(pysam.TabixFile(file_name))
 
     def __iter__(self):
         for chrom in self.chroms:
-            active_iters = self._load_iters(chrom)
-
-            while len(active_iters) > 0:
-                pos_buffer = set()
-
-                min_coord = min([x.record.coord for x in active_iters])
+            for record in self.fetch(chrom):
+                yield record
 
-                new_active_iters = []
-
-                for chrom_iter in active_iters:
-                    while chrom_iter.coord == min_coord:
-                        record = chrom_iter.record
-
-                        # Handles multiple alt alleles.
-                        for alt in record.alt.split(','):
-                            pos_buffer.add(LightVCFRecord(record.chrom, record.coord, record.ref, alt))
-
-                        chrom_iter.buffer_next_record()
+    def fetch(self, chrom):
+        '''
+        Heap merge of the raw lines of the chromosome across readers. Records
+        are collected per position to drop duplicates and sort the alleles.
+        '''
+        records = heapq.merge(*self._load_iters(chrom), key=lambda x: x[0])
 
-                    if chrom_iter.active:
-                        new_active_iters.append(chrom_iter)
+        for coord, pos_records in itertools.groupby(records, key=lambda x: x[0]):
+            pos_buffer = set()
 
-                for record in sorted(pos_buffer, key=lambda x: (get_chrom_order(x.chrom), x.coord, x.ref, x.alt)):
-                    yield record
+            for _, ref, alts in pos_records:
+                # Handles multiple alt alleles.
+                for alt in alts.split(','):
+                    pos_buffer.add((ref, alt))
 
-                active_iters = new_active_iters
+            for ref, alt in sorted(pos_buffer):
+                yield LightVCFRecord(chrom, coord, ref, alt)
 
     def close(self):
         for reader in self._readers:
@@ -126,37 +175,9 @@ class MultiVcfReader(object):
         iters = []
 
         for reader in self._readers:
-            try:
-                chrom_iter = reader.fetch(chrom)
-
-            except (KeyError, ValueError):
+            if chrom not in reader.contigs:
                 continue
 
-            iters.append(BufferedChromIter(chrom_iter))
+            iters.append(parse_lines(reader.fetch(chrom)))
 
         return iters
-
-
-class BufferedChromIter(object):
-
-    def __init__(self, chrom_iter):
-        self._iter = chrom_iter
-
-        self.active = True
-
-        self.buffer_next_record()
-
-    def buffer_next_record(self):
-        try:
-            record = self._iter.next()
-
-            self.record = LightVCFRecord(record.contig, record.pos + 1, record.ref, record.alt)
-
-            self.coord = self.record.coord
-
-        except StopIteration:
-            self.active = False
-
-            self.record = None
-
-            self.coord = None
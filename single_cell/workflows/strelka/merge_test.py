@@ -0,0 +1,66 @@
+import os
+import random
+
+import pysam
+import pytest
+from single_cell.workflows.strelka import _merge
+
+CHROMS = ['1', '2', '10', 'X', 'GL000192.1']
+
+
+def simulate_vcf(vcf_file, seed):
+    rng = random.Random(seed)
+
+    records = []
+    for chrom in rng.sample(CHROMS, 3):
+        for _ in range(200):
+            ref = rng.choice('ACGT')
+            alt = ','.join(rng.sample([b for b in 'ACGT' if b != ref], rng.choice([1, 1, 2])))
+            records.append((chrom, rng.randint(1, 2000), ref, alt))
+
+    records.sort(key=lambda x: (CHROMS.index(x[0]), x[1]))
+
+    with open(vcf_file, 'w') as writer:
+        writer.write('##fileformat=VCFv4.1\n')
+        writer.write('#' + '\t'.join(_merge.VCF_COLUMNS) + '\n')
+        for chrom, pos, ref, alt in records:
+            writer.write('\t'.join([chrom, str(pos), '.', ref, alt, '10', 'PASS', 'DP=10']) + '\n')
+
+    pysam.tabix_index(vcf_file, preset='vcf', force=True)
+
+    return records
+
+
+def read_records(vcf_file):
+    with open(vcf_file) as reader:
+        lines = [line.rstrip('\r\n').split('\t') for line in reader if not line.startswith('#')]
+
+    return [(line[0], int(line[1]), line[3], line[4]) for line in lines]
+
+
+@pytest.fixture
+def vcf_files(tmpdir):
+    vcf_files = []
+    records = set()
+    for i in range(4):
+        vcf_file = os.path.join(str(tmpdir), '{}.vcf'.format(i))
+        for chrom, pos, ref, alt in simulate_vcf(vcf_file, i):
+            records.update((chrom, pos, ref, allele) for allele in alt.split(','))
+        vcf_files.append(vcf_file + '.gz')
+
+    expected = sorted(records, key=lambda x: (CHROMS.index(x[0]), x[1], x[2], x[3]))
+
+    return vcf_files, expected
+
+
+@pytest.mark.parametrize('ncores', [1, 3])
+def test_merge_vcfs(tmpdir, vcf_files, ncores):
+    vcf_files, expected = vcf_files
+    merged = os.path.join(str(tmpdir), 'merged.vcf')
+
+    _merge.merge_vcfs(vcf_files, merged, ncores=ncores, tempdir=os.path.join(str(tmpdir), 'parts'))
+
+    assert read_records(merged) == expected
+
+    with open(merged) as reader:
+        assert reader.readline() == '##fileformat=VCFv4.1\n'
@@ -164,74 +164,90 @@ def filter_snv_file_list(
 
     max_normal_coverage = _get_max_normal_coverage(chrom, depth_filter_multiple, known_chrom_size, stats_files)
 
-    writer = None
+    header = None
 
     with open(out_file, 'wt') as out_fh:
         for key in sorted(in_files):
-            reader = vcf.Reader(filename=in_files[key])
+            file_header, records = _read_vcf(in_files[key])
 
-            if writer is None:
+            if header is None:
                 # Add filters to header
+                filters = []
+
                 if use_depth_filter:
-                    reader.filters[FILTER_ID_DEPTH] = vcf.parser._Filter(
-                        id=FILTER_ID_DEPTH,
-                        desc='Greater than {0}x chromosomal mean depth in Normal sample'.format(depth_filter_multiple)
-                    )
-
-                reader.filters[FILTER_ID_BASE] = vcf.parser._Filter(
-                    id=FILTER_ID_BASE,
-                    desc='Fraction of basecalls filtered at this site in either sample is at or above {0}'.format(
+                    filters.append(_filter_header_line(
+                        FILTER_ID_DEPTH,
+                        'Greater than {0}x chromosomal mean depth in Normal sample'.format(depth_filter_multiple)
+                    ))
+
+                filters.append(_filter_header_line(
+                    FILTER_ID_BASE,
+                    'Fraction of basecalls filtered at this site in either sample is at or above {0}'.format(
                         max_filtered_basecall_frac)
-                )
+                ))
 
-                reader.filters[FILTER_ID_SPANNING_DELETION] = vcf.parser._Filter(
-                    id=FILTER_ID_SPANNING_DELETION,
-                    desc='Fraction of reads crossing site with spanning deletions in either sample exceeeds {0}'.format(
+                filters.append(_filter_header_line(
+                    FILTER_ID_SPANNING_DELETION,
+                    'Fraction of reads crossing site with spanning deletions in either sample exceeeds {0}'.format(
                         max_spanning_deletion_frac)
-                )
+                ))
 
-                reader.filters[FILTER_ID_QSS] = vcf.parser._Filter(
-                    id=FILTER_ID_QSS,
-                    desc='Normal sample is not homozygous ref or ssnv Q-score < {0}, ie calls with NT!=ref or QSS_NT < {0}'.format(
+                filters.append(_filter_header_line(
+                    FILTER_ID_QSS,
+                    'Normal sample is not homozygous ref or ssnv Q-score < {0}, ie calls with NT!=ref or QSS_NT < {0}'.format(
                         quality_lower_bound)
-                )
+                ))
+
+                header = _add_header_lines(file_header, 'FILTER', filters)
+
+                out_fh.write(''.join(header))
 
-                writer = vcf.Writer(out_fh, reader)
+            normal_dp = _get_format_field(records, 'NORMAL', 'DP')
+            normal_fdp = _get_format_field(records, 'NORMAL', 'FDP')
+            normal_sdp = _get_format_field(records, 'NORMAL', 'SDP')
 
-            for record in reader:
-                normal = record.genotype('NORMAL')
+            tumour_dp = _get_format_field(records, 'TUMOR', 'DP')
+            tumour_fdp = _get_format_field(records, 'TUMOR', 'FDP')
+            tumour_sdp = _get_format_field(records, 'TUMOR', 'SDP')
 
-                tumour = record.genotype('TUMOR')
+            filters = []
 
-                # Normal depth filter
-                if use_depth_filter and (normal.data.DP > max_normal_coverage):
-                    record.add_filter(FILTER_ID_DEPTH)
+            # Normal depth filter
+            if use_depth_filter:
+                filters.append((FILTER_ID_DEPTH, normal_dp > max_normal_coverage))
 
-                # Filtered basecall fraction
-                normal_filtered_base_call_fraction = _get_filtered_base_call_fraction(normal.data)
+            # Filtered basecall fraction
+            normal_filtered_base_call_fraction = _get_filtered_base_call_fraction(normal_dp, normal_fdp)
 
-                tumour_filtered_base_call_fraction = _get_filtered_base_call_fraction(tumour.data)
+            tumour_filtered_base_call_fraction = _get_filtered_base_call_fraction(tumour_dp, tumour_fdp)
 
-                if (normal_filtered_base_call_fraction >= max_filtered_basecall_frac) or \
-                        (tumour_filtered_base_call_fraction >= max_filtered_basecall_frac):
-                    record.add_filter(FILTER_ID_BASE)
+            filters.append((
+                FILTER_ID_BASE,
+                (normal_filtered_base_call_fraction >= max_filtered_basecall_frac) |
+                (tumour_filtered_base_call_fraction >= max_filtered_basecall_frac)
+            ))
 
-                # Spanning deletion fraction
-                normal_spanning_deletion_fraction = _get_spanning_deletion_fraction(normal.data)
+            # Spanning deletion fraction
+            normal_spanning_deletion_fraction = _get_spanning_deletion_fraction(normal_dp, normal_sdp)
 
-                tumour_spanning_deletion_fraction = _get_spanning_deletion_fraction(tumour.data)
+            tumour_spanning_deletion_fraction = _get_spanning_deletion_fraction(tumour_dp, tumour_sdp)
 
-                if (normal_spanning_deletion_fraction > max_spanning_deletion_frac) or \
-                        (tumour_spanning_deletion_fraction > max_spanning_deletion_frac):
-                    record.add_filter(FILTER_ID_SPANNING_DELETION)
+            filters.append((
+                FILTER_ID_SPANNING_DELETION,
+                (normal_spanning_deletion_fraction > max_spanning_deletion_frac) |
+                (tumour_spanning_deletion_fraction > max_spanning_deletion_frac)
+            ))
 
-                # Q-val filter
-                if (record.INFO['NT'] != 'ref') or (record.INFO['QSS_NT'] < quality_lower_bound):
-                    record.add_filter(FILTER_ID_QSS)
+            # Q-val filter
+            filters.append((
+                FILTER_ID_QSS,
+                (_get_info_field(records, 'NT') != 'ref') |
+                (pd.to_numeric(_get_info_field(records, 'QSS_NT')) < quality_lower_bound)
+            ))
 
-                writer.write_record(record)
+            _add_filters(records, filters)
 
-        writer.close()
+            _write_records(out_fh, records)
 
 
 def _get_max_normal_coverage(chrom, depth_filter_multiple, known_chrom_size, stats_files):
@@ -267,24 +283,158 @@ def _get_normal_coverage(stats_files):
     return total_coverage
 
 
-def _get_filtered_base_call_fraction(data):
-    frac = 0
+def _get_filtered_base_call_fraction(dp, fdp):
+    return (fdp / dp).where(dp > 0, 0)
+
+
+def _get_spanning_deletion_fraction(dp, sdp):
+    total = dp + sdp
+
+    return (sdp / total).where(total > 0, 0)
+
+
+# =======================================================================================================================
+# Columnar vcf records
+# =======================================================================================================================
+
+
+def _read_vcf(filename):
+    '''
+    Read the header lines and the records of a vcf. Records are kept as
+    strings so the columns that are not filtered on are written back as is.
+    '''
+    header = []
+
+    with open(filename) as reader:
+        for line in reader:
+            header.append(line)
+
+            if line.startswith('#CHROM'):
+                break
+
+        columns = header[-1].lstrip('#').rstrip('\n').split('\t')
+
+        records = pd.read_csv(
+            reader, sep='\t', header=None, names=columns, dtype=str,
+            keep_default_na=False, quoting=csv.QUOTE_NONE
+        )
+
+    return header, records
 
-    if data.DP > 0:
-        frac = data.FDP / data.DP
 
-    return frac
+def _write_records(out_fh, records):
+    if records.empty:
+        return
 
+    columns = records.columns
+
+    lines = records[columns[0]].str.cat([records[col] for col in columns[1:]], sep='\t')
+
+    out_fh.write('\n'.join(lines) + '\n')
+
+
+def _filter_header_line(filter_id, desc):
+    return '##FILTER=<ID={0},Description="{1}">\n'.format(filter_id, desc)
+
+
+def _format_header_line(format_id, num, format_type, desc):
+    return '##FORMAT=<ID={0},Number={1},Type={2},Description="{3}">\n'.format(format_id, num, format_type, desc)
+
+
+def _get_header_line_id(line):
+    return re.match('##[^=]+=<ID=([^,>]*)', line).group(1)
+
+
+def _add_header_lines(header, key, lines):
+    '''
+    Replace the ##key= lines with the same ID in place, the other lines are
+    inserted after the last ##key= line of the header, or before the
+    column header if there are none.
+    '''
+    prefix = '##{0}='.format(key)
+
+    header = list(header)
+
+    new_lines = []
+
+    for line in lines:
+        line_id = _get_header_line_id(line)
+
+        matches = [
+            i for i, header_line in enumerate(header)
+            if header_line.startswith(prefix) and _get_header_line_id(header_line) == line_id
+        ]
+
+        if matches:
+            header[matches[0]] = line
+        else:
+            new_lines.append(line)
 
-def _get_spanning_deletion_fraction(data):
-    total = data.DP + data.SDP
+    matches = [i for i, line in enumerate(header) if line.startswith(prefix)]
 
-    frac = 0
+    idx = matches[-1] + 1 if matches else len(header) - 1
 
-    if total > 0:
-        frac = data.SDP / total
+    return header[:idx] + new_lines + header[idx:]
 
-    return frac
+
+def _get_info_field(records, key):
+    '''
+    Value of an INFO field per record, NaN where the field is missing.
+    '''
+    return records['INFO'].str.extract('(?:^|;){0}=([^;]*)'.format(re.escape(key)), expand=False)
+
+
+def _get_format_field(records, sample, key):
+    '''
+    Numeric value of a FORMAT field of the sample per record. Records are
+    split in groups sharing the same FORMAT column.
+    '''
+    values = pd.Series(float('nan'), index=records.index)
+
+    for fmt, rows in records.groupby('FORMAT').groups.items():
+        keys = fmt.split(':')
+
+        if key not in keys:
+            continue
+
+        sample_data = records.loc[rows, sample].str.split(':', expand=True)
+
+        values[rows] = pd.to_numeric(sample_data[keys.index(key)], errors='coerce')
+
+    return values
+
+
+def _add_format_field(records, key, sample_values):
+    '''
+    Append a FORMAT field with the given values per sample to every record.
+    '''
+    records['FORMAT'] = records['FORMAT'] + ':' + key
+
+    for sample, values in sample_values.items():
+        records[sample] = records[sample] + ':' + values.astype(str)
+
+
+def _add_filters(records, filters):
+    '''
+    Rewrite the FILTER column with the failed filters appended, records
+    that fail none of them are left as is.
+
+    :param records: vcf records
+    :param filters: list of (filter id, boolean mask of the failing records)
+    '''
+    added = pd.Series('', index=records.index)
+
+    for filter_id, mask in filters:
+        added = added.where(~mask.values, added + ';' + filter_id)
+
+    added = added.str.lstrip(';')
+
+    # PASS and missing filters are replaced by the failed filters
+    existing = records['FILTER'].where(~records['FILTER'].isin(['PASS', '.']), '')
+
+    filtered = (existing + ';' + added).str.strip(';')
+
+    records['FILTER'] = filtered.where(added != '', records['FILTER'])
 
 
 # =======================================================================================================================
@@ -325,7 +475,7 @@ def filter_indel_file_list(
 
     max_normal_coverage = _get_max_normal_coverage(chrom, depth_filter_multiple, known_chrom_size, stats_files)
 
-    writer = None
+    header = None
 
     with open(out_file, 'wt') as out_fh:
         for key in sorted(vcf_files):
@@ -337,150 +487,125 @@ def filter_indel_file_list(
                 names=window_cols,
                 sep='\t')
 
-            reader = vcf.Reader(filename=vcf_files[key])
+            file_header, records = _read_vcf(vcf_files[key])
 
-            if writer is None:
+            if header is None:
                 # Add format to header
-                reader.formats['DP50'] = vcf.parser._Format(
-                    id='DP50',
-                    num=1,
-                    type='Float',
-                    desc='Average tier1 read depth within 50 bases'
-                )
-
-                reader.formats['FDP50'] = vcf.parser._Format(
-                    id='FDP50',
-                    num=1,
-                    type='Float',
-                    desc='Average tier1 number of basecalls filtered from original read depth within 50 bases'
-                )
-
-                reader.formats['SUBDP50'] = vcf.parser._Format(
-                    id='SUBDP50',
-                    num=1,
-                    type='Float',
-                    desc='Average number of reads below tier1 mapping quality threshold aligned across sites within 50 bases'
-                )
+                formats = [
+                    _format_header_line(
+                        'DP50', 1, 'Float',
+                        'Average tier1 read depth within 50 bases'
+                    ),
+                    _format_header_line(
+                        'FDP50', 1, 'Float',
+                        'Average tier1 number of basecalls filtered from original read depth within 50 bases'
+                    ),
+                    _format_header_line(
+                        'SUBDP50', 1, 'Float',
+                        'Average number of reads below tier1 mapping quality threshold aligned across sites within 50 bases'
+                    ),
+                ]
 
                 # Add filters to header
+                filters = []
+
                 if use_depth_filter:
-                    reader.filters[FILTER_ID_DEPTH] = vcf.parser._Filter(
-                        id=FILTER_ID_DEPTH,
-                        desc='Greater than {0}x chromosomal mean depth in Normal sample'.format(depth_filter_multiple)
-                    )
-
-                reader.filters[FILTER_ID_REPEAT] = vcf.parser._Filter(
-                    id=FILTER_ID_REPEAT,
-                    desc='Sequence repeat of more than {0}x in the reference sequence'.format(max_ref_repeat)
-                )
-
-                reader.filters[FILTER_ID_INDEL_HPOL] = vcf.parser._Filter(
-                    id=FILTER_ID_INDEL_HPOL,
-                    desc='Indel overlaps an interrupted homopolymer longer than {0}x in the reference sequence'.format(
+                    filters.append(_filter_header_line(
+                        FILTER_ID_DEPTH,
+                        'Greater than {0}x chromosomal mean depth in Normal sample'.format(depth_filter_multiple)
+                    ))
+
+                filters.append(_filter_header_line(
+                    FILTER_ID_REPEAT,
+                    'Sequence repeat of more than {0}x in the reference sequence'.format(max_ref_repeat)
+                ))
+
+                filters.append(_filter_header_line(
+                    FILTER_ID_INDEL_HPOL,
+                    'Indel overlaps an interrupted homopolymer longer than {0}x in the reference sequence'.format(
                         max_int_hpol_length)
-                )
+                ))
 
-                reader.filters[FILTER_ID_BASE] = vcf.parser._Filter(
-                    id=FILTER_ID_BASE,
-                    desc='Average fraction of filtered basecalls within 50 bases of the indel exceeds {0}'.format(
+                filters.append(_filter_header_line(
+                    FILTER_ID_BASE,
+                    'Average fraction of filtered basecalls within 50 bases of the indel exceeds {0}'.format(
                         max_window_filtered_basecall_frac)
-                )
+                ))
 
-                reader.filters[FILTER_ID_QSI] = vcf.parser._Filter(
-                    id=FILTER_ID_QSI,
-                    desc='Normal sample is not homozygous ref or sindel Q-score < {0}, ie calls with NT!=ref or QSI_NT < {0}'.format(
+                filters.append(_filter_header_line(
+                    FILTER_ID_QSI,
+                    'Normal sample is not homozygous ref or sindel Q-score < {0}, ie calls with NT!=ref or QSI_NT < {0}'.format(
                         quality_lower_bound)
-                )
-
-                writer = vcf.Writer(out_fh, reader)
-
-            for record in reader:
-                window_row = window.loc[
-                    (window['chrom'] == str(record.CHROM)) & (window['coord'] == record.POS)].iloc[0]
-
-                normal = record.genotype('NORMAL')
-
-                tumour = record.genotype('TUMOR')
-
-                normal_data = normal.data._asdict()
-
-                tumour_data = tumour.data._asdict()
-
-                # Add window data to vcf record
-                record.add_format('DP50')
-
-                record.add_format('FDP50')
-
-                record.add_format('SUBDP50')
-
-                normal_data['DP50'] = window_row['normal_window_used'] + window_row['normal_window_filtered']
-
-                normal_data['FDP50'] = window_row['normal_window_filtered']
-
-                normal_data['SUBDP50'] = window_row['normal_window_submap']
+                ))
 
-                tumour_data['DP50'] = window_row['tumour_window_used'] + window_row['tumour_window_filtered']
+                header = _add_header_lines(file_header, 'FILTER', filters)
 
-                tumour_data['FDP50'] = window_row['tumour_window_filtered']
+                header = _add_header_lines(header, 'FORMAT', formats)
 
-                tumour_data['SUBDP50'] = window_row['tumour_window_submap']
+                out_fh.write(''.join(header))
 
-                normal.data = _convert_dict_to_call(normal_data)
+            # window data of the record, first row for each site
+            window = window.drop_duplicates(['chrom', 'coord'])
 
-                tumour.data = _convert_dict_to_call(tumour_data)
+            sites = pd.DataFrame({'chrom': records['CHROM'], 'coord': records['POS'].astype(int)})
 
-                # Add filters
+            window = sites.merge(window, on=['chrom', 'coord'], how='left', validate='many_to_one')
 
-                # Normal depth filter
-                if use_depth_filter and (normal.data.DP > max_normal_coverage):
-                    record.add_filter(FILTER_ID_DEPTH)
+            if window['normal_window_used'].isnull().any():
+                raise Exception('indel sites missing from window file {}'.format(window_files[key]))
 
-                # Ref repeat
-                if 'RC' in record.INFO:
-                    ref_repeat = record.INFO['RC']
+            normal_dp50 = window['normal_window_used'] + window['normal_window_filtered']
 
-                    if ref_repeat > max_ref_repeat:
-                        record.add_filter(FILTER_ID_REPEAT)
+            normal_fdp50 = window['normal_window_filtered']
 
-                # Indel homopolymer
-                if 'IHP' in record.INFO:
-                    indel_homopolymer = record.INFO['IHP']
+            tumour_dp50 = window['tumour_window_used'] + window['tumour_window_filtered']
 
-                    if indel_homopolymer > max_int_hpol_length:
-                        record.add_filter(FILTER_ID_INDEL_HPOL)
+            tumour_fdp50 = window['tumour_window_filtered']
 
-                # Base filter
-                normal_filtered_base_call_fraction = _get_filtered_base_call_fraction_indel(normal.data)
+            # Add window data to vcf record
+            _add_format_field(records, 'DP50', {'NORMAL': normal_dp50, 'TUMOR': tumour_dp50})
 
-                tumour_filtered_base_call_fraction = _get_filtered_base_call_fraction_indel(tumour.data)
+            _add_format_field(records, 'FDP50', {'NORMAL': normal_fdp50, 'TUMOR': tumour_fdp50})
 
-                if (normal_filtered_base_call_fraction >= max_window_filtered_basecall_frac) or \
-                        (tumour_filtered_base_call_fraction >= max_window_filtered_basecall_frac):
-                    record.add_filter(FILTER_ID_BASE)
+            _add_format_field(
+                records, 'SUBDP50',
+                {'NORMAL': window['normal_window_submap'], 'TUMOR': window['tumour_window_submap']}
+            )
 
-                # Q-val filter
-                if (record.INFO['NT'] != 'ref') or (record.INFO['QSI_NT'] < quality_lower_bound):
-                    record.add_filter(FILTER_ID_QSI)
+            # Add filters
+            filters = []
 
-                writer.write_record(record)
+            # Normal depth filter
+            if use_depth_filter:
+                filters.append((FILTER_ID_DEPTH, _get_format_field(records, 'NORMAL', 'DP') > max_normal_coverage))
 
-        if writer:
-            writer.close()
+            # Ref repeat
+            filters.append((FILTER_ID_REPEAT, pd.to_numeric(_get_info_field(records, 'RC')) > max_ref_repeat))
 
+            # Indel homopolymer
+            filters.append((FILTER_ID_INDEL_HPOL, pd.to_numeric(_get_info_field(records, 'IHP')) > max_int_hpol_length))
 
-def _convert_dict_to_call(data_dict):
-    call_data_class = vcf.model.make_calldata_tuple(data_dict.keys())
+            # Base filter
+            normal_filtered_base_call_fraction = _get_filtered_base_call_fraction(normal_dp50, normal_fdp50)
 
-    return call_data_class(**data_dict)
+            tumour_filtered_base_call_fraction = _get_filtered_base_call_fraction(tumour_dp50, tumour_fdp50)
 
+            filters.append((
+                FILTER_ID_BASE,
+                (normal_filtered_base_call_fraction >= max_window_filtered_basecall_frac) |
+                (tumour_filtered_base_call_fraction >= max_window_filtered_basecall_frac)
+            ))
 
-def _get_filtered_base_call_fraction_indel(data):
-    frac = 0
+            # Q-val filter
+            filters.append((
+                FILTER_ID_QSI,
+                (_get_info_field(records, 'NT') != 'ref') |
+                (pd.to_numeric(_get_info_field(records, 'QSI_NT')) < quality_lower_bound)
+            ))
 
-    if data.DP50 > 0:
-        frac = data.FDP50 / data.DP50
+            _add_filters(records, filters)
 
-    return frac
+            _write_records(out_fh, records)
 
 
 # =======================================================================================================================
@@ -0,0 +1,209 @@
+import os
+import random
+
+import pytest
+from single_cell.workflows.strelka import tasks
+
+HEADER = [
+    '##fileformat=VCFv4.1\n',
+    '##source=strelka\n',
+    '##INFO=<ID=QSS_NT,Number=1,Type=Integer,Description="Quality score">\n',
+    '##FILTER=<ID=QSS_ref,Description="old filter">\n',
+    '##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">\n',
+    '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNORMAL\tTUMOR\n',
+]
+
+INTERVALS = ['1-1-5000', '1-5001-10000']
+
+
+def write_stats(stats_file, mean):
+    with open(stats_file, 'w') as writer:
+        writer.write('NORMAL_NO_REF_N_COVERAGE sample_size: 5000 min: 0 max: 100 mean: {} sd: 1 \n'.format(mean))
+
+
+def write_vcf(vcf_file, records):
+    with open(vcf_file, 'w') as writer:
+        writer.write(''.join(HEADER))
+        for record in records:
+            writer.write('\t'.join(map(str, record)) + '\n')
+
+
+def simulate_snvs(rng, start, n_records):
+    records = []
+    for pos in sorted(rng.sample(range(start, start + 5000), n_records)):
+        nt = rng.choice(['ref', 'ref', 'het'])
+        info = 'SOMATIC;QSS={0};TQSS=1;NT={1};QSS_NT={0};TQSS_NT=1;SGT=CC->CT'.format(rng.randint(0, 40), nt)
+        samples = []
+        for _ in range(2):
+            dp = rng.choice([0, rng.randint(1, 60)])
+            samples.append('{}:{}:{}:0:0,0:{},{}:0,0:0,0'.format(
+                dp, rng.randint(0, 20), rng.randint(0, 20), dp, dp))
+        records.append(['1', pos, '.', 'C', 'T', '.', rng.choice(['PASS', '.']), info,
+                        'DP:FDP:SDP:SUBDP:AU:CU:GU:TU'] + samples)
+    return records
+
+
+def simulate_indels(rng, start, n_records):
+    records = []
+    windows = []
+    for pos in sorted(rng.sample(range(start, start + 5000), n_records)):
+        info = 'IC=1;IHP={};NT={};QSI=1;QSI_NT={};RC={};RU=A;SGT=ref->het;SOMATIC;TQSI=1;TQSI_NT=1'.format(
+            rng.randint(0, 20), rng.choice(['ref', 'ref', 'het']), rng.randint(0, 60), rng.randint(0, 12))
+        samples = ['{}:{}:0,0:0,0:0,0'.format(rng.randint(0, 60), rng.randint(0, 60)) for _ in range(2)]
+        records.append(['1', pos, '.', 'CA', 'C', '.', 'PASS', info, 'DP:DP2:TAR:TIR:TOR'] + samples)
+        windows.append(['1', pos] + [round(rng.uniform(0, 30), 2) for _ in range(6)])
+    return records, windows
+
+
+def expected_snv_filter(record, max_normal_coverage):
+    info = dict(field.split('=') for field in record[7].split(';') if '=' in field)
+    normal, tumour = [dict(zip(record[8].split(':'), map(float, sample.split(':')[:3]))) for sample in record[9:]]
+
+    filters = []
+    if normal['DP'] > max_normal_coverage:
+        filters.append('DP')
+    if any(data['DP'] > 0 and data['FDP'] / data['DP'] >= 0.4 for data in (normal, tumour)):
+        filters.append('BCNoise')
+    if any(data['DP'] + data['SDP'] > 0 and data['SDP'] / (data['DP'] + data['SDP']) > 0.75
+           for data in (normal, tumour)):
+        filters.append('SpanDel')
+    if info['NT'] != 'ref' or int(info['QSS_NT']) < 15:
+        filters.append('QSS_ref')
+
+    return ';'.join(filters) if filters else record[6]
+
+
+def expected_indel_filter(record, window, max_normal_coverage):
+    info = dict(field.split('=') for field in record[7].split(';') if '=' in field)
+    normal_dp = float(record[9].split(':')[0])
+
+    filters = []
+    if normal_dp > max_normal_coverage:
+        filters.append('DP')
+    if int(info['RC']) > 8:
+        filters.append('Repeat')
+    if int(info['IHP']) > 14:
+        filters.append('iHpol')
+    dp50 = [window[2] + window[3], window[5] + window[6]]
+    fdp50 = [window[3], window[6]]
+    if any(dp > 0 and fdp / dp >= 0.3 for dp, fdp in zip(dp50, fdp50)):
+        filters.append('BCNoise')
+    if info['NT'] != 'ref' or int(info['QSI_NT']) < 30:
+        filters.append('QSI_ref')
+
+    return ';'.join(filters) if filters else record[6]
+
+
+def read_vcf(vcf_file):
+    with open(vcf_file) as reader:
+        lines = reader.readlines()
+
+    header = [line for line in lines if line.startswith('#')]
+    records = [line.rstrip('\n').split('\t') for line in lines if not line.startswith('#')]
+
+    return header, records
+
+
+@pytest.mark.parametrize('use_depth_filter', [True, False])
+def test_filter_snv_file_list(tmpdir, use_depth_filter):
+    rng = random.Random(0)
+
+    vcf_files = {}
+    stats_files = {}
+    records = []
+    for i, interval in enumerate(INTERVALS):
+        vcf_files[interval] = os.path.join(str(tmpdir), '{}.vcf'.format(interval))
+        stats_files[interval] = os.path.join(str(tmpdir), '{}.stats'.format(interval))
+        interval_records = simulate_snvs(rng, 1 + i * 5000, 300)
+        write_vcf(vcf_files[interval], interval_records)
+        write_stats(stats_files[interval], 10)
+        records.extend(interval_records)
+
+    out_file = os.path.join(str(tmpdir), 'filtered.vcf')
+
+    tasks.filter_snv_file_list(
+        vcf_files, stats_files, out_file, '1', {'1': 10000}, INTERVALS,
+        use_depth_filter=use_depth_filter
+    )
+
+    header, filtered = read_vcf(out_file)
+
+    max_normal_coverage = 30 if use_depth_filter else float('inf')
+
+    assert len(filtered) == len(records)
+    for record, filtered_record in zip(records, filtered):
+        record = list(map(str, record))
+        assert filtered_record[6] == expected_snv_filter(record, max_normal_coverage)
+        assert filtered_record[:6] + filtered_record[7:] == record[:6] + record[7:]
+
+    # filters already in the header are replaced in place
+    filter_lines = [line for line in header if line.startswith('##FILTER')]
+    expected_ids = ['QSS_ref', 'DP', 'BCNoise', 'SpanDel'] if use_depth_filter else \
+        ['QSS_ref', 'BCNoise', 'SpanDel']
+    assert [line.split(',')[0] for line in filter_lines] == \
+        ['##FILTER=<ID=' + filter_id for filter_id in expected_ids]
+    assert 'QSS_NT < 15' in filter_lines[0]
+    assert header[-1] == HEADER[-1]
+
+
+def test_filter_indel_file_list(tmpdir):
+    rng = random.Random(1)
+
+    vcf_files = {}
+    stats_files = {}
+    window_files = {}
+    records = []
+    windows = []
+    for i, interval in enumerate(INTERVALS):
+        vcf_files[interval] = os.path.join(str(tmpdir), '{}.vcf'.format(interval))
+        stats_files[interval] = os.path.join(str(tmpdir), '{}.stats'.format(interval))
+        window_files[interval] = os.path.join(str(tmpdir), '{}.window'.format(interval))
+        interval_records, interval_windows = simulate_indels(rng, 1 + i * 5000, 300)
+        write_vcf(vcf_files[interval], interval_records)
+        write_stats(stats_files[interval], 10)
+        with open(window_files[interval], 'w') as writer:
+            for window in interval_windows:
+                writer.write('\t'.join(map(str, window)) + '\n')
+        records.extend(interval_records)
+        windows.extend(interval_windows)
+
+    out_file = os.path.join(str(tmpdir), 'filtered.vcf')
+
+    tasks.filter_indel_file_list(
+        vcf_files, stats_files, window_files, out_file, '1', {'1': 10000}, INTERVALS,
+    )
+
+    header, filtered = read_vcf(out_file)
+
+    assert len(filtered) == len(records)
+    for record, window, filtered_record in zip(records, windows, filtered):
+        record = list(map(str, record))
+        assert filtered_record[6] == expected_indel_filter(record, window, 30)
+        assert filtered_record[:6] + filtered_record[7:8] == record[:6] + record[7:8]
+        assert filtered_record[8] == record[8] + ':DP50:FDP50:SUBDP50'
+        assert filtered_record[9] == record[9] + ':{}:{}:{}'.format(window[2] + window[3], window[3], window[4])
+        assert filtered_record[10] == record[10] + ':{}:{}:{}'.format(window[5] + window[6], window[6], window[7])
+
+    format_ids = [line.split(',')[0] for line in header if line.startswith('##FORMAT')]
+    assert format_ids == ['##FORMAT=<ID=DP', '##FORMAT=<ID=DP50', '##FORMAT=<ID=FDP50', '##FORMAT=<ID=SUBDP50']
+
+    filter_ids = [line.split(',')[0] for line in header if line.startswith('##FILTER')]
+    assert len(filter_ids) == len(set(filter_ids))
+
+
+def test_filter_snv_file_list_no_records(tmpdir):
+    vcf_file = os.path.join(str(tmpdir), 'empty.vcf')
+    stats_file = os.path.join(str(tmpdir), 'empty.stats')
+    write_vcf(vcf_file, [])
+    write_stats(stats_file, 10)
+
+    out_file = os.path.join(str(tmpdir), 'filtered.vcf')
+
+    tasks.filter_snv_file_list(
+        {INTERVALS[0]: vcf_file}, {INTERVALS[0]: stats_file}, out_file, '1', {'1': 10000}, INTERVALS[:1]
+    )
+
+    header, filtered = read_vcf(out_file)
+
+    assert filtered == []
+    assert header[-1] == HEADER[-1]